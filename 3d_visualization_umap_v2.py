@@ -7,6 +7,8 @@ import plotly.express as px
 import plotly.io as pio
 from plotly.colors import qualitative
 
+from embedding_store import load_store
+
 # -----------------------------
 # Plotly renderer
 # -----------------------------
@@ -16,7 +18,7 @@ pio.renderers.default = "browser"
 # Config
 # -----------------------------
 MODEL_NAME = "data/intfloat/multilingual-e5-base"
-DATASET_FILE = "data/dataset_intfloat-multilingual-e5-base.json"
+MODEL_KEY = "intfloat-multilingual-e5-base"
 RAW_FILE = "data/raw_intfloat-multilingual-e5-base.json"
 SOURCE_DIR = "source"
 N_COMPONENTS = 2 # Set to 2 for 2D visualization or 3 for 3D visualization
@@ -24,8 +26,8 @@ N_COMPONENTS = 2 # Set to 2 for 2D visualization or 3 for 3D visualization
 # -----------------------------
 # Load embeddings dataset
 # -----------------------------
-with open(DATASET_FILE, "r", encoding="utf-8") as f:
-    data = json.load(f)
+matrix, metadata = load_store(MODEL_KEY)
+data = metadata["chunks"]
 
 # Load raw dataset with question texts
 with open(RAW_FILE, "r", encoding="utf-8") as f:
@@ -58,7 +60,7 @@ files = []
 embeddings = []
 
 for idx, item in enumerate(data, 1):
-    embedding = np.array(item["embedding"])
+    embedding = np.asarray(matrix[idx - 1], dtype=np.float32)
     question_text = q_texts.get(int(item["question_id"]), item["question_id"])
     file_name = question_to_file.get(question_text, "unknown")
     
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import argparse
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+from embedding_store import load_store
+from vector_search import ExactIndex, normalize_query, dot_scores, inverse_row_norms, top_k, top_k_indices
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+ANN_FILENAME_TEMPLATE = "data/ivf_{model}.npz"
+
+ANN_MIN_CORPUS = 50000  # Below this size exact search is fast enough
+DEFAULT_NPROBE = 16  # Lists scanned per query: higher = better recall, slower
+KMEANS_ITERATIONS = 20
+KMEANS_MAX_SAMPLE = 100000  # Rows used to train the coarse quantizer
+ASSIGN_BLOCK_ROWS = 65536
+
+
+def default_n_lists(count: int) -> int:
+    """Number of inverted lists for a corpus of the given size (~4 * sqrt(n))."""
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+
+# -------------------------------
+# Coarse quantizer (spherical k-means)
+# -------------------------------
+def assign_lists(matrix: np.ndarray, centroids: np.ndarray, block_rows: int = ASSIGN_BLOCK_ROWS) -> np.ndarray:
+    """Assign every row to its most similar centroid, block by block."""
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        assignments[start:start + block_rows] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_kmeans(sample: np.ndarray, n_lists: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """
+    Train unit-length centroids with spherical k-means.
+
+    Args:
+        sample (np.ndarray): Unit-length float32 training vectors.
+        n_lists (int): Number of centroids.
+        iterations (int): Lloyd iterations.
+        seed (int): Random seed for initialization.
+
+    Returns:
+        np.ndarray: Centroids of shape (n_lists, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids[non_empty] = sums / np.maximum(norms, 1e-12)
+
+        # Re-seed empty lists with random training vectors
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+
+    return centroids
+
+
+# -------------------------------
+# IVF index
+# -------------------------------
+class IVFIndex:
+    """
+    Inverted-file index: rows are bucketed by their nearest k-means centroid,
+    and a query only scans the rows of its `nprobe` closest buckets.
+
+    Lists are stored CSR-style: `list_rows[list_offsets[i]:list_offsets[i + 1]]`
+    are the corpus rows of list i. Vectors themselves are not copied; the
+    index scores candidates against the (memory-mapped) store matrix.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_rows: np.ndarray,
+        store_version: str = "",
+        nprobe: int = DEFAULT_NPROBE
+    ):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.store_version = store_version
+        self.nprobe = nprobe
+        self.matrix: Optional[np.ndarray] = None
+        self.inv_norms: Optional[np.ndarray] = None
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        n_lists: Optional[int] = None,
+        store_version: str = "",
+        seed: int = 0
+    ) -> "IVFIndex":
+        """
+        Train the coarse quantizer on a sample and bucket all rows.
+
+        Args:
+            matrix (np.ndarray): Unit-length corpus matrix (may be memory-mapped).
+            n_lists (int, optional): Number of lists; defaults to ~4 * sqrt(n).
+            store_version (str): Version of the store the index is built from.
+            seed (int): Random seed.
+
+        Returns:
+            IVFIndex: Built index (not attached to a matrix).
+        """
+        count = matrix.shape[0]
+        n_lists = min(n_lists or default_n_lists(count), count)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, min(count, KMEANS_MAX_SAMPLE), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        sample /= np.maximum(np.linalg.norm(sample, axis=1, keepdims=True), 1e-12)
+        centroids = train_kmeans(sample, n_lists, seed=seed)
+
+        assignments = assign_lists(matrix, centroids)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists)))).astype(np.int64)
+
+        return cls(centroids, list_offsets, list_rows, store_version=store_version)
+
+    def save(self, path: str) -> None:
+        """Save the index as a .npz file (written to a temp file, then renamed)."""
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+            store_version=np.array(self.store_version)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, nprobe: int = DEFAULT_NPROBE) -> "IVFIndex":
+        """Load an index saved with save()."""
+        with np.load(path) as data:
+            return cls(
+                data["centroids"],
+                data["list_offsets"],
+                data["list_rows"],
+                store_version=str(data["store_version"]),
+                nprobe=nprobe
+            )
+
+    def attach(self, matrix: np.ndarray, inv_norms: Optional[np.ndarray] = None) -> "IVFIndex":
+        """Attach the corpus matrix the index scores candidates against."""
+        if matrix.shape[0] != len(self.list_rows):
+            raise ValueError(f"IVF index covers {len(self.list_rows)} rows, store has {matrix.shape[0]}")
+        self.matrix = matrix
+        self.inv_norms = inv_norms
+        return self
+
+    def candidates(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        """Sorted corpus rows of the nprobe lists closest to the unit query q."""
+        probe = top_k_indices(self.centroids @ q, min(nprobe, self.n_lists))
+        rows = np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe])
+        rows.sort()  # sequential access pattern on the memory-mapped matrix
+        return rows
+
+    def search(self, query_emb: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        q = normalize_query(query_emb)
+        rows = self.candidates(q, nprobe or self.nprobe)
+        scores = dot_scores(self.matrix[rows], q)
+        if self.inv_norms is not None:
+            scores *= self.inv_norms[rows]
+        idxs, best = top_k(scores, k)
+        return rows[idxs], best
+
+
+def load_ann_index(
+    model_key: str,
+    matrix: np.ndarray,
+    metadata: Dict[str, Any],
+    inv_norms: Optional[np.ndarray] = None,
+    nprobe: int = DEFAULT_NPROBE,
+    min_corpus: int = ANN_MIN_CORPUS
+) -> Optional[IVFIndex]:
+    """
+    Load the IVF index for a store if it is worth using and up to date.
+
+    Returns None (exact search should be used) when the corpus is smaller
+    than min_corpus, the index file is missing, or it was built from a
+    different store version.
+    """
+    path = ANN_FILENAME_TEMPLATE.format(model=model_key)
+    if matrix.shape[0] < min_corpus or not os.path.exists(path):
+        return None
+
+    index = IVFIndex.load(path, nprobe=nprobe)
+    if index.store_version != metadata.get("version", "") or len(index.list_rows) != matrix.shape[0]:
+        return None
+    return index.attach(matrix, inv_norms)
+
+
+def build_ann_index(model_key: str, n_lists: Optional[int] = None) -> str:
+    """
+    Build the IVF index for an existing store and save it next to it.
+
+    Returns:
+        str: Path of the written index file.
+    """
+    matrix, metadata = load_store(model_key)
+    index = IVFIndex.build(matrix, n_lists=n_lists, store_version=metadata.get("version", ""))
+    path = ANN_FILENAME_TEMPLATE.format(model=model_key)
+    index.save(path)
+    return path
+
+
+# -------------------------------
+# Recall report
+# -------------------------------
+def recall_report(
+    matrix: np.ndarray,
+    index: IVFIndex,
+    queries: np.ndarray,
+    k: int,
+    nprobes: List[int],
+    inv_norms: Optional[np.ndarray] = None
+) -> List[Dict[str, Any]]:
+    """
+    Compare IVF results against brute-force search.
+
+    Args:
+        matrix (np.ndarray): Corpus matrix.
+        index (IVFIndex): Index attached to the same matrix.
+        queries (np.ndarray): Query vectors, one per row.
+        k (int): Number of results compared (recall@k).
+        nprobes (List[int]): nprobe settings to evaluate.
+        inv_norms (np.ndarray, optional): Inverse row norms for unnormalized stores.
+
+    Returns:
+        List[Dict]: One row per setting with recall@k and mean latency in ms.
+    """
+    exact = ExactIndex(matrix, inv_norms)
+
+    start = time.perf_counter()
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = [{"backend": "exact", "nprobe": None, "recall": 1.0, "latency_ms": round(exact_ms, 3)}]
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = [index.search(q, k, nprobe=nprobe)[0] for q in queries]
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(truth_set.intersection(rows.tolist())) / max(len(truth_set), 1)
+                          for truth_set, rows in zip(truth, found)])
+        report.append({
+            "backend": "ivf",
+            "nprobe": nprobe,
+            "recall": round(float(recall), 4),
+            "latency_ms": round(latency_ms, 3)
+        })
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Print recall@k and latency of the IVF index against exact search."""
+    parser = argparse.ArgumentParser(description="Recall@k report of the IVF index against brute-force search.")
+    parser.add_argument("model_key", help="Sanitized model name, e.g. intfloat-multilingual-e5-base")
+    parser.add_argument("--k", type=int, default=50, help="Results compared per query")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--queries", type=int, default=200, help="Corpus rows sampled as queries")
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise added to sampled queries")
+    parser.add_argument("--build", action="store_true", help="(Re)build the index before measuring")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.build:
+        print(f"Built {build_ann_index(args.model_key)}")
+
+    matrix, metadata = load_store(args.model_key)
+    inv_norms = None if metadata.get("normalized") else inverse_row_norms(matrix)
+    index = load_ann_index(args.model_key, matrix, metadata, inv_norms, min_corpus=0)
+    if index is None:
+        parser.error("no up-to-date IVF index for this store (use --build)")
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(matrix.shape[0], min(args.queries, matrix.shape[0]), replace=False)
+    queries = np.asarray(matrix[np.sort(rows)], dtype=np.float32)
+    queries += rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+
+    report = recall_report(matrix, index, queries, args.k, args.nprobe, inv_norms)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"recall@{args.k} over {len(queries)} queries, {matrix.shape[0]} rows, {index.n_lists} lists")
+        for row in report:
+            label = "exact" if row["nprobe"] is None else f"nprobe={row['nprobe']}"
+            print(f"  {label:>12}  recall={row['recall']:.4f}  latency={row['latency_ms']:.3f} ms")
+    return report
+
+
+if __name__ == "__main__":
+    main()
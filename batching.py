@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Sequence, Tuple
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+# All batchers created in this process, by name (for stats)
+_batchers: Dict[str, "MicroBatcher"] = {}
+
+
+# -------------------------------
+# Micro-batching scheduler
+# -------------------------------
+class MicroBatcher:
+    """
+    Coalesce concurrent single-item calls into batched calls.
+
+    Callers submit items from any thread. A background worker waits for
+    the first item, keeps collecting for up to max_wait_ms (or until
+    max_batch_size items are queued), runs `fn` once on the whole batch and
+    routes each result back to the caller's Future.
+
+    `fn` must take a list of items and return a sequence of results of the
+    same length and order.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 2.0,
+        name: str = "batcher"
+    ):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+
+        self._queue: Deque[Tuple[Any, Future]] = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+
+        self.batch_sizes: Counter = Counter()
+        self.items = 0
+        self.max_queue_depth = 0
+
+        _batchers[name] = self
+
+    # ---------------------------
+    # Client side
+    # ---------------------------
+    def submit_many(self, items: Sequence[Any]) -> List[Future]:
+        """Queue items (atomically, so they tend to share a batch) and return their futures."""
+        futures = [Future() for _ in items]
+        with self._cond:
+            self._ensure_worker()
+            self._queue.extend(zip(items, futures))
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return futures
+
+    def submit(self, item: Any) -> Future:
+        return self.submit_many([item])[0]
+
+    def run(self, items: Sequence[Any]) -> List[Any]:
+        """Submit items and block until all results are available."""
+        return [future.result() for future in self.submit_many(items)]
+
+    # ---------------------------
+    # Worker side
+    # ---------------------------
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+            self._worker.start()
+
+    def _next_batch(self) -> List[Tuple[Any, Future]]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.max_wait_ms / 1000.0
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: got {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logger.exception(f"Batch of {len(items)} failed in '{self.name}'")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batch_sizes[len(items)] += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    # ---------------------------
+    # Stats
+    # ---------------------------
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and batch-size histogram."""
+        batches = sum(self.batch_sizes.values())
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / batches, 2) if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+        }
+
+
+def batcher_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of all batchers in this process."""
+    return {name: batcher.stats() for name, batcher in _batchers.items()}
@@ -0,0 +1,495 @@
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import logging
+import argparse
+import platform
+import contextlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+import numpy as np
+
+from text_utils import normalize_text
+from model_registry import registry
+from model_config import EMBEDDER_MODEL
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+BENCHMARK_MODEL = EMBEDDER_MODEL  # The model the retriever loads the store of
+
+# Files the serving modules read at import time; copied from the current
+# directory when present, otherwise written with these minimal defaults
+SUPPORT_FILES: Dict[str, str] = {
+    "data/strings.json": json.dumps({"rag_links_header": "Sources", "links_header": "Links"}),
+    "data/replace.json": "{}",
+    "data/rag_prompt.txt": "Answer the question using only the sources below. Be brief.",
+    "templates/index.html": "<!doctype html><html><body>RAG benchmark</body></html>",
+}
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "si", "de", "pa", "zu", "ro", "ni", "che", "bra"]
+STAND_IN_ANSWER = (
+    "This is a stand-in answer produced for benchmarking. "
+    "It always has the same length and ends with a complete sentence."
+)
+
+
+# -------------------------------
+# Deterministic stand-in models
+# -------------------------------
+def _token_id(word: str) -> int:
+    return zlib.crc32(word.encode("utf-8"))
+
+
+class StandInEncoder:
+    """
+    Feature-hashing bag-of-words encoder with the SentenceTransformer encode() API.
+
+    Texts sharing words get similar vectors, so retrieval results are
+    meaningful. ms_per_text adds a sleep per text to emulate model cost
+    (sleeping releases the GIL, like a real forward pass).
+    """
+
+    def __init__(self, dim: int = 384, ms_per_text: float = 0.0):
+        self.dim = dim
+        self.ms_per_text = ms_per_text
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: Sequence[str], normalize_embeddings: bool = False, **kwargs: Any) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in normalize_text(text).split():
+                token = _token_id(word)
+                vectors[row, token % self.dim] += 1.0 if token & 0x10000 else -1.0
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if self.ms_per_text:
+            time.sleep(self.ms_per_text * len(texts) / 1000)
+        return vectors
+
+
+class StandInReranker:
+    """Word-overlap scorer with the CrossEncoder predict() API."""
+
+    def __init__(self, ms_per_pair: float = 0.0):
+        self.ms_per_pair = ms_per_pair
+
+    def predict(self, pairs: Sequence[Sequence[str]], **kwargs: Any) -> np.ndarray:
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for n, (query, text) in enumerate(pairs):
+            a, b = set(normalize_text(query).split()), set(normalize_text(text).split())
+            scores[n] = len(a & b) / np.sqrt(max(len(a) * len(b), 1))
+        if self.ms_per_pair:
+            time.sleep(self.ms_per_pair * len(pairs) / 1000)
+        return scores
+
+
+class StandInLlama:
+    """
+    Fixed-output model with the parts of the llama_cpp.Llama API the
+    pipeline uses (tokenize, eval, KV state, streaming completion).
+    """
+
+    def __init__(self, ms_per_token: float = 0.0, ms_per_prompt_token: float = 0.0):
+        self.ms_per_token = ms_per_token
+        self.ms_per_prompt_token = ms_per_prompt_token
+        self.n_tokens = 0
+        self._tokens: List[int] = []
+
+    @property
+    def input_ids(self) -> np.ndarray:
+        return np.array(self._tokens[:self.n_tokens], dtype=np.int64)
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [_token_id(word) for word in text.decode("utf-8").split()]
+        return [1] + tokens if add_bos else tokens
+
+    def reset(self) -> None:
+        self.n_tokens = 0
+
+    def eval(self, tokens: Sequence[int]) -> None:
+        self._tokens = self._tokens[:self.n_tokens] + list(tokens)
+        self.n_tokens = len(self._tokens)
+        if self.ms_per_prompt_token:
+            time.sleep(self.ms_per_prompt_token * len(tokens) / 1000)
+
+    def save_state(self) -> List[int]:
+        return self._tokens[:self.n_tokens]
+
+    def load_state(self, state: List[int]) -> None:
+        self._tokens = list(state)
+        self.n_tokens = len(self._tokens)
+
+    def __call__(self, prompt: Any, max_tokens: int = 16, stream: bool = False, **kwargs: Any) -> Any:
+        words = STAND_IN_ANSWER.split()[:max_tokens]
+        if stream:
+            return self._stream(words)
+        if self.ms_per_token:
+            time.sleep(self.ms_per_token * len(words) / 1000)
+        return {"choices": [{"text": " ".join(words)}]}
+
+    def _stream(self, words: List[str]) -> Iterator[Dict[str, Any]]:
+        for n, word in enumerate(words):
+            if self.ms_per_token:
+                time.sleep(self.ms_per_token / 1000)
+            yield {"choices": [{"text": (" " if n else "") + word}]}
+
+
+# -------------------------------
+# Synthetic corpus
+# -------------------------------
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    """Pronounceable made-up words, unique."""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_corpus(
+    folder: str,
+    questions: int,
+    answer_words: int,
+    files: int = 10,
+    seed: int = 0
+) -> List[str]:
+    """
+    Write a synthetic FAQ corpus in the source/ format.
+
+    Every question has a few topic words that dominate its answer; answer
+    lengths vary between 0.5x and 2x answer_words, so long answers span
+    several chunks. Every tenth answer mentions an error code.
+
+    Returns:
+        List[str]: The generated questions.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(max(1000, questions // 2), rng)
+    os.makedirs(folder, exist_ok=True)
+
+    handles = [open(os.path.join(folder, f"part_{n:03d}.txt"), "w", encoding="utf-8") for n in range(files)]
+    generated: List[str] = []
+    try:
+        for n in range(questions):
+            topic = rng.sample(vocabulary, 4)
+            question = "how to " + " ".join(topic)
+            length = rng.randint(answer_words // 2, answer_words * 2)
+            words = [rng.choice(topic) if rng.random() < 0.3 else rng.choice(vocabulary) for _ in range(length)]
+            if n % 10 == 0:
+                words.insert(rng.randrange(len(words)), f"0x{0x80070000 + n:08x}")
+
+            f = handles[n % files]
+            f.write(f"[query] {question}\n[link] https://example.com/faq/{n}\n")
+            for start in range(0, len(words), 40):
+                f.write(" ".join(words[start:start + 40]) + "\n")
+            f.write("\n")
+            generated.append(question)
+    finally:
+        for f in handles:
+            f.close()
+    return generated
+
+
+def make_queries(questions: List[str], count: int, seed: int = 0) -> List[str]:
+    """Paraphrase-like queries: corpus questions with shuffled, dropped and added words."""
+    rng = random.Random(seed + 1)
+    queries: List[str] = []
+    for n in range(count):
+        words = rng.choice(questions).split()[2:]
+        rng.shuffle(words)
+        words = words[:-1] + ["please", f"q{n}"]  # unique, so query caches miss
+        queries.append(" ".join(words))
+    return queries
+
+
+def prepare_workspace(workdir: str, source_dir: str) -> None:
+    """Create data/, templates/ and static/ with the files the modules read at import."""
+    for path, default in SUPPORT_FILES.items():
+        target = os.path.join(workdir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        original = os.path.join(source_dir, path)
+        if os.path.exists(original):
+            shutil.copyfile(original, target)
+        else:
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(default)
+    os.makedirs(os.path.join(workdir, "static"), exist_ok=True)
+
+
+# -------------------------------
+# Measurement helpers
+# -------------------------------
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    """Latency summary of samples in seconds, reported in ms."""
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+def time_each(fn: Callable[[Any], Any], items: Sequence[Any]) -> Dict[str, Any]:
+    """Call fn on every item sequentially and summarize the latencies."""
+    samples: List[float] = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def run_concurrent(fn: Callable[[Any], int], items: Sequence[Any], concurrency: int) -> Dict[str, Any]:
+    """
+    Call fn on all items from `concurrency` threads.
+
+    fn returns an HTTP status code; latencies, throughput and status
+    counts are reported.
+    """
+    samples: List[float] = []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def call(item: Any) -> None:
+        start = time.perf_counter()
+        try:
+            status = str(fn(item))
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, items))
+    wall = time.perf_counter() - start
+
+    result = summarize(samples)
+    result.update({
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "requests_per_sec": round(len(items) / wall, 2) if wall > 0 else 0.0,
+        "statuses": statuses,
+    })
+    return result
+
+
+# -------------------------------
+# Benchmark stages
+# -------------------------------
+def bench_build(args: argparse.Namespace, encoder: Optional[StandInEncoder]) -> Dict[str, Any]:
+    """Full build of the synthetic corpus, then an incremental rebuild with nothing changed."""
+    import build_embeddings
+
+    pairs = build_embeddings.parse_pairs(build_embeddings.read_source_lines("source"))
+    full = build_embeddings.build_index(
+        BENCHMARK_MODEL, pairs, args.batch_size, incremental=False, ann=args.ann, model=encoder
+    )
+    incremental = build_embeddings.build_index(
+        BENCHMARK_MODEL, pairs, args.batch_size, incremental=True, ann=args.ann, model=encoder
+    )
+    return {"full": full, "incremental": incremental}
+
+
+def bench_stages(queries: List[str]) -> Dict[str, Any]:
+    """Sequential per-stage latencies of the retrieval and generation functions."""
+    import retriever
+    import cross_encoder
+    import pipeline
+    from formatting import format_result
+    from rag_generation import rag_generation, rag_prompt
+
+    results: Dict[str, Any] = {}
+    results["encode_query"] = time_each(retriever.encode_query, queries)
+    results["encode_query_cached"] = time_each(retriever.encode_query, queries)
+
+    embeddings = {query: retriever.encode_query(query) for query in queries}
+    results["search_top_k"] = time_each(
+        lambda q: retriever.search_top_k(embeddings[q], pipeline.TOP_K_RETRIEVE, question=q), queries
+    )
+
+    searched = {q: retriever.search_top_k(embeddings[q], pipeline.TOP_K_RETRIEVE, question=q) for q in queries}
+    results["rerank_bi_encoder"] = time_each(
+        lambda q: retriever.rerank_questions(searched[q], embeddings[q], top_k=3), queries
+    )
+    results["rerank_cross_encoder"] = time_each(
+        lambda q: cross_encoder.rerank_questions_cross_encoder(
+            searched[q], retriever.raw_data, q, top_k=3, index_version=retriever.INDEX_VERSION
+        ),
+        queries
+    )
+
+    contexts = {q: pipeline.retrieve_answers({"question": q, "use_RAG": True}) for q in queries}
+    results["retrieve_answers"] = time_each(
+        lambda q: pipeline.retrieve_answers({"question": q + " again", "use_RAG": True}), queries
+    )
+    results["build_sources"] = time_each(lambda q: pipeline.build_sources(contexts[q]), queries)
+
+    sources = {q: pipeline.build_sources(contexts[q]) for q in queries}
+    results["rag_generation"] = time_each(lambda q: rag_generation(q, sources[q], rag_prompt), queries)
+    results["format_result"] = time_each(
+        lambda q: format_result(q, STAND_IN_ANSWER, contexts[q]["links"], True, True), queries
+    )
+    return results
+
+
+def bench_http(queries: List[str], args: argparse.Namespace) -> Dict[str, Any]:
+    """Concurrent /ask and /ask_stream requests against both servers (in-process test clients)."""
+    rng = random.Random(args.seed + 2)
+    payloads = [
+        {"question": query, "use_RAG": rng.random() < args.rag_fraction}
+        for query in (queries * (args.requests // max(len(queries), 1) + 1))[:args.requests]
+    ]
+    results: Dict[str, Any] = {}
+
+    if "flask" in args.servers:
+        import server_flask
+        local = threading.local()
+
+        def flask_post(path: str, payload: Dict[str, Any]) -> int:
+            client = getattr(local, "client", None)
+            if client is None:
+                client = local.client = server_flask.app.test_client()
+            response = client.post(path, json=payload)
+            response.get_data()
+            return response.status_code
+
+        results["flask"] = {
+            path: run_concurrent(lambda p, path=path: flask_post(path, p), payloads, args.concurrency)
+            for path in ("/ask", "/ask_stream")
+        }
+
+    if "fastapi" in args.servers:
+        try:
+            from fastapi.testclient import TestClient
+            import server_fastapi
+        except ImportError as e:
+            results["fastapi"] = {"skipped": repr(e)}
+        else:
+            with TestClient(server_fastapi.app) as client:
+                results["fastapi"] = {
+                    path: run_concurrent(
+                        lambda p, path=path: client.post(path, json=p).status_code, payloads, args.concurrency
+                    )
+                    for path in ("/ask", "/ask_stream")
+                }
+    return results
+
+
+def install_stand_ins(args: argparse.Namespace, encoder: StandInEncoder) -> None:
+    """Register the stand-in models before any of them is loaded."""
+    import rag_generation
+    from llm_pool import LlamaPool
+
+    registry.override("embedder", encoder)
+    registry.override("reranker", StandInReranker(args.reranker_ms))
+    registry.override("llm", LlamaPool(
+        lambda: StandInLlama(args.llm_ms_per_token, args.llm_ms_per_prompt_token),
+        rag_generation.LLM_POOL_SIZE
+    ))
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# -------------------------------
+# Command line interface
+# -------------------------------
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Run the benchmark in a temporary workspace and print/write the JSON report."""
+    parser = argparse.ArgumentParser(description="End-to-end benchmark on a synthetic corpus.")
+    parser.add_argument("--questions", type=int, default=2000, help="Synthetic question-answer pairs")
+    parser.add_argument("--answer-words", type=int, default=150, help="Mean answer length in words")
+    parser.add_argument("--queries", type=int, default=100, help="Queries for the per-stage benchmarks")
+    parser.add_argument("--requests", type=int, default=200, help="HTTP requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent HTTP clients")
+    parser.add_argument("--rag-fraction", type=float, default=0.5, help="Share of HTTP requests with use_RAG")
+    parser.add_argument("--servers", nargs="*", choices=("flask", "fastapi"), default=["flask", "fastapi"])
+    parser.add_argument("--batch-size", type=int, default=64, help="Build batch size")
+    parser.add_argument("--ann", choices=("auto", "always", "never"), default="auto", help="IVF index mode")
+    parser.add_argument("--dim", type=int, default=384, help="Stand-in embedding dimension")
+    parser.add_argument("--encoder-ms", type=float, default=0.0, help="Simulated encoder cost per text")
+    parser.add_argument("--reranker-ms", type=float, default=0.0, help="Simulated reranker cost per pair")
+    parser.add_argument("--llm-ms-per-token", type=float, default=0.0, help="Simulated decode cost per token")
+    parser.add_argument("--llm-ms-per-prompt-token", type=float, default=0.0, help="Simulated prompt eval cost")
+    parser.add_argument("--real-models", action="store_true", help="Use the configured models instead of stand-ins")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the semantic answer cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Workspace directory (default: a new temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the workspace afterwards")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's INFO logs")
+    args = parser.parse_args(argv)
+
+    # Configure logging before the servers do (their basicConfig is then a no-op)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr)
+
+    output = os.path.abspath(args.output) if args.output else None
+    source_dir = os.getcwd()
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-benchmark-"))
+    os.makedirs(workdir, exist_ok=True)
+    prepare_workspace(workdir, source_dir)
+    os.chdir(workdir)
+
+    try:
+        questions = generate_corpus("source", args.questions, args.answer_words, seed=args.seed)
+        queries = make_queries(questions, args.queries, seed=args.seed)
+        encoder = None if args.real_models else StandInEncoder(args.dim, args.encoder_ms)
+
+        report: Dict[str, Any] = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+            "environment": environment(),
+        }
+        with contextlib.redirect_stdout(sys.stderr):  # keep stdout for the report
+            report["build"] = bench_build(args, encoder)
+
+        if not args.real_models:
+            install_stand_ins(args, encoder)
+        import pipeline
+        pipeline.SEMANTIC_CACHE_ENABLED = args.answer_cache
+
+        report["stages"] = bench_stages(queries)
+        report["http"] = bench_http(queries, args)
+        report["pipeline_metrics"] = pipeline.metrics_payload()
+    finally:
+        os.chdir(source_dir)
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, default=str)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
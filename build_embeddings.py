@@ -3,9 +3,21 @@ import json
 import time
 import re
 import string
-from typing import List, Dict
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from model_config import SEARCH_QUANTIZATION
+from embedding_store import StoreWriter, SUPPORTED_DTYPES, load_store
+from ann_index import ANN_MIN_CORPUS, ANN_FILENAME_TEMPLATE, build_ann_index
+from quantized_index import QUANT_MODES, QUANT_FILENAME_TEMPLATE, build_quantized_index
+from sharded_index import SHARD_MANIFEST_TEMPLATE, build_shards
+from lexical_index import BM25_FILENAME_TEMPLATE, build_lexical_index
+
 # -------------------------------
 # Constants / Config
 # -------------------------------
@@ -18,7 +30,14 @@ AVAILABLE_MODELS = [
 
 SOURCE_FOLDER = "source"
 RAW_FILENAME_TEMPLATE = "data/raw_{model}.json"
-DATASET_FILENAME_TEMPLATE = "data/dataset_{model}.json"
+EMBEDDING_DTYPE = "float32"  # "float16" halves the store size
+BATCH_SIZE = 64
+INCREMENTAL = True  # Reuse vectors of unchanged chunks from the previous store
+REUSE_COPY_BLOCK = 4096  # Rows copied per block from the previous store
+PROGRESS_INTERVAL = 5.0  # Seconds between progress lines
+ANN_MODES = ("auto", "always", "never")  # auto: build the IVF index from ANN_MIN_CORPUS chunks
+QUANTIZE = (SEARCH_QUANTIZATION,) if SEARCH_QUANTIZATION else ()  # Compact first-stage codes: only the searched mode
+SHARDS = 0  # Shard files for scatter-gather search (0 = none)
 
 CHUNK_SIZE = 200
 CHUNK_OVERLAP = 50
@@ -50,109 +69,587 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHU
     return chunks
 
 
+def chunk_hash(model_name: str, question: str, chunk: str) -> str:
+    """Content hash of a (question, chunk) pair for a given model."""
+    digest = hashlib.sha1()
+    for part in (model_name, question, chunk):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def assign_stable_ids(pairs: List[Dict[str, Any]], previous_pairs: List[Dict[str, Any]]) -> None:
+    """
+    Assign question ids that survive re-indexing.
+
+    A question keeps the id it had in the previous raw file (matched by
+    question text and occurrence number, so duplicated questions are stable
+    too). New questions get ids above the largest previous id.
+
+    Args:
+        pairs (List[Dict]): Freshly parsed pairs, updated in place.
+        previous_pairs (List[Dict]): Pairs from the previous raw file.
+    """
+    def occurrence_keys(items: List[Dict[str, Any]]) -> Iterator[Tuple[str, int]]:
+        seen: Dict[str, int] = {}
+        for item in items:
+            n = seen.get(item["question"], 0)
+            seen[item["question"]] = n + 1
+            yield item["question"], n
+
+    previous_ids = {
+        key: item["id"]
+        for key, item in zip(occurrence_keys(previous_pairs), previous_pairs)
+    }
+    next_id = max((item["id"] for item in previous_pairs), default=-1) + 1
+
+    for key, pair in zip(occurrence_keys(pairs), pairs):
+        if key in previous_ids:
+            pair["id"] = previous_ids[key]
+        else:
+            pair["id"] = next_id
+            next_id += 1
+
+
+def encode_batches(model: SentenceTransformer, texts: List[str], batch_size: int = BATCH_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Encode texts in length-sorted batches.
+
+    Texts of similar length are grouped together to minimize padding inside
+    each batch. Vectors are L2-normalized, so the retriever can score with a
+    plain dot product. Yields (row_indices, vectors) so callers can write every batch
+    to its original position as soon as it is ready.
+
+    Args:
+        model (SentenceTransformer): Embedding model.
+        texts (List[str]): Texts to encode.
+        batch_size (int): Number of texts per forward pass.
+
+    Yields:
+        Tuple[np.ndarray, np.ndarray]: Row indices and their embeddings.
+    """
+    order = np.argsort([-len(text) for text in texts], kind="stable")
+    for start in range(0, len(order), batch_size):
+        rows = order[start:start + batch_size]
+        vectors = model.encode(
+            [texts[i] for i in rows],
+            batch_size=len(rows),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        yield rows, vectors
+
+
 # -------------------------------
-# Main script
+# Source parsing
 # -------------------------------
+def read_source_lines(source_folder: str = SOURCE_FOLDER) -> List[str]:
+    """Read all lines of all files in the source folder."""
+    lines: List[str] = []
+    for filename in sorted(os.listdir(source_folder)):
+        file_path = os.path.join(source_folder, filename)
+        if os.path.isfile(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                lines.extend([line.strip() for line in f])
+    return lines
 
-# Print available models
-print("Available models:")
-for idx, m in enumerate(AVAILABLE_MODELS, 1):
-    print(f"{idx}. {m}")
-
-# User selects a model
-while True:
-    try:
-        choice = int(input("Enter model number: "))
-        if 1 <= choice <= len(AVAILABLE_MODELS):
-            MODEL_TYPE = AVAILABLE_MODELS[choice - 1]
-            break
+
+def parse_pairs(lines: List[str]) -> List[Dict[str, Any]]:
+    """
+    Parse source lines into question-answer pairs.
+
+    Args:
+        lines (List[str]): Lines of the source files.
+
+    Returns:
+        List[Dict]: Pairs with positional 'id', 'question', 'link' and 'answer'.
+    """
+    pairs: List[Dict[str, Any]] = []
+    current_question: str = None
+    current_link: str = None
+    current_answer: List[str] = []
+    index = 0
+
+    for line in lines:
+        line = line.strip()
+        if HEADER_PATTERN.match(line):
+            if current_question is not None:
+                pairs.append({
+                    "id": index,
+                    "question": current_question,
+                    "link": current_link,
+                    "answer": "\n".join(current_answer)
+                })
+                index += 1
+            current_question = line.replace("[query] ", "")
+            current_link = None
+            current_answer = []
+        elif LINK_PATTERN.match(line):
+            current_link = line.replace("[link]", "")
+        elif line:
+            line = line.replace("[passage]", "")
+            if line:
+                current_answer.append(line)
+
+    # Add last pair
+    if current_question is not None:
+        pairs.append({
+            "id": index,
+            "question": current_question,
+            "link": current_link,
+            "answer": "\n".join(current_answer)
+        })
+
+    return pairs
+
+
+# -------------------------------
+# Index building
+# -------------------------------
+def write_store(
+    model: SentenceTransformer,
+    model_name: str,
+    model_key: str,
+    kind: str,
+    texts: List[str],
+    rows: List[Dict[str, Any]],
+    batch_size: int = BATCH_SIZE,
+    dtype: str = EMBEDDING_DTYPE,
+    incremental: bool = INCREMENTAL
+) -> Dict[str, Any]:
+    """
+    Encode texts into a store, reusing vectors of unchanged rows.
+
+    Rows whose 'hash' is found in the previous store of the same kind (same
+    model, dtype and dimension) are copied from it; all other texts are
+    encoded in batches and streamed to disk. Rows missing from the new
+    list are dropped simply by not being copied. When every row is reused
+    in place and the row metadata is identical, the previous store is kept
+    as is (same files, same version).
+
+    Args:
+        model (SentenceTransformer): Embedding model.
+        model_name (str): Model name (stored in metadata).
+        model_key (str): Sanitized model name used in file names.
+        kind (str): Store kind, 'chunks' or 'answers'.
+        texts (List[str]): Text to encode for every row.
+        rows (List[Dict]): Metadata of every row, including 'hash'.
+        batch_size (int): Number of texts per forward pass.
+        dtype (str): On-disk dtype of the matrix.
+        incremental (bool): Reuse vectors from the previous store.
+
+    Returns:
+        Dict[str, Any]: Row counts, encode time, store paths and version,
+        and whether the previous store was kept unchanged.
+    """
+    dim = model.get_sentence_embedding_dimension()
+
+    # Map hashes of the previous store to their rows
+    previous_embeddings = None
+    previous_metadata: Dict[str, Any] = {}
+    previous_rows: Dict[str, int] = {}
+    if incremental:
+        try:
+            previous_embeddings, previous_metadata = load_store(model_key, kind=kind)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            print(f"[{model_name}] Previous {kind} store not usable, re-encoding everything: {e}")
+        else:
+            if (previous_metadata["model"] == model_name
+                    and previous_metadata["dtype"] == dtype
+                    and previous_metadata["dim"] == dim
+                    and previous_metadata.get("normalized", False)):
+                previous_rows = {
+                    item["hash"]: row
+                    for row, item in enumerate(previous_metadata[kind])
+                    if "hash" in item
+                }
+
+    # Split rows into reused (unchanged hash) and new/modified ones
+    reused_new_rows: List[int] = []
+    reused_old_rows: List[int] = []
+    encode_rows: List[int] = []
+    for row, item in enumerate(rows):
+        old_row = previous_rows.get(item["hash"])
+        if old_row is None:
+            encode_rows.append(row)
         else:
-            print(f"Enter a number between 1 and {len(AVAILABLE_MODELS)}")
-    except ValueError:
-        print("Enter a valid number")
-
-print(f"Selected model: {MODEL_TYPE}")
-start_time = time.time()
-
-# Load SentenceTransformer model
-model = SentenceTransformer(MODEL_TYPE)
-
-# Read source files
-lines: List[str] = []
-for filename in os.listdir(SOURCE_FOLDER):
-    file_path = os.path.join(SOURCE_FOLDER, filename)
-    if os.path.isfile(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines.extend([line.strip() for line in f])
-
-# Parse into question-answer pairs
-pairs: List[Dict[str, str]] = []
-current_question: str = None
-current_link: str = None
-current_answer: List[str] = []
-index = 0
-
-for line in lines:
-    line = line.strip()
-    if HEADER_PATTERN.match(line):
-        if current_question is not None:
-            pairs.append({
-                "id": index,
-                "question": current_question,
-                "link": current_link,
-                "answer": "\n".join(current_answer)
+            reused_new_rows.append(row)
+            reused_old_rows.append(old_row)
+
+    print(
+        f"[{model_name}] {kind}: {len(rows)} rows, {len(reused_new_rows)} reused, "
+        f"{len(encode_rows)} to encode (batch size {batch_size})"
+    )
+
+    # Nothing moved or changed: keep the previous store (and its version)
+    if previous_rows and reused_new_rows == reused_old_rows and previous_metadata[kind] == rows:
+        print(f"[{model_name}] {kind}: store unchanged, keeping version {previous_metadata['version']}")
+        return {
+            "rows": len(rows),
+            "reused": len(reused_new_rows),
+            "encoded": 0,
+            "encode_seconds": 0.0,
+            "paths": (),
+            "version": previous_metadata["version"],
+            "unchanged": True,
+        }
+
+    writer = StoreWriter(model_key, model_name, len(rows), dim, dtype=dtype, normalized=True, kind=kind)
+
+    # Copy unchanged vectors from the previous store
+    for start in range(0, len(reused_new_rows), REUSE_COPY_BLOCK):
+        block = slice(start, start + REUSE_COPY_BLOCK)
+        writer.write(np.asarray(reused_new_rows[block]), previous_embeddings[reused_old_rows[block]])
+
+    # Encode new/modified rows batch by batch, writing each batch as it completes
+    encode_start = time.time()
+    encode_texts = [texts[row] for row in encode_rows]
+    encode_rows_array = np.asarray(encode_rows, dtype=np.int64)
+    encoded = 0
+    last_report = encode_start
+    for batch_rows, vectors in encode_batches(model, encode_texts, batch_size):
+        writer.write(encode_rows_array[batch_rows], vectors)
+        encoded += len(batch_rows)
+        now = time.time()
+        if now - last_report >= PROGRESS_INTERVAL or encoded == len(encode_texts):
+            rate = encoded / max(now - encode_start, 1e-9)
+            print(f"[{model_name}] {kind}: encoded {encoded}/{len(encode_texts)} ({rate:.1f} {kind}/sec)", flush=True)
+            last_report = now
+    encode_time = time.time() - encode_start
+
+    # Publish the matrix (.npy) and row metadata (.json)
+    previous_embeddings = None
+    paths = writer.close(rows)
+
+    return {
+        "rows": len(rows),
+        "reused": len(reused_new_rows),
+        "encoded": len(encode_rows),
+        "encode_seconds": encode_time,
+        "paths": paths,
+        "version": writer.version,
+        "unchanged": False,
+    }
+
+
+def saved_store_version(path: str) -> Optional[str]:
+    """
+    Store version recorded in a derived index file (.npz or JSON manifest),
+    or None when the file is missing.
+    """
+    if not os.path.exists(path):
+        return None
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("store_version")
+    with np.load(path) as data:  # lazy: only the version member is read
+        return str(data["store_version"])
+
+
+def build_index(
+    model_name: str,
+    pairs: List[Dict[str, Any]],
+    batch_size: int = BATCH_SIZE,
+    dtype: str = EMBEDDING_DTYPE,
+    incremental: bool = INCREMENTAL,
+    ann: str = "auto",
+    quantize: Sequence[str] = QUANTIZE,
+    shards: int = SHARDS,
+    model: Optional[SentenceTransformer] = None
+) -> Dict[str, Any]:
+    """
+    Build (or incrementally update) the raw file and embedding stores of one model.
+
+    Writes the chunk store searched by the retriever and the answer store
+    (one embedding of the full answer per question) used for reranking.
+
+    Args:
+        model_name (str): SentenceTransformer model name.
+        pairs (List[Dict]): Parsed question-answer pairs (not modified).
+        batch_size (int): Number of chunks per forward pass.
+        dtype (str): On-disk dtype of the embedding matrix.
+        incremental (bool): Reuse vectors of unchanged chunks from the previous store.
+        ann (str): IVF index mode, one of ANN_MODES.
+        quantize (Sequence[str]): Quantized code files to build, from QUANT_MODES.
+        shards (int): Number of shard files for sharded search (0 = none).
+        model (SentenceTransformer, optional): Already loaded encoder (e.g. a local
+            stand-in); loaded from model_name if None.
+
+    Returns:
+        Dict[str, Any]: Build statistics (chunk counts, timings, throughput).
+    """
+    start_time = time.time()
+    pairs = [dict(pair) for pair in pairs]  # ids are assigned per model
+
+    model_key = sanitize_filename(model_name)
+    raw_filename = RAW_FILENAME_TEMPLATE.format(model=model_key)
+
+    # Load SentenceTransformer model
+    if model is None:
+        model = SentenceTransformer(model_name)
+    load_time = time.time() - start_time
+
+    # Keep question ids stable across rebuilds (full rebuilds too, only vector reuse is optional)
+    previous_pairs: List[Dict[str, Any]] = []
+    if os.path.exists(raw_filename):
+        with open(raw_filename, "r", encoding="utf-8") as f:
+            previous_pairs = json.load(f)
+    assign_stable_ids(pairs, previous_pairs)
+
+    # Split answers into chunks (texts only, embeddings are streamed to disk)
+    dataset_chunks: List[Dict[str, Any]] = []
+    texts_for_embedding: List[str] = []
+    for pair in pairs:
+        question_id = f"{pair['id']:04d}"
+        for n, chunk in enumerate(chunk_text(pair["answer"])):
+            texts_for_embedding.append(f"{pair['question']} {chunk}")
+            dataset_chunks.append({
+                "question_id": question_id,
+                "chunk_text": chunk,
+                "word_start": n * (CHUNK_SIZE - CHUNK_OVERLAP),  # offset in the answer, to merge overlaps
+                "hash": chunk_hash(model_name, pair["question"], chunk)
             })
-            index += 1
-        current_question = line.replace("[query] ", "")
-        current_link = None
-        current_answer = []
-    elif LINK_PATTERN.match(line):
-        current_link = line.replace("[link]", "")
-    elif line:
-        line = line.replace("[passage]", "")
-        if line:
-            current_answer.append(line)
-
-# Add last pair
-if current_question is not None:
-    pairs.append({
-        "id": index,
-        "question": current_question,
-        "link": current_link,
-        "answer": "\n".join(current_answer)
-    })
-
-print(f"Found {len(pairs)} question-answer pairs")
-
-# Save raw pairs JSON
-RAW_FILENAME = RAW_FILENAME_TEMPLATE.format(model=sanitize_filename(MODEL_TYPE))
-with open(RAW_FILENAME, "w", encoding="utf-8") as f:
-    json.dump(pairs, f, ensure_ascii=False, indent=4)
-
-print(f"Saved raw data to {RAW_FILENAME}")
-
-# Generate embeddings for chunks
-dataset_chunks: List[Dict[str, any]] = []
-for i, pair in enumerate(pairs):
-    question_id = f"{i:04d}"
-    answer_chunks = chunk_text(pair["answer"])
-
-    for chunk in answer_chunks:
-        text_for_embedding = f"{pair['question']} {chunk}"
-        embedding_vector = model.encode([text_for_embedding])[0].tolist()
-        dataset_chunks.append({
-            "question_id": question_id,
-            "chunk_text": chunk,
-            "embedding": embedding_vector
-        })
 
-# Save dataset JSON
-DATASET_FILENAME = DATASET_FILENAME_TEMPLATE.format(model=sanitize_filename(MODEL_TYPE))
-with open(DATASET_FILENAME, "w", encoding="utf-8") as f:
-    json.dump(dataset_chunks, f, ensure_ascii=False, indent=2)
+    chunk_stats = write_store(
+        model, model_name, model_key, "chunks", texts_for_embedding, dataset_chunks,
+        batch_size, dtype, incremental
+    )
+
+    # One embedding of the full answer per question, for the bi-encoder rerank
+    answer_rows = [
+        {"question_id": f"{pair['id']:04d}", "hash": chunk_hash(model_name, "", pair["answer"])}
+        for pair in pairs
+    ]
+    answer_stats = write_store(
+        model, model_name, model_key, "answers", [pair["answer"] for pair in pairs], answer_rows,
+        batch_size, dtype, incremental
+    )
+
+    # Derived indexes are rebuilt only when they were built from another store version
+    store_version = chunk_stats["version"]
+    up_to_date: List[str] = []
+
+    # BM25 index over the same text the chunks were embedded from
+    lexical_start = time.time()
+    lexical_filename = BM25_FILENAME_TEMPLATE.format(model=model_key)
+    if saved_store_version(lexical_filename) == store_version:
+        up_to_date.append(lexical_filename)
+    else:
+        lexical_filename = build_lexical_index(model_key, texts_for_embedding)
+    lexical_time = time.time() - lexical_start
+
+    # Build the ANN index from the published store
+    ann_time = 0.0
+    if dataset_chunks and (ann == "always" or (ann == "auto" and len(dataset_chunks) >= ANN_MIN_CORPUS)):
+        ann_filename = ANN_FILENAME_TEMPLATE.format(model=model_key)
+        if saved_store_version(ann_filename) == store_version:
+            up_to_date.append(ann_filename)
+        else:
+            ann_start = time.time()
+            ann_filename = build_ann_index(model_key)
+            ann_time = time.time() - ann_start
+            print(f"[{model_name}] built IVF index {ann_filename} in {ann_time:.2f} seconds")
+
+    # int8 / binary codes for the quantized first stage
+    quant_start = time.time()
+    quant_filenames: Tuple[str, ...] = ()
+    for mode in (quantize if dataset_chunks else ()):
+        quant_filename = QUANT_FILENAME_TEMPLATE.format(mode=mode, model=model_key)
+        if saved_store_version(quant_filename) == store_version:
+            up_to_date.append(quant_filename)
+        else:
+            quant_filenames += (build_quantized_index(model_key, mode),)
+    quant_time = time.time() - quant_start
+
+    # Row-range shard files for scatter-gather search
+    shard_time = 0.0
+    if dataset_chunks and shards > 0:
+        shard_manifest = SHARD_MANIFEST_TEMPLATE.format(model=model_key)
+        manifest = None
+        if saved_store_version(shard_manifest) == store_version:
+            with open(shard_manifest, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        if manifest is not None and len(manifest["shards"]) == shards:
+            up_to_date.append(shard_manifest)
+        else:
+            shard_start = time.time()
+            shard_manifest = build_shards(model_key, shards)
+            shard_time = time.time() - shard_start
+            print(f"[{model_name}] split the store into {shards} shards ({shard_manifest}) in {shard_time:.2f} seconds")
+
+    if up_to_date:
+        print(f"[{model_name}] up to date with store version {store_version}: {', '.join(up_to_date)}")
+
+    # Save raw pairs JSON
+    with open(raw_filename, "w", encoding="utf-8") as f:
+        json.dump(pairs, f, ensure_ascii=False, indent=4)
+
+    elapsed = time.time() - start_time
+    rebuilt = () if lexical_filename in up_to_date else (lexical_filename,)
+    saved = ", ".join(chunk_stats["paths"] + answer_stats["paths"] + rebuilt + quant_filenames + (raw_filename,))
+    print(f"[{model_name}] saved {saved} in {elapsed:.2f} seconds")
+
+    encode_time = chunk_stats["encode_seconds"]
+    return {
+        "model": model_name,
+        "questions": len(pairs),
+        "chunks": len(dataset_chunks),
+        "reused": chunk_stats["reused"],
+        "encoded": chunk_stats["encoded"],
+        "answers_encoded": answer_stats["encoded"],
+        "store_unchanged": chunk_stats["unchanged"],
+        "indexes_up_to_date": len(up_to_date),
+        "load_seconds": round(load_time, 3),
+        "encode_seconds": round(encode_time, 3),
+        "answers_encode_seconds": round(answer_stats["encode_seconds"], 3),
+        "lexical_seconds": round(lexical_time, 3),
+        "ann_seconds": round(ann_time, 3),
+        "quantize_seconds": round(quant_time, 3),
+        "shard_seconds": round(shard_time, 3),
+        "total_seconds": round(elapsed, 3),
+        "chunks_per_sec": round(chunk_stats["encoded"] / encode_time, 1) if encode_time > 0 else 0.0,
+    }
+
+
+def _init_worker(threads: int) -> None:
+    """Limit intra-op threads of a pool worker to its share of the CPU budget."""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+
+
+def build_indexes(
+    model_names: List[str],
+    source_folder: str = SOURCE_FOLDER,
+    workers: int = 1,
+    threads_per_worker: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    dtype: str = EMBEDDING_DTYPE,
+    incremental: bool = INCREMENTAL,
+    ann: str = "auto",
+    quantize: Sequence[str] = QUANTIZE,
+    shards: int = SHARDS
+) -> List[Dict[str, Any]]:
+    """
+    Build indexes for several models from one parse of the source folder.
+
+    Source files are parsed once; each model is then encoded in its own
+    worker process with a fixed thread budget.
+
+    Args:
+        model_names (List[str]): SentenceTransformer model names.
+        source_folder (str): Folder with source text files.
+        workers (int): Number of worker processes (1 = build in this process).
+        threads_per_worker (int, optional): Torch threads per worker; defaults to cpu_count // workers.
+        batch_size (int): Number of chunks per forward pass.
+        dtype (str): On-disk dtype of the embedding matrix.
+        incremental (bool): Reuse vectors of unchanged chunks.
+        ann (str): IVF index mode, one of ANN_MODES.
+        quantize (Sequence[str]): Quantized code files to build, from QUANT_MODES.
+        shards (int): Number of shard files for sharded search (0 = none).
+
+    Returns:
+        List[Dict[str, Any]]: Build statistics per model, in input order.
+    """
+    pairs = parse_pairs(read_source_lines(source_folder))
+    print(f"Found {len(pairs)} question-answer pairs in '{source_folder}'")
+
+    workers = max(1, min(workers, len(model_names)))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    # Same options for the serial and the process-pool path
+    options = dict(
+        batch_size=batch_size, dtype=dtype, incremental=incremental, ann=ann, quantize=quantize, shards=shards
+    )
+
+    if workers == 1:
+        _init_worker(threads_per_worker)
+        return [build_index(name, pairs, **options) for name in model_names]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads_per_worker,)
+    ) as pool:
+        futures = [
+            pool.submit(build_index, name, pairs, **options)
+            for name in model_names
+        ]
+        return [future.result() for future in futures]
+
+
+# -------------------------------
+# Command line interface
+# -------------------------------
+def resolve_model(value: str) -> str:
+    """Accept a model name or its 1-based number in AVAILABLE_MODELS."""
+    if value.isdigit():
+        number = int(value)
+        if not 1 <= number <= len(AVAILABLE_MODELS):
+            raise argparse.ArgumentTypeError(f"Enter a number between 1 and {len(AVAILABLE_MODELS)}")
+        return AVAILABLE_MODELS[number - 1]
+    return value
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Command line entry point."""
+    available = "\n".join(f"  {idx}. {m}" for idx, m in enumerate(AVAILABLE_MODELS, 1))
+    parser = argparse.ArgumentParser(
+        description="Build embedding indexes from the source folder.",
+        epilog=f"Available models:\n{available}",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("models", nargs="*", type=resolve_model, help="Model names or numbers")
+    parser.add_argument("--all", action="store_true", help="Build all available models")
+    parser.add_argument("--source", default=SOURCE_FOLDER, help="Source folder")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (one model per worker)")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Torch threads per worker")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Chunks per forward pass")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default=EMBEDDING_DTYPE, help="On-disk dtype")
+    parser.add_argument("--full", action="store_true", help="Re-encode everything instead of reusing unchanged chunks")
+    parser.add_argument("--ann", choices=ANN_MODES, default="auto",
+                        help=f"Build the IVF index (auto: from {ANN_MIN_CORPUS} chunks)")
+    parser.add_argument("--quantize", nargs="*", choices=QUANT_MODES, default=list(QUANTIZE),
+                        help="Quantized codes to build (none: pass the flag without values)")
+    parser.add_argument("--shards", type=int, default=SHARDS, help="Split the store into N shards for sharded search")
+    parser.add_argument("--stats-json", default=None, help="Write build statistics to this JSON file")
+    args = parser.parse_args(argv)
+
+    model_names = list(AVAILABLE_MODELS) if args.all else list(dict.fromkeys(args.models))
+    if not model_names:
+        parser.error("no models given (pass model names/numbers or --all)")
+
+    stats = build_indexes(
+        model_names,
+        source_folder=args.source,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        batch_size=args.batch_size,
+        dtype=args.dtype,
+        incremental=not args.full,
+        ann=args.ann,
+        quantize=args.quantize,
+        shards=args.shards
+    )
+
+    for item in stats:
+        print(
+            f"{item['model']}: {item['chunks']} chunks ({item['encoded']} encoded, {item['reused']} reused), "
+            f"{item['chunks_per_sec']} chunks/sec, {item['total_seconds']} s"
+        )
+
+    if args.stats_json:
+        with open(args.stats_json, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+
+    return stats
 
-elapsed = time.time() - start_time
-print(f"Embeddings saved to {DATASET_FILENAME}")
-print(f"Elapsed time: {elapsed:.2f} seconds")
 
-input("Press Enter to exit...")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import numpy as np
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a cached value in bytes."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, (bytes, str)):
+        return len(value) + 49
+    return 64
+
+
+# -------------------------------
+# In-memory LRU cache
+# -------------------------------
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and total size in bytes,
+    with optional time-to-live and hit/miss counters.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = estimate_size
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value (and mark it recently used) or default."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Insert or replace a value, evicting least recently used entries if needed."""
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, time.monotonic(), size)
+            self.bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# -------------------------------
+# Disk tier (SQLite)
+# -------------------------------
+class DiskCache:
+    """
+    Persistent key-value tier backed by SQLite, so cached values survive
+    restarts. Keys are strings, values are pickled. Entries older than the
+    TTL are ignored; the oldest entries are pruned beyond max_entries.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, created REAL)")
+        self._conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                (key, blob, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+# -------------------------------
+# Two-tier cache
+# -------------------------------
+class TieredCache:
+    """
+    In-memory LRU in front of an optional disk tier. Disk hits are promoted
+    to memory; new values are written to both tiers.
+    """
+
+    def __init__(self, memory: LRUCache, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return default if value is None else value
+
+    def put(self, key: str, value: Any) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+# -------------------------------
+# Semantic cache (nearest cached embedding)
+# -------------------------------
+class SemanticCache:
+    """
+    Thread-safe LRU cache looked up by embedding similarity instead of key.
+
+    Entries live in a preallocated (max_entries, dim) matrix of unit-length
+    vectors, so a lookup is one matrix-vector product over the entries of
+    the same scope (e.g. request flags). A lookup hits when the best cosine
+    similarity reaches the threshold. All entries are dropped when the
+    version (e.g. of the search index) changes.
+    """
+
+    def __init__(self, max_entries: int = 1024, threshold: float = 0.95, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.version = ""
+        self._vectors: Optional[np.ndarray] = None  # allocated on the first put, when dim is known
+        self._scope_codes = np.full(max_entries, -1, dtype=np.int64)
+        self._scopes: Dict[Hashable, int] = {}
+        self._entries: "OrderedDict[int, Tuple[Any, float]]" = OrderedDict()  # slot -> (value, created)
+        self._free = list(range(max_entries))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def use_version(self, version: str) -> None:
+        """Drop all entries if the version changed."""
+        with self._lock:
+            if version != self.version:
+                self._clear()
+                self.version = version
+
+    def lookup(self, vector: np.ndarray, scope: Hashable) -> Tuple[Any, float]:
+        """
+        Return (value, similarity) of the most similar entry in the scope,
+        or (None, best similarity) if none reaches the threshold.
+        """
+        q = self._unit(vector)
+        with self._lock:
+            code = self._scopes.get(scope)
+            slots = np.flatnonzero(self._scope_codes == code) if code is not None else np.empty(0, dtype=np.int64)
+            best_slot, best = -1, 0.0
+            if len(slots):
+                similarities = self._vectors[slots] @ q
+                position = int(np.argmax(similarities))
+                best_slot, best = int(slots[position]), float(similarities[position])
+
+            if best_slot >= 0 and best >= self.threshold:
+                value, created = self._entries[best_slot]
+                if self.ttl is None or time.monotonic() - created <= self.ttl:
+                    self._entries.move_to_end(best_slot)
+                    self.hits += 1
+                    return value, best
+                self._remove(best_slot)
+            self.misses += 1
+            return None, best
+
+    def put(self, vector: np.ndarray, scope: Hashable, value: Any) -> None:
+        """Insert a value, evicting the least recently used entry when full."""
+        q = self._unit(vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != q.shape[0]:
+                self._vectors = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+                self._clear()
+            if len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            slot = self._free.pop()
+            self._vectors[slot] = q
+            self._scope_codes[slot] = self._scopes.setdefault(scope, len(self._scopes))
+            self._entries[slot] = (value, time.monotonic())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._free = list(range(self.max_entries))
+        self._scope_codes[:] = -1
+        self._scopes.clear()
+
+    def _remove(self, slot: int) -> None:
+        del self._entries[slot]
+        self._free.append(slot)
+        self._scope_codes[slot] = -1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,145 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+# Tokens of source text in the RAG prompt. n_ctx=4096 also has to hold the
+# instruction, the question and the generated answer (max_tokens=100).
+CONTEXT_TOKEN_BUDGET = 1536
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge overlapping or adjacent [start, end) word spans."""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def truncate_to_tokens(text: str, limit: int, count_tokens: Callable[[str], int]) -> str:
+    """Longest word prefix of text with at most `limit` tokens (binary search)."""
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+
+class SourceBlock:
+    """
+    Selected text of one question, rendered as a "Source n" block.
+
+    Chunks with a known word offset are merged into contiguous spans, so
+    the CHUNK_OVERLAP words shared by neighbouring windows appear once;
+    chunks without an offset (stores built before 'word_start' existed)
+    are only deduplicated by exact text.
+    """
+
+    def __init__(self, index: int, title: str):
+        self.index = index
+        self.title = title
+        self.words: Dict[int, str] = {}
+        self.spans: List[Tuple[int, int]] = []
+        self.loose: List[str] = []
+        self.chunks = 0
+        self.tokens = 0
+
+    def render(self, spans: Optional[List[Tuple[int, int]]] = None, loose: Optional[List[str]] = None) -> str:
+        spans = self.spans if spans is None else spans
+        loose = self.loose if loose is None else loose
+        parts = [" ".join(self.words[i] for i in range(start, end)) for start, end in spans] + loose
+        text = " ... ".join(parts)
+        return f"Source {self.index}: {self.title}\n{text}\n"
+
+
+# -------------------------------
+# Context packing
+# -------------------------------
+def pack_context(
+    top_answers: List[Dict[str, Any]],
+    raw_data: Dict[int, Dict[str, Any]],
+    count_tokens: Callable[[str], int],
+    budget: int = CONTEXT_TOKEN_BUDGET
+) -> List[str]:
+    """
+    Fill a token budget with the highest-scoring chunks of the top answers.
+
+    Chunks of all answers are taken best score first (the 'chunk_scores'
+    from search_top_k, or the cross-encoder chunk scores); a chunk is
+    skipped when its words are already covered or when adding it would
+    exceed the budget. Answers without chunk fields contribute their full
+    answer at the answer score. If not even the best chunk fits, it is
+    truncated to the budget so the context is never empty.
+
+    Args:
+        top_answers (List[Dict]): Reranked results with 'id', 'score' and optional
+            'chunk_texts', 'chunk_starts', 'chunk_scores'.
+        raw_data (Dict): Question id -> record with 'question' and 'answer'.
+        count_tokens (Callable[[str], int]): Tokenizer of the generation model.
+        budget (int): Maximum number of tokens of all source blocks together.
+
+    Returns:
+        List[str]: Source blocks ordered by their best chunk, for rag_generation().
+    """
+    candidates: List[Tuple[float, int, Optional[int], str]] = []
+    for record in top_answers:
+        texts = record.get("chunk_texts") or [raw_data[record["id"]]["answer"]]
+        starts = record.get("chunk_starts") or [None] * len(texts)
+        scores = record.get("chunk_scores") or [record["score"]] * len(texts)
+        for text, start, score in zip(texts, starts, scores):
+            candidates.append((float(score), record["id"], start, text))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    blocks: Dict[int, SourceBlock] = {}
+    used = 0
+    skipped = 0
+    for score, question_id, start, text in candidates:
+        block = blocks.get(question_id) or SourceBlock(len(blocks), raw_data[question_id]["question"])
+        spans, loose = block.spans, block.loose
+        words = text.split()
+        if start is not None:
+            spans = merge_spans(block.spans + [(start, start + len(words))])
+            if spans == block.spans:
+                continue  # fully covered by chunks already selected
+            block.words.update(zip(range(start, start + len(words)), words))
+        else:
+            if text in block.loose:
+                continue
+            loose = block.loose + [text]
+
+        tokens = count_tokens(block.render(spans, loose))
+        if used + tokens - block.tokens > budget:
+            if used > 0:
+                skipped += 1
+                continue
+            # Nothing selected yet: truncate the best chunk instead of sending no context
+            header = count_tokens(block.render([], [""]))
+            spans, loose = [], [truncate_to_tokens(text, budget - header, count_tokens)]
+            tokens = count_tokens(block.render(spans, loose))
+
+        used += tokens - block.tokens
+        block.spans, block.loose, block.tokens = spans, loose, tokens
+        block.chunks += 1
+        blocks[question_id] = block
+
+    logger.info(
+        f"Context: {sum(block.chunks for block in blocks.values())} chunks from {len(blocks)} sources, "
+        f"{used}/{budget} tokens, {skipped} chunks over budget"
+    )
+    return [block.render() for block in blocks.values()]
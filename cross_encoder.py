@@ -1,28 +1,112 @@
 from sentence_transformers import CrossEncoder
 import logging
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+from cache import LRUCache
+from batching import MicroBatcher
+from model_registry import registry
+from inference_backend import load_cross_encoder
+from text_utils import normalize_text
+from model_config import CROSS_ENCODER_MODEL
 
 # -------------------------------
 # Constants
 # -------------------------------
-CROSS_ENCODER_MODEL = "jinaai/jina-reranker-v2-base-multilingual"
 DEVICE = "cpu"
+RERANKER_BACKEND = "torch"  # See inference_backend.BACKENDS, e.g. "onnx-int8" after exporting
+SCORE_CACHE_MAX_ENTRIES = 50000  # Cached (question, candidate) scores
+PREDICT_MAX_BATCH_SIZE = 32  # Pairs scored in one forward pass
+PREDICT_MAX_WAIT_MS = 2.0  # How long to wait for pairs from other requests
+
+RERANK_MODE = "chunk"  # "chunk": best chunks per question, "answer": full answers
+CHUNK_MAX_WORDS = 160  # Length cap of a chunk in (question, chunk) pairs
+CHUNK_AGGREGATION = "max"  # Chunk scores -> question score: "max" or "mean"
+EARLY_CUTOFF_MARGIN = 0.1  # Skip candidates this far below the leader's retrieval score (None = off)
+EARLY_CUTOFF_MIN_KEEP = 1  # Candidates always kept by the early cut-off (the leader at least)
 
 # -------------------------------
 # Configure logger
 # -------------------------------
 logger = logging.getLogger(__name__)
-logger.info("Initializing Cross-Encoder reranker...")
 
 # -------------------------------
-# Initialize CrossEncoder model
+# Register CrossEncoder model (loaded on first use)
 # -------------------------------
-reranker = CrossEncoder(
+registry.register("reranker", lambda: load_cross_encoder(
     CROSS_ENCODER_MODEL,
+    RERANKER_BACKEND,
     device=DEVICE,
     trust_remote_code=True
+))
+
+
+def get_reranker() -> CrossEncoder:
+    """Return the CrossEncoder model, loading it on first use."""
+    return registry.get("reranker")
+
+
+# Coalesce pairs from concurrent requests into one predict() call
+predict_batcher = MicroBatcher(
+    lambda pairs: get_reranker().predict(pairs),
+    max_batch_size=PREDICT_MAX_BATCH_SIZE,
+    max_wait_ms=PREDICT_MAX_WAIT_MS,
+    name="cross_encoder"
 )
-logger.info(f"Cross-Encoder reranker '{CROSS_ENCODER_MODEL}' successfully loaded.")
+
+# -------------------------------
+# Score cache: (index version, normalized question, candidate id) -> score
+# -------------------------------
+score_cache = LRUCache(SCORE_CACHE_MAX_ENTRIES, sizeof=lambda value: 1)
+_score_cache_version = ""
+_score_cache_lock = threading.Lock()
+
+
+def _use_index_version(index_version: str) -> None:
+    """Drop all cached scores once the dataset has been rebuilt."""
+    global _score_cache_version
+    with _score_cache_lock:
+        if index_version != _score_cache_version:
+            score_cache.clear()
+            _score_cache_version = index_version
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def early_cutoff(
+    top_chunk_results: List[Dict[str, Any]],
+    margin: Optional[float],
+    keep: int = EARLY_CUTOFF_MIN_KEEP
+) -> List[Dict[str, Any]]:
+    """
+    Drop candidates whose retrieval score is more than `margin` below the leader.
+
+    The compared 'score' is whatever retrieval returned: the bi-encoder
+    cosine similarity, or the fused dense + BM25 score when HYBRID_FUSION
+    is on ("weighted" stays on the cosine scale, "rrf" scores are reciprocal
+    ranks and need a much smaller margin). At least `keep`
+    candidates (the best ones) are always kept, independent of top_k.
+    """
+    if margin is None or not top_chunk_results:
+        return top_chunk_results
+    ranked = sorted(top_chunk_results, key=lambda x: x["score"], reverse=True)
+    threshold = ranked[0]["score"] - margin
+    return [item for i, item in enumerate(ranked) if i < keep or item["score"] >= threshold]
+
+
+def cached_scores(question: str, keys: List[Tuple], texts: List[str]) -> List[float]:
+    """
+    Cross-encoder scores of (question, text) pairs, predicting only cache misses (in one batch).
+    """
+    scores = [score_cache.get(key) for key in keys]
+    misses = [i for i, score in enumerate(scores) if score is None]
+    if misses:
+        pairs = [(question, texts[i]) for i in misses]
+        for i, score in zip(misses, predict_batcher.run(pairs)):
+            scores[i] = float(score)
+            score_cache.put(keys[i], scores[i])
+    return scores
 
 
 # -------------------------------
@@ -32,30 +116,68 @@ def rerank_questions_cross_encoder(
     top_chunk_results: List[Dict[str, Any]],
     raw_data: Dict[str, Dict[str, str]],
     question: str,
-    top_k: int = 3
+    top_k: int = 3,
+    index_version: str = "",
+    mode: str = RERANK_MODE,
+    aggregation: str = CHUNK_AGGREGATION,
+    cutoff_margin: Optional[float] = EARLY_CUTOFF_MARGIN
 ) -> List[Dict[str, Any]]:
     """
     Rerank candidate answers using a Cross-Encoder.
 
+    In "chunk" mode each candidate is scored on its best chunks from
+    search_top_k (capped at CHUNK_MAX_WORDS words) and chunk scores are
+    aggregated per question; in "answer" mode on its full answer. In both
+    modes candidates far below the retrieval leader are skipped first.
+
     Args:
         top_chunk_results (List[Dict]): List of candidate chunks with at least 'id' key.
         raw_data (Dict): Dictionary mapping chunk IDs to data containing 'answer'.
         question (str): The question to compare against candidate answers.
         top_k (int): Number of top results to return.
+        index_version (str): Version of the dataset; cached scores of other versions are dropped.
+        mode (str): "chunk" or "answer".
+        aggregation (str): "max" or "mean" of chunk scores (chunk mode).
+        cutoff_margin (float, optional): Retrieval score margin for the early cut-off.
 
     Returns:
-        List[Dict]: Top-k chunks with their reranked scores.
+        List[Dict]: Top-k results with their reranked scores (chunk fields kept,
+        'chunk_scores' replaced by cross-encoder scores in chunk mode).
     """
-    # Build pairs: (question, candidate answer)
-    pairs = [(question, raw_data[item["id"]]['answer']) for item in top_chunk_results]
+    _use_index_version(index_version)
+    cache_question = normalize_text(question)
+    candidates = early_cutoff(top_chunk_results, cutoff_margin)
+
+    if mode == "chunk" and all(item.get("chunk_texts") for item in candidates):
+        # Build pairs: (question, best chunk), flattened over all candidates
+        keys: List[Tuple] = []
+        texts: List[str] = []
+        owners: List[int] = []
+        for n, item in enumerate(candidates):
+            for row, text in zip(item["chunk_rows"], item["chunk_texts"]):
+                keys.append((index_version, cache_question, "chunk", row))
+                texts.append(" ".join(text.split()[:CHUNK_MAX_WORDS]))
+                owners.append(n)
+
+        chunk_scores = cached_scores(question, keys, texts)
 
-    # Compute relevance scores using the cross-encoder
-    scores = reranker.predict(pairs)
+        # Aggregate chunk scores to question level
+        per_candidate: List[List[float]] = [[] for _ in candidates]
+        for n, score in zip(owners, chunk_scores):
+            per_candidate[n].append(score)
+        combine = max if aggregation == "max" else (lambda values: sum(values) / len(values))
+        scores = [combine(values) for values in per_candidate]
+        # Keep the cross-encoder chunk scores for context packing
+        candidates = [{**item, "chunk_scores": values} for item, values in zip(candidates, per_candidate)]
+    else:
+        # Build pairs: (question, candidate answer)
+        keys = [(index_version, cache_question, "answer", item["id"]) for item in candidates]
+        scores = cached_scores(question, keys, [raw_data[item["id"]]['answer'] for item in candidates])
 
     # Combine each item with its score
     reranked = [
-        {"id": item["id"], "score": score}
-        for item, score in zip(top_chunk_results, scores)
+        {**item, "score": score}
+        for item, score in zip(candidates, scores)
     ]
 
     # Sort by score descending
@@ -0,0 +1,199 @@
+import os
+import json
+import uuid
+from typing import List, Dict, Any, Tuple
+import numpy as np
+
+# -------------------------------
+# Constants
+# -------------------------------
+EMBEDDINGS_FILENAME_TEMPLATE = "data/embeddings_{model}.npy"
+CHUNKS_FILENAME_TEMPLATE = "data/chunks_{model}.json"
+ANSWER_EMBEDDINGS_FILENAME_TEMPLATE = "data/answer_embeddings_{model}.npy"
+ANSWERS_FILENAME_TEMPLATE = "data/answers_{model}.json"
+
+# Store kind -> (matrix template, metadata template, metadata key of the row list)
+STORE_KINDS = {
+    "chunks": (EMBEDDINGS_FILENAME_TEMPLATE, CHUNKS_FILENAME_TEMPLATE, "chunks"),
+    "answers": (ANSWER_EMBEDDINGS_FILENAME_TEMPLATE, ANSWERS_FILENAME_TEMPLATE, "answers"),
+}
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+# -------------------------------
+# Paths
+# -------------------------------
+def store_paths(model_key: str, kind: str = "chunks") -> Tuple[str, str]:
+    """
+    Return (embeddings_path, metadata_path) for a sanitized model name.
+
+    kind is 'chunks' for the chunk store searched by the retriever or
+    'answers' for the per-question answer embeddings used in reranking.
+    """
+    matrix_template, metadata_template, _ = STORE_KINDS[kind]
+    return (
+        matrix_template.format(model=model_key),
+        metadata_template.format(model=model_key),
+    )
+
+
+# -------------------------------
+# Write store
+# -------------------------------
+class StoreWriter:
+    """
+    Streaming writer for the embedding store.
+
+    The matrix is allocated on disk up front and filled row by row as
+    batches are encoded, so peak memory does not grow with corpus size.
+    Files are written under temporary names and renamed on close(), so
+    running servers keep their old mapping until they restart.
+
+    Every store gets a fresh random 'version'; derived artifacts (ANN
+    indexes, caches) record it to detect that the store was rebuilt.
+    """
+
+    def __init__(
+        self,
+        model_key: str,
+        model_name: str,
+        count: int,
+        dim: int,
+        dtype: str = "float32",
+        normalized: bool = False,
+        kind: str = "chunks"
+    ):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+
+        self.model_name = model_name
+        self.dtype = dtype
+        self.normalized = normalized
+        self.version = uuid.uuid4().hex
+        self.rows_key = STORE_KINDS[kind][2]
+        self.embeddings_path, self.chunks_path = store_paths(model_key, kind)
+        self._tmp_path = self.embeddings_path + ".tmp.npy"
+        self._matrix = np.lib.format.open_memmap(self._tmp_path, mode="w+", dtype=dtype, shape=(count, dim))
+        self.rows_written = 0
+
+    def write(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        Write encoded vectors into the given row positions.
+
+        Args:
+            rows (np.ndarray): Target row indices.
+            vectors (np.ndarray): Matrix of shape (len(rows), dim).
+        """
+        self._matrix[rows] = vectors
+        self.rows_written += len(rows)
+
+    def close(self, chunks: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        Flush the matrix, write row metadata and publish both files.
+
+        Args:
+            chunks (List[Dict]): Per-row metadata (e.g. 'question_id', 'chunk_text').
+
+        Returns:
+            Tuple[str, str]: Paths of the written embeddings and chunks files.
+        """
+        count, dim = self._matrix.shape
+        if len(chunks) != count:
+            raise ValueError(f"Row count mismatch: {count} embeddings, {len(chunks)} chunks")
+
+        self._matrix.flush()
+        del self._matrix
+        os.replace(self._tmp_path, self.embeddings_path)
+
+        metadata = {
+            "version": self.version,
+            "model": self.model_name,
+            "dtype": self.dtype,
+            "count": int(count),
+            "dim": int(dim),
+            "normalized": self.normalized,
+            self.rows_key: chunks,
+        }
+        tmp_path = self.chunks_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        os.replace(tmp_path, self.chunks_path)
+
+        return self.embeddings_path, self.chunks_path
+
+
+def save_store(
+    model_key: str,
+    model_name: str,
+    embeddings: np.ndarray,
+    chunks: List[Dict[str, Any]],
+    dtype: str = "float32",
+    normalized: bool = False
+) -> Tuple[str, str]:
+    """
+    Save an in-memory embedding matrix and its chunk metadata in one go.
+
+    Args:
+        model_key (str): Sanitized model name used in file names.
+        model_name (str): Original model name, stored in metadata.
+        embeddings (np.ndarray): Matrix of shape (n_chunks, dim).
+        chunks (List[Dict]): Per-row metadata ('question_id', 'chunk_text').
+        dtype (str): On-disk dtype, 'float32' or 'float16'.
+        normalized (bool): Whether rows are unit-length.
+
+    Returns:
+        Tuple[str, str]: Paths of the written embeddings and chunks files.
+    """
+    count, dim = embeddings.shape
+    writer = StoreWriter(model_key, model_name, count, dim, dtype=dtype, normalized=normalized)
+    writer.write(np.arange(count), embeddings)
+    return writer.close(chunks)
+
+
+# -------------------------------
+# Load store
+# -------------------------------
+def load_store_metadata(model_key: str, kind: str = "chunks") -> Dict[str, Any]:
+    """
+    Load only the metadata of a store (version, row list), without opening the matrix.
+
+    Args:
+        model_key (str): Sanitized model name used in file names.
+        kind (str): Store kind, 'chunks' or 'answers'.
+
+    Returns:
+        Dict: Metadata dictionary.
+    """
+    _, chunks_path = store_paths(model_key, kind)
+    with open(chunks_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_store(model_key: str, mmap: bool = True, kind: str = "chunks") -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Load the embedding matrix (memory-mapped by default) and its metadata.
+
+    The matrix is opened read-only with mmap, so several worker processes
+    share one copy through the OS page cache.
+
+    Args:
+        model_key (str): Sanitized model name used in file names.
+        mmap (bool): Memory-map the matrix instead of reading it into RAM.
+        kind (str): Store kind, 'chunks' or 'answers'.
+
+    Returns:
+        Tuple[np.ndarray, Dict]: Embedding matrix and metadata dictionary.
+    """
+    embeddings_path, _ = store_paths(model_key, kind)
+    rows_key = STORE_KINDS[kind][2]
+    metadata = load_store_metadata(model_key, kind)
+
+    embeddings = np.load(embeddings_path, mmap_mode="r" if mmap else None)
+    if embeddings.shape[0] != len(metadata[rows_key]):
+        raise ValueError(
+            f"Store '{model_key}' ({kind}) is inconsistent: {embeddings.shape[0]} rows, "
+            f"{len(metadata[rows_key])} {rows_key}"
+        )
+
+    return embeddings, metadata
@@ -1,6 +1,6 @@
 import json
 import html
-from typing import Dict, Tuple
+from typing import Any, Dict, Tuple
 
 # Load replacement dictionary
 with open("data/replace.json", "r", encoding="utf-8") as f:
@@ -67,3 +67,17 @@ def format_result(
     result += "</div>"
 
     return result
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """
+    Format one Server-Sent Events message with a JSON payload.
+
+    Args:
+        event (str): Event name ('links', 'token', 'done' or 'error').
+        data (dict): JSON-serializable payload.
+
+    Returns:
+        str: SSE message terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
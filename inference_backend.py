@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import argparse
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from model_config import EMBEDDER_MODEL, CROSS_ENCODER_MODEL
+from embedding_store import load_store_metadata, store_paths
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+# "torch"      - fp32 PyTorch (reference)
+# "torch-int8" - PyTorch with dynamic int8 quantization of Linear layers
+# "onnx"       - exported ONNX graph on ONNX Runtime
+# "onnx-int8"  - exported ONNX graph with dynamic int8 quantization
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+EXPORT_DIR_TEMPLATE = "models/{kind}_{model}"
+QUANTIZATION_CONFIG = "avx2"  # "avx2", "avx512" or "avx512_vnni" (match the CPUs of the serving nodes)
+ONNX_FILE = "onnx/model.onnx"
+ONNX_INT8_FILE = f"onnx/model_qint8_{QUANTIZATION_CONFIG}.onnx"
+
+PARITY_SAMPLES = 64
+
+SAMPLE_TEXTS = [
+    "How do I reset my password?",
+    "The device does not turn on after the update.",
+    "Error code 0x80070005 when installing the product.",
+    "Which payment methods are supported?",
+]
+
+
+def export_dir(kind: str, model_name: str) -> str:
+    """Directory of the exported ONNX model for 'embedder' or 'reranker'."""
+    return EXPORT_DIR_TEMPLATE.format(kind=kind, model=model_name.replace("/", "-"))
+
+
+def _quantize_torch(module: Any) -> None:
+    """Dynamic int8 quantization of all Linear layers, in place."""
+    import torch
+    torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _onnx_source(kind: str, model_name: str, backend: str) -> Dict[str, Any]:
+    """Model path and model_kwargs for loading an exported ONNX graph."""
+    directory = export_dir(kind, model_name)
+    file_name = ONNX_INT8_FILE if backend == "onnx-int8" else ONNX_FILE
+    if not os.path.exists(os.path.join(directory, file_name)):
+        raise FileNotFoundError(
+            f"No exported {backend} model in '{directory}', run: "
+            f"python inference_backend.py export {kind} --model {model_name}"
+        )
+    return {"path": directory, "model_kwargs": {"file_name": file_name}}
+
+
+# -------------------------------
+# Loaders
+# -------------------------------
+def load_sentence_transformer(model_name: str, backend: str = "torch") -> Any:
+    """
+    Load a SentenceTransformer with the selected inference backend.
+
+    Args:
+        model_name (str): HuggingFace model name.
+        backend (str): One of BACKENDS.
+
+    Returns:
+        SentenceTransformer: Model ready for encode().
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    if backend.startswith("onnx"):
+        source = _onnx_source("embedder", model_name, backend)
+        return SentenceTransformer(source["path"], backend="onnx", model_kwargs=source["model_kwargs"])
+
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "torch-int8":
+        _quantize_torch(model)
+    return model
+
+
+def load_cross_encoder(model_name: str, backend: str = "torch", **kwargs: Any) -> Any:
+    """
+    Load a CrossEncoder with the selected inference backend.
+
+    Args:
+        model_name (str): HuggingFace model name.
+        backend (str): One of BACKENDS.
+        **kwargs: Passed to CrossEncoder (e.g. device, trust_remote_code).
+
+    Returns:
+        CrossEncoder: Model ready for predict().
+    """
+    from sentence_transformers import CrossEncoder
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    if backend.startswith("onnx"):
+        source = _onnx_source("reranker", model_name, backend)
+        return CrossEncoder(source["path"], backend="onnx", model_kwargs=source["model_kwargs"], **kwargs)
+
+    model = CrossEncoder(model_name, **kwargs)
+    if backend == "torch-int8":
+        _quantize_torch(model.model)
+    return model
+
+
+# -------------------------------
+# Export
+# -------------------------------
+def export_onnx(kind: str, model_name: str, trust_remote_code: bool = False) -> str:
+    """
+    Export a model to ONNX and add a dynamically int8-quantized copy.
+
+    Args:
+        kind (str): 'embedder' or 'reranker'.
+        model_name (str): HuggingFace model name.
+        trust_remote_code (bool): Allow custom model code (needed by some rerankers).
+
+    Returns:
+        str: Export directory.
+    """
+    from sentence_transformers import SentenceTransformer, CrossEncoder, export_dynamic_quantized_onnx_model
+
+    directory = export_dir(kind, model_name)
+    if kind == "embedder":
+        model = SentenceTransformer(model_name, backend="onnx", trust_remote_code=trust_remote_code)
+    else:
+        model = CrossEncoder(model_name, backend="onnx", trust_remote_code=trust_remote_code)
+
+    model.save_pretrained(directory)
+    export_dynamic_quantized_onnx_model(model, QUANTIZATION_CONFIG, directory)
+    return directory
+
+
+# -------------------------------
+# Parity check
+# -------------------------------
+def _sample_texts(model_name: str, limit: int = PARITY_SAMPLES) -> List[str]:
+    """Chunk texts of the built index if available, built-in samples otherwise."""
+    model_key = model_name.replace("/", "-")
+    _, chunks_path = store_paths(model_key)
+    if os.path.exists(chunks_path):
+        chunks = load_store_metadata(model_key)["chunks"]
+        texts = [item["chunk_text"] for item in chunks[:limit]]
+        if texts:
+            return texts
+    return SAMPLE_TEXTS
+
+
+def _timed(fn: Any, *args: Any) -> Any:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def parity_embedder(model_name: str, backend: str, texts: List[str]) -> Dict[str, Any]:
+    """Cosine similarity between fp32 and candidate-backend embeddings."""
+    reference = load_sentence_transformer(model_name, "torch")
+    candidate = load_sentence_transformer(model_name, backend)
+
+    ref, ref_seconds = _timed(lambda: reference.encode(texts, normalize_embeddings=True))
+    out, out_seconds = _timed(lambda: candidate.encode(texts, normalize_embeddings=True))
+    cosine = np.sum(np.asarray(ref) * np.asarray(out), axis=1)
+
+    return {
+        "model": model_name,
+        "backend": backend,
+        "samples": len(texts),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "reference_seconds": round(ref_seconds, 3),
+        "backend_seconds": round(out_seconds, 3),
+    }
+
+
+def parity_reranker(model_name: str, backend: str, texts: List[str], **kwargs: Any) -> Dict[str, Any]:
+    """Score deltas and top-1 agreement between fp32 and candidate-backend reranker."""
+    reference = load_cross_encoder(model_name, "torch", **kwargs)
+    candidate = load_cross_encoder(model_name, backend, **kwargs)
+
+    queries = SAMPLE_TEXTS
+    pairs = [(query, text) for query in queries for text in texts]
+    ref, ref_seconds = _timed(lambda: np.asarray(reference.predict(pairs), dtype=np.float32))
+    out, out_seconds = _timed(lambda: np.asarray(candidate.predict(pairs), dtype=np.float32))
+
+    delta = np.abs(ref - out)
+    ref_top = ref.reshape(len(queries), -1).argmax(axis=1)
+    out_top = out.reshape(len(queries), -1).argmax(axis=1)
+
+    return {
+        "model": model_name,
+        "backend": backend,
+        "pairs": len(pairs),
+        "score_delta_max": round(float(delta.max()), 5),
+        "score_delta_mean": round(float(delta.mean()), 5),
+        "top1_agreement": round(float(np.mean(ref_top == out_top)), 4),
+        "reference_seconds": round(ref_seconds, 3),
+        "backend_seconds": round(out_seconds, 3),
+    }
+
+
+# -------------------------------
+# Command line interface
+# -------------------------------
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Export ONNX models and check their parity with the fp32 reference."""
+    parser = argparse.ArgumentParser(description="Export and verify quantized / ONNX inference backends.")
+    parser.add_argument("command", choices=("export", "parity"))
+    parser.add_argument("kind", choices=("embedder", "reranker"))
+    parser.add_argument("--model", default=None, help="Model name (default: the one used by the server)")
+    parser.add_argument("--backend", choices=BACKENDS, default="onnx-int8", help="Backend to compare (parity)")
+    parser.add_argument("--corpus-model", default=None,
+                        help="Take parity texts from the chunk store of this embedding model")
+    args = parser.parse_args(argv)
+
+    model_name = args.model or (EMBEDDER_MODEL if args.kind == "embedder" else CROSS_ENCODER_MODEL)
+
+    if args.command == "export":
+        report = {"exported": export_onnx(args.kind, model_name, trust_remote_code=args.kind == "reranker")}
+    elif args.kind == "embedder":
+        report = parity_embedder(model_name, args.backend, _sample_texts(args.corpus_model or model_name))
+    else:
+        texts = _sample_texts(args.corpus_model)[:16] if args.corpus_model else SAMPLE_TEXTS
+        report = parity_reranker(model_name, args.backend, texts, device="cpu", trust_remote_code=True)
+
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
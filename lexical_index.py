@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import argparse
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+from embedding_store import load_store
+from text_utils import normalize_text
+from vector_search import top_k
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+BM25_FILENAME_TEMPLATE = "data/bm25_{model}.npz"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_POSTINGS_PER_TERM = 20000  # Highest-impact postings scanned per query term (bounds common words)
+RRF_K = 60  # Rank offset of reciprocal rank fusion
+TERM_PREFIX_BYTES = 8  # Leading UTF-8 bytes of every term packed into one uint64 search key
+
+
+def tokenize(text: str) -> List[str]:
+    """Index terms of a text: normalize_text() words, so codes and error strings match verbatim."""
+    return normalize_text(text).split()
+
+
+def term_prefixes(term_blob: np.ndarray, term_bounds: np.ndarray) -> np.ndarray:
+    """
+    First TERM_PREFIX_BYTES bytes of every term as big-endian uint64 keys
+    (zero-padded), which sort in the same order as the terms themselves.
+    """
+    starts = term_bounds[:-1, None] + np.arange(TERM_PREFIX_BYTES)
+    inside = starts < term_bounds[1:, None]
+    padded = np.zeros(starts.shape, dtype=np.uint8)
+    padded[inside] = term_blob[starts[inside]]
+    return padded.view(">u8").ravel().astype(np.uint64)
+
+
+# -------------------------------
+# BM25 inverted index
+# -------------------------------
+class BM25Index:
+    """
+    BM25 inverted index over the chunk texts.
+
+    Postings are stored CSR-style like the IVF lists:
+    `posting_docs[term_offsets[t]:term_offsets[t + 1]]` are the chunk rows
+    containing term t and `posting_impacts` their precomputed BM25 term
+    scores (idf * saturated tf), each list sorted by impact descending so
+    a query can stop after the MAX_POSTINGS_PER_TERM best postings of a
+    very common term. A query is a few term lookups and one segment-sum
+    over the touched postings.
+
+    The vocabulary is one sorted UTF-8 blob: term t is
+    `term_blob[term_bounds[t]:term_bounds[t + 1]]`. Terms are looked up by
+    np.searchsorted over their 8-byte prefixes and a byte comparison within
+    the (usually single) matching prefix range, so no Python string or dict
+    per term is held in memory.
+    """
+
+    name = "bm25"
+
+    def __init__(
+        self,
+        term_blob: np.ndarray,
+        term_bounds: np.ndarray,
+        term_offsets: np.ndarray,
+        posting_docs: np.ndarray,
+        posting_impacts: np.ndarray,
+        store_version: str = ""
+    ):
+        self.term_blob = term_blob
+        self.term_bounds = term_bounds
+        self.term_prefixes = term_prefixes(term_blob, term_bounds)
+        self.term_offsets = term_offsets
+        self.posting_docs = posting_docs
+        self.posting_impacts = posting_impacts
+        self.store_version = store_version
+
+    @classmethod
+    def build(cls, texts: List[str], store_version: str = "", k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """
+        Build the index from the texts of all chunks (row i = chunk i of the store).
+
+        Args:
+            texts (List[str]): Chunk texts in store order.
+            store_version (str): Version of the store the index is built from.
+            k1 (float): BM25 term-frequency saturation.
+            b (float): BM25 length normalization.
+
+        Returns:
+            BM25Index: Built index.
+        """
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        frequencies: List[int] = []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc)
+                frequencies.append(tf)
+
+        terms = np.array(term_ids, dtype=np.int64)
+        docs = np.array(doc_ids, dtype=np.int32)
+        tf = np.array(frequencies, dtype=np.float32)
+
+        df = np.bincount(terms, minlength=len(vocabulary)).astype(np.float32)
+        idf = np.log1p((len(texts) - df + 0.5) / (df + 0.5))
+        avg_length = float(lengths.mean()) if len(texts) else 1.0
+        norm = k1 * (1 - b + b * lengths[docs] / max(avg_length, 1e-6))
+        impacts = (idf[terms] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+        # Renumber terms in sorted order (UTF-8 byte order == code point order)
+        sorted_terms = sorted(vocabulary)
+        rank = np.empty(len(vocabulary), dtype=np.int64)
+        rank[[vocabulary[term] for term in sorted_terms]] = np.arange(len(vocabulary))
+        terms = rank[terms]
+        df = df[np.argsort(rank)]
+
+        encoded = [term.encode("utf-8") for term in sorted_terms]
+        term_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        term_bounds = np.concatenate(([0], np.cumsum([len(term) for term in encoded], dtype=np.int64)))
+
+        # Group by term, best impact first inside each list
+        order = np.lexsort((-impacts, terms))
+        term_offsets = np.concatenate(([0], np.cumsum(df.astype(np.int64))))
+
+        return cls(term_blob, term_bounds, term_offsets, docs[order], impacts[order], store_version=store_version)
+
+    def term_id(self, term: str) -> Optional[int]:
+        """Row of a term in the sorted vocabulary, or None if it is not indexed."""
+        encoded = term.encode("utf-8")
+        key = np.uint64(int.from_bytes(encoded[:TERM_PREFIX_BYTES].ljust(TERM_PREFIX_BYTES, b"\0"), "big"))
+        lo = int(np.searchsorted(self.term_prefixes, key, side="left"))
+        hi = int(np.searchsorted(self.term_prefixes, key, side="right"))
+        # Terms sharing the prefix are sorted too: bisect them on the full bytes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate = self.term_blob[self.term_bounds[mid]:self.term_bounds[mid + 1]].tobytes()
+            if candidate == encoded:
+                return mid
+            if candidate < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def save(self, path: str) -> None:
+        """Save the index as a .npz file (written to a temp file, then renamed)."""
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            term_blob=self.term_blob,
+            term_bounds=self.term_bounds,
+            term_offsets=self.term_offsets,
+            posting_docs=self.posting_docs,
+            posting_impacts=self.posting_impacts,
+            store_version=np.array(self.store_version)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Load an index saved with save()."""
+        with np.load(path) as data:
+            return cls(
+                data["term_blob"],
+                data["term_bounds"],
+                data["term_offsets"],
+                data["posting_docs"],
+                data["posting_impacts"],
+                store_version=str(data["store_version"])
+            )
+
+    def search(self, text: str, k: int, max_postings: int = MAX_POSTINGS_PER_TERM) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 top-k chunk rows of a query text.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (rows, scores) sorted by score descending.
+        """
+        docs: List[np.ndarray] = []
+        impacts: List[np.ndarray] = []
+        for term in set(tokenize(text)):
+            t = self.term_id(term)
+            if t is None:
+                continue
+            start = self.term_offsets[t]
+            end = min(self.term_offsets[t + 1], start + max_postings)
+            docs.append(self.posting_docs[start:end])
+            impacts.append(self.posting_impacts[start:end])
+
+        if not docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(impacts)).astype(np.float32)
+        idxs, best = top_k(scores, k)
+        return rows[idxs].astype(np.int64), best
+
+
+def load_lexical_index(model_key: str, metadata: Dict[str, Any]) -> Optional[BM25Index]:
+    """
+    Load the BM25 index for a store, or None when it is missing or was
+    built from a different store version.
+    """
+    path = BM25_FILENAME_TEMPLATE.format(model=model_key)
+    if not os.path.exists(path):
+        return None
+
+    index = BM25Index.load(path)
+    if index.store_version != metadata.get("version", ""):
+        return None
+    return index
+
+
+def build_lexical_index(model_key: str, texts: List[str]) -> str:
+    """
+    Build the BM25 index for an existing store and save it next to it.
+
+    Args:
+        model_key (str): Sanitized model name of the store.
+        texts (List[str]): Indexed text of every chunk, in store order.
+
+    Returns:
+        str: Path of the written index file.
+    """
+    _, metadata = load_store(model_key)
+    if len(texts) != metadata["count"]:
+        raise ValueError(f"Got {len(texts)} texts for a store of {metadata['count']} chunks")
+    index = BM25Index.build(texts, store_version=metadata.get("version", ""))
+    path = BM25_FILENAME_TEMPLATE.format(model=model_key)
+    index.save(path)
+    return path
+
+
+# -------------------------------
+# Fusion of dense and lexical results
+# -------------------------------
+def fuse_rrf(
+    dense: Tuple[np.ndarray, np.ndarray],
+    lexical: Tuple[np.ndarray, np.ndarray],
+    rrf_k: int = RRF_K
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reciprocal rank fusion: score = sum over lists of 1 / (rrf_k + rank).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (rows, fused scores) sorted descending.
+    """
+    rows = np.concatenate((dense[0], lexical[0]))
+    ranks = np.concatenate((np.arange(len(dense[0])), np.arange(len(lexical[0])))) + 1
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=1.0 / (rrf_k + ranks)).astype(np.float32)
+    idxs, best = top_k(scores, len(scores))
+    return unique_rows[idxs], best
+
+
+def fuse_weighted(
+    dense: Tuple[np.ndarray, np.ndarray],
+    lexical: Tuple[np.ndarray, np.ndarray],
+    dense_scores: Callable[[np.ndarray], np.ndarray],
+    weight: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted fusion: cosine + weight * BM25 / best BM25 of the query.
+
+    Rows found only lexically are scored densely with dense_scores(rows);
+    rows found only densely get no lexical part. Fused scores stay on the
+    cosine scale, so score margins downstream keep their meaning.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (rows, fused scores) sorted descending.
+    """
+    dense_rows, dense_best = dense
+    lexical_rows, lexical_best = lexical
+
+    extra = np.setdiff1d(lexical_rows, dense_rows)
+    rows = np.concatenate((dense_rows, extra))
+    scores = np.concatenate((dense_best, dense_scores(extra))).astype(np.float32)
+
+    if len(lexical_rows) and lexical_best[0] > 0:
+        positions = {row: i for i, row in enumerate(rows.tolist())}
+        lexical_positions = np.array([positions[row] for row in lexical_rows.tolist()], dtype=np.int64)
+        scores[lexical_positions] += weight * lexical_best / lexical_best[0]
+
+    idxs, best = top_k(scores, len(scores))
+    return rows[idxs], best
+
+
+# -------------------------------
+# Command line interface
+# -------------------------------
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Run BM25 queries against a built index and print hits and latency."""
+    parser = argparse.ArgumentParser(description="Query the BM25 index of a chunk store.")
+    parser.add_argument("model_key", help="Sanitized model name, e.g. intfloat-multilingual-e5-base")
+    parser.add_argument("queries", nargs="+", help="Query texts")
+    parser.add_argument("--k", type=int, default=10, help="Hits per query")
+    args = parser.parse_args(argv)
+
+    _, metadata = load_store(args.model_key)
+    index = load_lexical_index(args.model_key, metadata)
+    if index is None:
+        parser.error("no up-to-date BM25 index for this store (rebuild with build_embeddings.py)")
+
+    report = []
+    for query in args.queries:
+        start = time.perf_counter()
+        rows, scores = index.search(query, args.k)
+        latency_ms = (time.perf_counter() - start) * 1000
+        report.append({
+            "query": query,
+            "latency_ms": round(latency_ms, 3),
+            "hits": [
+                {"row": int(row), "question_id": metadata["chunks"][row]["question_id"], "score": round(float(score), 3)}
+                for row, score in zip(rows, scores)
+            ],
+        })
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(TimeoutError):
+    """No model instance became free within the queue timeout."""
+
+
+# -------------------------------
+# Pool of model instances
+# -------------------------------
+class LlamaPool:
+    """
+    Fixed set of model instances handed out one request at a time.
+
+    llama-cpp contexts must not be used concurrently, so each request
+    checks out a whole instance. Waiting requests are served strictly in
+    arrival order (a ticket queue), so a burst cannot starve earlier
+    requests. llama-cpp releases the GIL while evaluating, so N instances
+    with T threads each generate in parallel on N * T cores; the weights
+    are memory-mapped and shared between instances, only the KV caches
+    are per instance.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int, name: str = "llm"):
+        self.name = name
+        self.instances: List[Any] = [factory() for _ in range(size)]
+        self._free: Deque[Any] = deque(self.instances)
+        self._waiters: Deque[object] = deque()
+        self._cond = threading.Condition()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_waiting = 0
+        self.wait_seconds = 0.0
+
+    @contextmanager
+    def instance(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """
+        Check out a free instance for the duration of the with-block.
+
+        Args:
+            timeout (float, optional): Seconds to wait in the queue (None = forever).
+
+        Raises:
+            PoolTimeout: If no instance was free in time.
+        """
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._waiters.append(ticket)
+            self.max_waiting = max(self.max_waiting, len(self._waiters))
+            try:
+                while self._waiters[0] is not ticket or not self._free:
+                    remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No free '{self.name}' instance after {timeout} s")
+                    self._cond.wait(remaining)
+                llm = self._free.popleft()
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()  # the next ticket may now be at the head
+            self.checkouts += 1
+            self.wait_seconds += time.monotonic() - start
+
+        try:
+            yield llm
+        finally:
+            with self._cond:
+                self._free.append(llm)
+                self._cond.notify_all()
+
+    def tokenize(self, text: bytes, **kwargs: Any) -> List[int]:
+        """Tokenize without checking out an instance (uses the shared vocabulary only)."""
+        return self.instances[0].tokenize(text, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy and queueing counters."""
+        with self._cond:
+            return {
+                "size": len(self.instances),
+                "busy": len(self.instances) - len(self._free),
+                "waiting": len(self._waiters),
+                "max_waiting": self.max_waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "mean_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+            }
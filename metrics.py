@@ -0,0 +1,130 @@
+import time
+import bisect
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+# Histogram bucket upper bounds in seconds: 50 us ... ~150 s, 25% apart;
+# percentiles report the upper bound of their bucket (at most 25% high)
+BUCKET_BOUNDS: List[float] = [0.00005 * 1.25 ** i for i in range(68)]
+PERCENTILES = (50, 95, 99)
+
+
+# -------------------------------
+# Latency histogram
+# -------------------------------
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Recording is a binary search and an increment, so spans can stay on
+    in production; percentiles are read from the cumulative bucket counts
+    (upper bound of the bucket, capped at the exact maximum).
+    """
+
+    def __init__(self, bounds: List[float] = BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """Approximate p-th percentile in seconds."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bounds[bucket] if bucket < len(self.bounds) else self.max, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean, percentiles and max in milliseconds."""
+        summary: Dict[str, Any] = {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+        }
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = round(self.percentile(p) * 1000, 3)
+        summary["max_ms"] = round(self.max * 1000, 3)
+        return summary
+
+
+# -------------------------------
+# Metrics registry
+# -------------------------------
+class Metrics:
+    """
+    Process-wide stage latencies and counters.
+
+    Stages are timed with span(), which feeds one histogram per stage name
+    and, optionally, a per-request timings dict for logging.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Counter = Counter()
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    @contextmanager
+    def span(self, name: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+        """
+        Time the with-block as stage `name`; failures also count '<name>_errors'.
+
+        Args:
+            name (str): Stage name.
+            timings (Dict[str, float], optional): Per-request dict that receives the duration.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(name, elapsed)
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stage latency summaries and counters."""
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "stages": {name: histogram.summary() for name, histogram in sorted(self._histograms.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+
+metrics = Metrics()
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    """One-line per-request stage breakdown for the log."""
+    return ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items())
@@ -0,0 +1,12 @@
+# -------------------------------
+# Model names
+# -------------------------------
+# Kept free of imports so offline tools (ONNX export, benchmark, index
+# build) can read the serving defaults without loading the index or the models.
+EMBEDDER_MODEL = "intfloat/multilingual-e5-base"
+CROSS_ENCODER_MODEL = "jinaai/jina-reranker-v2-base-multilingual"
+
+# -------------------------------
+# Search backend
+# -------------------------------
+SEARCH_QUANTIZATION = None  # "int8" or "binary": search compact codes, rescore in full precision
@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+
+# -------------------------------
+# Model registry
+# -------------------------------
+class ModelRegistry:
+    """
+    Registry of lazily loaded models.
+
+    Modules register a loader under a name at import time; the model is
+    only loaded on the first get() (or by a warm-up thread), exactly once
+    even under concurrent requests. Load times and errors are recorded for
+    the readiness endpoint.
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._loading: Dict[str, bool] = {}
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        """Register a loader; nothing is loaded until the model is requested."""
+        self._loaders[name] = loader
+        self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        """Return the model, loading it on first use."""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                logger.info(f"Loading model '{name}'...")
+                self._loading[name] = True
+                start = time.perf_counter()
+                try:
+                    model = self._loaders[name]()
+                except Exception as e:
+                    self._errors[name] = repr(e)
+                    raise
+                finally:
+                    self._loading[name] = False
+                self._load_seconds[name] = time.perf_counter() - start
+                self._errors.pop(name, None)
+                self._models[name] = model
+                logger.info(f"Model '{name}' loaded in {self._load_seconds[name]:.2f} seconds.")
+        return model
+
+    def override(self, name: str, model: Any) -> None:
+        """Install an already constructed model (e.g. a local stand-in)."""
+        self._locks.setdefault(name, threading.Lock())
+        with self._locks[name]:
+            self._models[name] = model
+            self._load_seconds[name] = 0.0
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def ready(self, names: Iterable[str]) -> bool:
+        """True when all given models are loaded."""
+        return all(self.is_loaded(name) for name in names)
+
+    def warm_up(self, names: Optional[List[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """
+        Load models ahead of the first request.
+
+        Args:
+            names (List[str], optional): Models to load (default: all registered).
+            background (bool): Load in a daemon thread instead of blocking.
+
+        Returns:
+            threading.Thread or None: The warm-up thread when background is True.
+        """
+        names = list(self._loaders) if names is None else names
+
+        def load_all() -> None:
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    logger.exception(f"Warm-up of model '{name}' failed")
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Per-model state and load time."""
+        return {
+            name: {
+                "loaded": name in self._models,
+                "loading": self._loading.get(name, False),
+                "load_seconds": round(self._load_seconds[name], 3) if name in self._load_seconds else None,
+                "error": self._errors.get(name),
+            }
+            for name in self._loaders
+        }
+
+
+registry = ModelRegistry()
@@ -1,11 +1,19 @@
+import time
 import logging
 from datetime import datetime
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Tuple
 
-from retriever import raw_data, normalize_text, encode_text, search_top_k, rerank_questions
-from cross_encoder import rerank_questions_cross_encoder
-from rag_generation import rag_prompt, rag_generation
+from retriever import INDEX_VERSION, raw_data, encode_query, search_top_k, rerank_questions, query_cache, search_index
+from cross_encoder import rerank_questions_cross_encoder, score_cache
+from rag_generation import rag_prompt, rag_generation, rag_generation_stream, trim_answer, count_tokens, prompt_cache_stats, get_llm_pool
+from context_builder import CONTEXT_TOKEN_BUDGET, pack_context
 from formatting import format_result
+from text_utils import code_terms
+from cache import SemanticCache
+from metrics import metrics, format_timings
+from batching import batcher_stats
+from model_registry import registry
+from sharded_index import ShardedIndex
 
 # -------------------------------
 # Configure logger
@@ -18,6 +26,12 @@ logger.info("Initializing RAG pipeline...")
 # -------------------------------
 TOP_K_RETRIEVE = 3  # Number of top chunks/questions to retrieve
 
+# Answer cache for paraphrased RAG questions (same flags and the same codes/numbers)
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_THRESHOLD = 0.95  # Cosine similarity of question embeddings (e5 scores unrelated text ~0.7-0.8)
+SEMANTIC_CACHE_MAX_ENTRIES = 2048
+SEMANTIC_CACHE_TTL = 3600  # Seconds; None = no expiry
+
 FLAGS: Dict[str, Tuple[str, Any]] = {
     "-s": ("show_Score", True),
     "-ce": ("use_cross_encoder", True),
@@ -26,6 +40,9 @@ FLAGS: Dict[str, Tuple[str, Any]] = {
     "-3": ("use_top_k", 3)
 }
 
+# Cached answers and links, looked up by question embedding; cleared on index rebuild
+answer_cache = SemanticCache(SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL)
+
 # -------------------------------
 # Helper functions
 # -------------------------------
@@ -75,77 +92,232 @@ def save_log(question: str, answer: str, use_RAG: bool, log_file: str = "qa.log"
 
 
 # -------------------------------
-# Main pipeline function
+# Pipeline stages
 # -------------------------------
-def process_question(data: Dict[str, Any]) -> str:
+def retrieve_answers(data: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Process a user question: retrieve top results, optionally rerank using Cross-Encoder,
-    optionally generate RAG answer, and format result as HTML.
+    Retrieval part of the pipeline (stages 1-5): parse, encode, search, rerank, links.
 
     Args:
         data (Dict[str, Any]): Incoming JSON data containing 'question' and optional 'use_RAG'.
 
     Returns:
-        str: Formatted HTML result for display.
+        Dict[str, Any]: Request context with 'question', 'params', 'use_RAG',
+        'top_answers' and 'links', consumed by generate_answer() and finalize_result().
+        On a semantic cache hit it also holds the 'cached_answer'.
     """
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+    metrics.inc("requests")
+
     # -------------------------------
     # 1. Parse input and flags
     # -------------------------------
-    raw_question: List[str] = data.get("question", "").split()
-    use_RAG: bool = data.get("use_RAG", False)
+    with metrics.span("parse", timings):
+        raw_question: List[str] = data.get("question", "").split()
+        use_RAG: bool = data.get("use_RAG", False)
 
-    question, params = parse_question_flags(raw_question, FLAGS)
+        question, params = parse_question_flags(raw_question, FLAGS)
     logger.info(f"Processing question: '{question}' | RAG: {use_RAG} | Params: {params}")
 
     # -------------------------------
     # 2. Encode question embedding
     # -------------------------------
-    question_emb = encode_text([normalize_text(question)])
+    with metrics.span("encode", timings):
+        question_emb = encode_query(question)
+
+    # -------------------------------
+    # 2a. RAG answer of a near-identical earlier question (same flags, same codes/numbers)
+    # -------------------------------
+    context: Dict[str, Any] = {
+        "question": question,
+        "params": params,
+        "use_RAG": use_RAG,
+        "question_emb": question_emb,
+        "cache_scope": (tuple(sorted(params.items())), use_RAG),
+        "code_terms": code_terms(question),
+        "started": started,
+        "timings": timings,
+    }
+    if SEMANTIC_CACHE_ENABLED and use_RAG:
+        with metrics.span("answer_cache", timings):
+            answer_cache.use_version(INDEX_VERSION)
+            cached, similarity = answer_cache.lookup(question_emb, context["cache_scope"])
+        if cached is not None and cached["code_terms"] != context["code_terms"]:
+            # e.g. the same question about another error code: similar embedding, different answer
+            metrics.inc("answer_cache_code_mismatches")
+            cached = None
+        if cached is not None:
+            metrics.inc("answer_cache_hits")
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f})")
+            context.update(cached, cache_hit=True)
+            return context
 
     # -------------------------------
     # 3. Retrieve top answers
     # -------------------------------
-    top_answers = search_top_k(question_emb, top_k=TOP_K_RETRIEVE)
+    with metrics.span("retrieve", timings):
+        top_answers = search_top_k(question_emb, top_k=TOP_K_RETRIEVE, question=question)
 
     # -------------------------------
     # 4. Optional reranking using Cross-Encoder
     # -------------------------------
     if params["use_cross_encoder"]:
-        top_answers = rerank_questions_cross_encoder(
-            top_answers, raw_data, question, top_k=params["use_top_k"]
-        )
+        with metrics.span("rerank_cross_encoder", timings):
+            top_answers = rerank_questions_cross_encoder(
+                top_answers, raw_data, question, top_k=params["use_top_k"], index_version=INDEX_VERSION
+            )
     else:
-        top_answers = rerank_questions(top_answers, question_emb, top_k=params["use_top_k"])
+        with metrics.span("rerank", timings):
+            top_answers = rerank_questions(top_answers, question_emb, top_k=params["use_top_k"])
 
     # -------------------------------
     # 5. Prepare links dictionary
     # -------------------------------
-    links: Dict[str, Any] = {}
-    for index, record in enumerate(top_answers):
-        raw_record = raw_data[record["id"]]
-        link = raw_record["link"]
-        if link not in links:
-            links[link] = (record["score"], raw_record["question"])
+    with metrics.span("links", timings):
+        links: Dict[str, Any] = {}
+        for index, record in enumerate(top_answers):
+            raw_record = raw_data[record["id"]]
+            link = raw_record["link"]
+            if link not in links:
+                links[link] = (record["score"], raw_record["question"])
+
+    context.update(top_answers=top_answers, links=links)
+    return context
 
+
+def build_sources(context: Dict[str, Any]) -> List[str]:
+    """
+    RAG source blocks: the best chunks of the top answers within the token budget.
+    """
+    return pack_context(context["top_answers"], raw_data, count_tokens, CONTEXT_TOKEN_BUDGET)
+
+
+def generate_answer(context: Dict[str, Any]) -> str:
+    """
+    Generation stage (6): RAG answer for the retrieved context, or "" if RAG is off.
+    """
     # -------------------------------
     # 6. Generate RAG answer (if requested)
     # -------------------------------
     answer: str = ""
-    if use_RAG:
-        lines: List[str] = [
-            f"Source {index}: {raw_data[record['id']]['question']}\n{raw_data[record['id']]['answer']}\n"
-            for index, record in enumerate(top_answers)
-        ]
-        answer = rag_generation(question, "\n".join(lines), rag_prompt)
+    if context.get("cache_hit"):
+        answer = context["cached_answer"]
+    elif context["use_RAG"]:
+        with metrics.span("context", context["timings"]):
+            sources = build_sources(context)
+        with metrics.span("generate", context["timings"]):
+            answer = rag_generation(context["question"], sources, rag_prompt)
+    context["answer_complete"] = True
+    return answer
+
+
+def stream_answer(context: Dict[str, Any]) -> Iterator[str]:
+    """
+    Streaming variant of generate_answer(): yields answer pieces as they are generated.
+
+    Pieces are raw token deltas; finalize_result() trims the unfinished
+    last sentence from the concatenated answer.
+    """
+    if context.get("cache_hit"):
+        if context["cached_answer"]:
+            yield context["cached_answer"]
+    elif context["use_RAG"]:
+        with metrics.span("context", context["timings"]):
+            sources = build_sources(context)
+        with metrics.span("generate", context["timings"]):
+            yield from rag_generation_stream(context["question"], sources, rag_prompt)
+    context["answer_complete"] = True
+
+
+def links_payload(context: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON-serializable links of a retrieved context, sent before generation starts.
+    """
+    return {
+        "links": [
+            {"link": link, "score": float(score), "question": query}
+            for link, (score, query) in context["links"].items()
+        ],
+        "html": format_result(
+            context["question"], "", context["links"], context["params"]["show_Score"], context["use_RAG"]
+        ),
+    }
 
+
+def finalize_result(context: Dict[str, Any], answer: str) -> str:
+    """
+    Final stages (7-8): format the HTML result and save the log.
+    """
     # -------------------------------
     # 7. Format final HTML result
     # -------------------------------
-    result: str = format_result(question, answer, links, params["show_Score"], use_RAG)
+    timings = context["timings"]
+    answer = trim_answer(answer)  # streamed answers arrive untrimmed
+    with metrics.span("format", timings):
+        result: str = format_result(
+            context["question"], answer, context["links"], context["params"]["show_Score"], context["use_RAG"]
+        )
 
     # -------------------------------
-    # 8. Save log
+    # 8. Save log and cache the answer (only if generation completed)
     # -------------------------------
-    save_log(question, answer, use_RAG)
+    with metrics.span("log", timings):
+        save_log(context["question"], answer, context["use_RAG"])
+
+    if SEMANTIC_CACHE_ENABLED and context["use_RAG"] and context.get("answer_complete") and not context.get("cache_hit"):
+        answer_cache.put(context["question_emb"], context["cache_scope"], {
+            "code_terms": context["code_terms"],
+            "cached_answer": answer,
+            "top_answers": context["top_answers"],
+            "links": context["links"],
+        })
+
+    total = time.perf_counter() - context["started"]
+    metrics.observe("request", total)
+    logger.info(f"Request done in {total * 1000:.1f} ms: {format_timings(timings)}")
 
     return result
+
+
+# -------------------------------
+# Main pipeline function
+# -------------------------------
+def process_question(data: Dict[str, Any]) -> str:
+    """
+    Process a user question: retrieve top results, optionally rerank using Cross-Encoder,
+    optionally generate RAG answer, and format result as HTML.
+
+    Args:
+        data (Dict[str, Any]): Incoming JSON data containing 'question' and optional 'use_RAG'.
+
+    Returns:
+        str: Formatted HTML result for display.
+    """
+    context = retrieve_answers(data)
+    answer = generate_answer(context)
+    return finalize_result(context, answer)
+
+
+# -------------------------------
+# Metrics
+# -------------------------------
+def metrics_payload() -> Dict[str, Any]:
+    """
+    Everything the /metrics endpoint reports: stage latency histograms and
+    counters, cache hit rates, model calls (batches), generation tokens and
+    search shards.
+    """
+    payload = metrics.snapshot()
+    payload["caches"] = {
+        "query_embeddings": query_cache.stats(),
+        "cross_encoder_scores": score_cache.stats(),
+        "answers": answer_cache.stats(),
+        "prompt_prefix": prompt_cache_stats(),
+    }
+    payload["batchers"] = batcher_stats()
+    payload["llm_pool"] = get_llm_pool().stats() if registry.is_loaded("llm") else None
+    payload["search_shards"] = search_index.stats() if isinstance(search_index, ShardedIndex) else None
+    payload["models"] = registry.status()
+    return payload
+
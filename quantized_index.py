@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import argparse
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+from embedding_store import load_store
+from vector_search import ExactIndex, normalize_query, dot_scores, inverse_row_norms, top_k, top_k_indices
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+QUANT_FILENAME_TEMPLATE = "data/{mode}_{model}.npz"
+
+QUANT_MODES = ("int8", "binary")
+DEFAULT_RESCORE = 256  # Candidates rescored with the full-precision vectors
+QUANT_BLOCK_ROWS = 2048  # Rows decoded / compared at a time (cache-sized, bounds temporary memory)
+
+
+# -------------------------------
+# Code helpers
+# -------------------------------
+def _unit_block(block: np.ndarray) -> np.ndarray:
+    block = np.asarray(block, dtype=np.float32)
+    return block / np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+
+
+# Set bits of every byte value, for NumPy < 2.0 (no np.bitwise_count)
+_POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount_rows(bits: np.ndarray) -> np.ndarray:
+    """Number of set bits per row of a packed uint8 matrix."""
+    if not hasattr(np, "bitwise_count"):
+        return _POPCOUNT_TABLE[bits].sum(axis=1, dtype=np.int32)
+    if bits.shape[1] % 8 == 0:
+        bits = bits.view(np.uint64)  # 8x fewer elements to count
+    return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+
+
+# -------------------------------
+# Quantized index
+# -------------------------------
+class QuantizedIndex:
+    """
+    First-stage search over compact codes, rescored in full precision.
+
+    "int8" stores every unit-length row as int8 with one scale per
+    dimension (4x smaller than float32); coarse scores are the dot product
+    of the codes with the scaled query. "binary" stores the sign of every
+    dimension after subtracting the corpus mean, packed 8 per byte (32x
+    smaller); coarse scores come from the Hamming distance (XOR + popcount).
+
+    Only the codes are held in memory. The best `rescore` candidates are
+    rescored against the (memory-mapped) store matrix, so final scores are
+    exact cosine similarities and only those rows are read from disk.
+
+    int8 saves memory, not time: NumPy has no int8 BLAS kernel (integer
+    matmul is slower still), so its scan decodes blocks to float32 and is
+    slower than exact search over a resident float32 matrix. Use it when
+    the matrix does not fit in RAM; "binary" is the mode that scans faster.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        codes: np.ndarray,
+        params: np.ndarray,
+        dim: int,
+        store_version: str = "",
+        rescore: int = DEFAULT_RESCORE
+    ):
+        if mode not in QUANT_MODES:
+            raise ValueError(f"Unknown quantization '{mode}', expected one of {QUANT_MODES}")
+        self.mode = mode
+        self.name = mode
+        self.codes = codes
+        self.params = params  # int8: per-dimension scales, binary: corpus mean
+        self.dim = dim
+        self.store_version = store_version
+        self.rescore = rescore
+        self.matrix: Optional[np.ndarray] = None
+        self.inv_norms: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, mode: str, store_version: str = "", block_rows: int = QUANT_BLOCK_ROWS) -> "QuantizedIndex":
+        """
+        Quantize all rows of a store matrix, block by block.
+
+        Args:
+            matrix (np.ndarray): Corpus matrix (may be memory-mapped, need not be normalized).
+            mode (str): "int8" or "binary".
+            store_version (str): Version of the store the codes are built from.
+            block_rows (int): Rows processed at a time.
+
+        Returns:
+            QuantizedIndex: Built index (not attached to a matrix).
+        """
+        count, dim = matrix.shape
+
+        # First pass: per-dimension statistics of the unit-length rows
+        params = np.zeros(dim, dtype=np.float32)
+        for start in range(0, count, block_rows):
+            block = _unit_block(matrix[start:start + block_rows])
+            if mode == "int8":
+                np.maximum(params, np.abs(block).max(axis=0), out=params)
+            else:
+                params += block.sum(axis=0)
+        if mode == "int8":
+            params = np.maximum(params, 1e-12) / 127.0
+        else:
+            params /= max(count, 1)
+
+        # Second pass: codes
+        width = dim if mode == "int8" else (dim + 7) // 8
+        codes = np.empty((count, width), dtype=np.int8 if mode == "int8" else np.uint8)
+        for start in range(0, count, block_rows):
+            block = _unit_block(matrix[start:start + block_rows])
+            if mode == "int8":
+                codes[start:start + block_rows] = np.clip(np.rint(block / params), -127, 127)
+            else:
+                codes[start:start + block_rows] = np.packbits(block > params, axis=1)
+
+        return cls(mode, codes, params, dim, store_version=store_version)
+
+    def save(self, path: str) -> None:
+        """Save the codes as a .npz file (written to a temp file, then renamed)."""
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            mode=np.array(self.mode),
+            codes=self.codes,
+            params=self.params,
+            dim=np.array(self.dim),
+            store_version=np.array(self.store_version)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, rescore: int = DEFAULT_RESCORE) -> "QuantizedIndex":
+        """Load an index saved with save()."""
+        with np.load(path) as data:
+            return cls(
+                str(data["mode"]),
+                data["codes"],
+                data["params"],
+                int(data["dim"]),
+                store_version=str(data["store_version"]),
+                rescore=rescore
+            )
+
+    def attach(self, matrix: np.ndarray, inv_norms: Optional[np.ndarray] = None) -> "QuantizedIndex":
+        """Attach the full-precision matrix used for rescoring."""
+        if matrix.shape[0] != self.codes.shape[0]:
+            raise ValueError(f"Quantized index covers {self.codes.shape[0]} rows, store has {matrix.shape[0]}")
+        self.matrix = matrix
+        self.inv_norms = inv_norms
+        return self
+
+    def coarse_scores(self, q: np.ndarray) -> np.ndarray:
+        """Approximate similarity of the unit query q to every row (higher is better)."""
+        if self.mode == "int8":
+            # Scaled float query against blocks cast to float32 (BLAS); see the class docstring
+            return dot_scores(self.codes, q * self.params, block_rows=QUANT_BLOCK_ROWS)
+
+        query_bits = np.packbits(q > self.params)
+        scores = np.empty(self.codes.shape[0], dtype=np.float32)
+        for start in range(0, self.codes.shape[0], QUANT_BLOCK_ROWS):
+            distances = popcount_rows(np.bitwise_xor(self.codes[start:start + QUANT_BLOCK_ROWS], query_bits))
+            scores[start:start + QUANT_BLOCK_ROWS] = self.dim - 2 * distances
+        return scores
+
+    def search(self, query_emb: np.ndarray, k: int, rescore: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        q = normalize_query(query_emb)
+        candidates = top_k_indices(self.coarse_scores(q), max(k, rescore or self.rescore))
+        rows = np.sort(candidates)  # sequential access pattern on the memory-mapped matrix
+        scores = dot_scores(self.matrix[rows], q)
+        if self.inv_norms is not None:
+            scores *= self.inv_norms[rows]
+        idxs, best = top_k(scores, k)
+        return rows[idxs], best
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.params.nbytes
+
+
+def load_quantized_index(
+    model_key: str,
+    mode: str,
+    matrix: np.ndarray,
+    metadata: Dict[str, Any],
+    inv_norms: Optional[np.ndarray] = None,
+    rescore: int = DEFAULT_RESCORE
+) -> Optional[QuantizedIndex]:
+    """
+    Load the quantized codes for a store, or None when they are missing
+    or were built from a different store version.
+    """
+    path = QUANT_FILENAME_TEMPLATE.format(mode=mode, model=model_key)
+    if not os.path.exists(path):
+        return None
+
+    index = QuantizedIndex.load(path, rescore=rescore)
+    if index.store_version != metadata.get("version", "") or index.codes.shape[0] != matrix.shape[0]:
+        return None
+    return index.attach(matrix, inv_norms)
+
+
+def build_quantized_index(model_key: str, mode: str) -> str:
+    """
+    Build the quantized codes for an existing store and save them next to it.
+
+    Returns:
+        str: Path of the written file.
+    """
+    matrix, metadata = load_store(model_key)
+    index = QuantizedIndex.build(matrix, mode, store_version=metadata.get("version", ""))
+    path = QUANT_FILENAME_TEMPLATE.format(mode=mode, model=model_key)
+    index.save(path)
+    return path
+
+
+# -------------------------------
+# Recall report
+# -------------------------------
+def recall_report(
+    matrix: np.ndarray,
+    indexes: List[QuantizedIndex],
+    queries: np.ndarray,
+    k: int,
+    rescores: List[int],
+    inv_norms: Optional[np.ndarray] = None
+) -> List[Dict[str, Any]]:
+    """
+    Compare quantized search (with rescoring) against brute-force search.
+
+    Returns:
+        List[Dict]: One row per (mode, rescore) with recall@k, mean latency
+        and resident size of the codes in MB.
+    """
+    exact = ExactIndex(matrix, inv_norms)
+
+    start = time.perf_counter()
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = [{
+        "backend": "exact", "rescore": None, "recall": 1.0, "latency_ms": round(exact_ms, 3),
+        "memory_mb": round(matrix.shape[0] * matrix.shape[1] * 4 / 2 ** 20, 2)
+    }]
+    for index in indexes:
+        for rescore in rescores:
+            start = time.perf_counter()
+            found = [index.search(q, k, rescore=rescore)[0] for q in queries]
+            latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = np.mean([len(truth_set.intersection(rows.tolist())) / max(len(truth_set), 1)
+                              for truth_set, rows in zip(truth, found)])
+            report.append({
+                "backend": index.mode,
+                "rescore": rescore,
+                "recall": round(float(recall), 4),
+                "latency_ms": round(latency_ms, 3),
+                "memory_mb": round(index.nbytes / 2 ** 20, 2)
+            })
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Print recall@k, latency and memory of quantized search against exact search."""
+    parser = argparse.ArgumentParser(description="Recall@k report of quantized search against brute-force search.")
+    parser.add_argument("model_key", help="Sanitized model name, e.g. intfloat-multilingual-e5-base")
+    parser.add_argument("--mode", nargs="+", choices=QUANT_MODES, default=list(QUANT_MODES))
+    parser.add_argument("--k", type=int, default=50, help="Results compared per query")
+    parser.add_argument("--rescore", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--queries", type=int, default=200, help="Corpus rows sampled as queries")
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise added to sampled queries")
+    parser.add_argument("--build", action="store_true", help="(Re)build the codes before measuring")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.build:
+        for mode in args.mode:
+            print(f"Built {build_quantized_index(args.model_key, mode)}")
+
+    matrix, metadata = load_store(args.model_key)
+    inv_norms = None if metadata.get("normalized") else inverse_row_norms(matrix)
+    indexes = [load_quantized_index(args.model_key, mode, matrix, metadata, inv_norms) for mode in args.mode]
+    if any(index is None for index in indexes):
+        parser.error("no up-to-date quantized codes for this store (use --build)")
+
+    rng = np.random.default_rng(0)
+    rows = rng.choice(matrix.shape[0], min(args.queries, matrix.shape[0]), replace=False)
+    queries = np.asarray(matrix[np.sort(rows)], dtype=np.float32)
+    queries += rng.normal(scale=args.noise, size=queries.shape).astype(np.float32)
+
+    report = recall_report(matrix, indexes, queries, args.k, args.rescore, inv_norms)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"recall@{args.k} over {len(queries)} queries, {matrix.shape[0]} rows")
+        for row in report:
+            label = "exact" if row["rescore"] is None else f"{row['backend']} rescore={row['rescore']}"
+            print(f"  {label:>20}  recall={row['recall']:.4f}  latency={row['latency_ms']:.3f} ms  "
+                  f"memory={row['memory_mb']:.2f} MB")
+        if "int8" in args.mode:
+            print("  (int8 reduces memory only; its scan is not faster than exact search)")
+    return report
+
+
+if __name__ == "__main__":
+    main()
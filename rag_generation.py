@@ -1,8 +1,14 @@
 import os
+import time
 import logging
-from typing import List
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
 from llama_cpp import Llama
 
+from model_registry import registry
+from llm_pool import LlamaPool
+from metrics import metrics
+
 # -------------------------------
 # Configure logger
 # -------------------------------
@@ -16,16 +22,35 @@ MODEL_NAME = "qwen2.5-1.5b-instruct-q5_k_m.gguf"
 MODEL_PATH = os.path.join(os.path.expanduser("~"), ".cache", "huggingface", "hub", MODEL_NAME)
 PROMPT_PATH = "data/rag_prompt.txt"
 
+# Tune LLM_POOL_SIZE * LLM_THREADS_PER_INSTANCE to the number of physical cores
+LLM_POOL_SIZE = 2  # Llama instances generating in parallel (each has its own KV cache)
+LLM_THREADS_PER_INSTANCE = 4
+LLM_QUEUE_TIMEOUT = 30.0  # Seconds a request may wait for a free instance (None = forever)
+LLM_GENERATION_TIMEOUT = 60.0  # Seconds of generation before the answer is cut off (None = no limit)
+
 # -------------------------------
-# Initialize Llama model
+# Register Llama instance pool (loaded on first use)
 # -------------------------------
-llm = Llama(
-    model_path=MODEL_PATH,
-    n_ctx=4096,
-    n_threads=4,
-    verbose=False
-)
-logger.info(f"RAG model '{MODEL_NAME}' successfully loaded.")
+registry.register("llm", lambda: LlamaPool(
+    lambda: Llama(
+        model_path=MODEL_PATH,
+        n_ctx=4096,
+        n_threads=LLM_THREADS_PER_INSTANCE,
+        verbose=False
+    ),
+    LLM_POOL_SIZE
+))
+
+
+def get_llm_pool() -> LlamaPool:
+    """Return the pool of Llama instances, loading it on first use."""
+    return registry.get("llm")
+
+
+def count_tokens(text: str) -> int:
+    """Number of llama tokens of a piece of prompt text."""
+    return len(get_llm_pool().tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
 
 # -------------------------------
 # Load RAG prompt template
@@ -35,44 +60,224 @@ with open(PROMPT_PATH, "r", encoding="utf-8") as f:
 
 
 # -------------------------------
-# Function to generate RAG answer
+# Prompt and sentence trimming helpers
 # -------------------------------
-def rag_generation(question: str, retrieved: List[str], instruction: str) -> str:
+def prompt_parts(question: str, retrieved: List[str], instruction: str) -> Tuple[str, str]:
     """
-    Generate an answer based on a question and retrieved sources using RAG.
+    Split the prompt into the constant instruction prefix and the per-request rest.
+
+    The split is placed before the space of " {question}", so the space is
+    tokenized together with the first word as in the one-piece prompt.
+    """
+    sources = "\n".join(retrieved)
+    prefix = f"""{instruction}
+
+Question:"""
+    rest = f""" {question}
+
+Source:
+{sources}
+
+Answer:
+"""
+    return prefix, rest
+
+
+def build_prompt(question: str, retrieved: List[str], instruction: str) -> str:
+    """
+    Build the prompt for the model from the instruction, question and sources.
+    """
+    return "".join(prompt_parts(question, retrieved, instruction))
+
+
+# -------------------------------
+# Prompt-prefix KV cache
+# -------------------------------
+# (id of Llama instance, instruction) -> (prefix tokens, saved llama state)
+_prefix_states: Dict[Tuple[int, str], Tuple[List[int], Any]] = {}
+_prefix_lock = threading.Lock()
+
+prompt_stats: Dict[str, float] = {
+    "requests": 0,
+    "prefix_evals": 0,  # instruction prefix evaluated from scratch
+    "prefix_resident_hits": 0,  # prefix still in the KV cache from the previous request
+    "prefix_restored_hits": 0,  # prefix KV restored from the saved state
+    "prefix_mismatches": 0,  # prompt tokenized differently across the split, evaluated whole
+    "prompt_tokens": 0,
+    "prompt_tokens_evaluated": 0,
+    "prompt_eval_seconds": 0.0,
+}
+
+
+def prepare_prompt(llm: Llama, question: str, retrieved: List[str], instruction: str) -> List[int]:
+    """
+    Bring the model's KV cache up to date with the prompt and return its tokens.
+
+    The instruction prefix is evaluated once per model instance and its
+    state saved; later requests keep or restore that state, so only the
+    question and sources are evaluated. When the returned tokens are passed
+    to llm(...), llama-cpp finds them already evaluated and starts sampling.
+
+    The prompt is always tokenized in one piece; the saved prefix is only
+    reused when those tokens start with the prefix tokens, so reuse never
+    changes what the model sees.
 
     Args:
+        llm (Llama): Model instance checked out of the pool.
         question (str): The user's question.
-        retrieved (List[str]): List of retrieved documents/sources.
+        retrieved (List[str]): Retrieved documents/sources.
         instruction (str): Instruction to guide the model.
 
     Returns:
-        str: Generated answer.
+        List[int]: Prompt tokens.
     """
-    # Build the prompt for the model
-    prompt = f"""{instruction}
+    prefix, rest = prompt_parts(question, retrieved, instruction)
+    prompt_tokens = llm.tokenize((prefix + rest).encode("utf-8"), add_bos=True, special=True)
+    key = (id(llm), instruction)
 
-Question: {question}
+    start = time.perf_counter()
+    with _prefix_lock:
+        cached = _prefix_states.get(key)
+    if cached is not None:
+        prefix_tokens, state = cached
+    else:
+        prefix_tokens, state = llm.tokenize(prefix.encode("utf-8"), add_bos=True, special=True), None
+    n_prefix = len(prefix_tokens)
 
-Source:
-{retrieved}
+    prefix_reused = False
+    if prompt_tokens[:n_prefix] != prefix_tokens:
+        # Tokens merge across the split: evaluate the whole prompt, so the
+        # model sees exactly the tokens of the one-piece prompt
+        llm.reset()
+        n_prefix = 0
+        with _prefix_lock:
+            prompt_stats["prefix_mismatches"] += 1
+    elif state is None:
+        llm.reset()
+        llm.eval(prefix_tokens)
+        with _prefix_lock:
+            _prefix_states[key] = (prefix_tokens, llm.save_state())
+            prompt_stats["prefix_evals"] += 1
+    else:
+        prefix_reused = True
+        resident = llm.n_tokens >= n_prefix and list(llm.input_ids[:n_prefix]) == prefix_tokens
+        if not resident:
+            llm.load_state(state)
+        with _prefix_lock:
+            prompt_stats["prefix_resident_hits" if resident else "prefix_restored_hits"] += 1
+        llm.n_tokens = n_prefix  # drop the previous request's question/sources
 
-Answer:
-"""
+    rest_tokens = prompt_tokens[n_prefix:]
+    llm.eval(rest_tokens)
+    elapsed = time.perf_counter() - start
 
-    # Generate output from the model
-    output = llm(
-        prompt,
-        max_tokens=100,
-        temperature=0.2,
-        top_p=0.5
+    evaluated = len(rest_tokens) + (0 if prefix_reused else n_prefix)
+    with _prefix_lock:
+        prompt_stats["requests"] += 1
+        prompt_stats["prompt_tokens"] += len(prompt_tokens)
+        prompt_stats["prompt_tokens_evaluated"] += evaluated
+        prompt_stats["prompt_eval_seconds"] += elapsed
+    metrics.observe("llm_prompt_eval", elapsed)
+    metrics.inc("llm_prompt_tokens", len(prompt_tokens))
+    metrics.inc("llm_prompt_tokens_evaluated", evaluated)
+    logger.info(
+        f"Prompt eval: {evaluated} of {len(prompt_tokens)} tokens in {elapsed * 1000:.1f} ms "
+        f"(prefix {'reused' if prefix_reused else 'evaluated' if n_prefix else 'not reusable'})"
     )
 
-    answer = output["choices"][0]["text"].strip()
+    return prompt_tokens
 
-    # Trim answer to the last period to avoid incomplete sentences
+
+def prompt_cache_stats() -> Dict[str, float]:
+    """Prefix cache hit counts and prompt-eval totals."""
+    with _prefix_lock:
+        return dict(prompt_stats)
+
+
+def trim_answer(answer: str) -> str:
+    """
+    Strip the answer and cut it after the last period (drops an unfinished sentence).
+    """
+    answer = answer.strip()
     last_dot = answer.rfind(".")
     if last_dot != -1:
         answer = answer[:last_dot + 1]
-
     return answer
+
+
+def generate_pieces(question: str, retrieved: List[str], instruction: str) -> Iterator[str]:
+    """
+    Check out a pool instance and stream raw generated text from it.
+
+    The instance is returned to the pool when the generator finishes or is
+    closed (e.g. the client went away), which also stops generation.
+    Generation stops early after LLM_GENERATION_TIMEOUT seconds.
+
+    Raises:
+        PoolTimeout: If no instance became free within LLM_QUEUE_TIMEOUT.
+    """
+    queued = time.perf_counter()
+    with get_llm_pool().instance(LLM_QUEUE_TIMEOUT) as llm:
+        metrics.observe("llm_queue", time.perf_counter() - queued)
+        metrics.inc("llm_calls")
+        prompt = prepare_prompt(llm, question, retrieved, instruction)
+        start = time.monotonic()
+        generated = 0
+        try:
+            for chunk in llm(prompt, max_tokens=100, temperature=0.2, top_p=0.5, stream=True):
+                generated += 1
+                yield chunk["choices"][0]["text"]
+                if LLM_GENERATION_TIMEOUT is not None and time.monotonic() - start > LLM_GENERATION_TIMEOUT:
+                    logger.warning(f"Generation stopped after {LLM_GENERATION_TIMEOUT:.0f} s")
+                    break
+        finally:
+            metrics.observe("llm_decode", time.monotonic() - start)
+            metrics.inc("llm_generated_tokens", generated)
+
+
+# -------------------------------
+# Function to generate RAG answer
+# -------------------------------
+def rag_generation(question: str, retrieved: List[str], instruction: str) -> str:
+    """
+    Generate an answer based on a question and retrieved sources using RAG.
+
+    Args:
+        question (str): The user's question.
+        retrieved (List[str]): List of retrieved documents/sources.
+        instruction (str): Instruction to guide the model.
+
+    Returns:
+        str: Generated answer.
+    """
+    # Generate output from a pooled model, reusing the evaluated instruction prefix
+    answer = "".join(generate_pieces(question, retrieved, instruction))
+
+    # Trim answer to the last period to avoid incomplete sentences
+    return trim_answer(answer)
+
+
+def rag_generation_stream(question: str, retrieved: List[str], instruction: str) -> Iterator[str]:
+    """
+    Streaming variant of rag_generation(): yields the generated text token by token.
+
+    Pieces are sent as soon as they are decoded (only leading whitespace is
+    dropped), so the client sees the first token without waiting for a
+    sentence. The unfinished last sentence is therefore part of the stream;
+    trim_answer() of the concatenated pieces gives the final answer.
+
+    Args:
+        question (str): The user's question.
+        retrieved (List[str]): List of retrieved documents/sources.
+        instruction (str): Instruction to guide the model.
+
+    Yields:
+        str: Raw generated text deltas.
+    """
+    started = False
+    for text in generate_pieces(question, retrieved, instruction):
+        if not started:
+            text = text.lstrip()
+            started = bool(text)
+        if text:
+            yield text
@@ -1,12 +1,23 @@
 import logging
 import json
-import string
-import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from embedding_store import load_store, load_store_metadata
+from cache import LRUCache, DiskCache, TieredCache
+from batching import MicroBatcher
+from model_registry import registry
+from inference_backend import load_sentence_transformer
+from text_utils import normalize_text
+from model_config import EMBEDDER_MODEL, SEARCH_QUANTIZATION
+from vector_search import ExactIndex, dot_scores, group_hits, inverse_row_norms, normalize_query
+from ann_index import load_ann_index, ANN_MIN_CORPUS, DEFAULT_NPROBE
+from lexical_index import load_lexical_index, fuse_rrf, fuse_weighted
+from quantized_index import load_quantized_index, DEFAULT_RESCORE
+from sharded_index import load_sharded_index, SHARD_TIMEOUT, SHARD_DEGRADE
+
 # -------------------------------
 # Configure logger
 # -------------------------------
@@ -15,90 +26,221 @@ logger = logging.getLogger(__name__)
 # -------------------------------
 # Constants
 # -------------------------------
-MODEL_NAME = "intfloat/multilingual-e5-base"
-RAW_DATA_PATH = f"data/raw_{MODEL_NAME.replace('/', '-')}.json"
-DATASET_PATH = f"data/dataset_{MODEL_NAME.replace('/', '-')}.json"
+MODEL_NAME = EMBEDDER_MODEL
+EMBEDDER_BACKEND = "torch"  # See inference_backend.BACKENDS, e.g. "onnx-int8" after exporting
+MODEL_KEY = MODEL_NAME.replace('/', '-')
+RAW_DATA_PATH = f"data/raw_{MODEL_KEY}.json"
+ANN_NPROBE = DEFAULT_NPROBE  # IVF lists scanned per query (recall/latency knob)
+QUANT_RESCORE = DEFAULT_RESCORE  # Quantized candidates rescored per query (recall/latency knob)
+SEARCH_SHARDS = None  # "local" (one worker process per shard) or ["host:port", ...] of running shard workers
+SEARCH_SHARD_TIMEOUT = SHARD_TIMEOUT  # Seconds to wait for the shards of one search
+SEARCH_SHARD_DEGRADE = SHARD_DEGRADE  # "partial": search the shards that answered in time, "fail": error out
+CHUNKS_PER_QUESTION = 3  # Top chunks kept per question in search results
+
+DENSE_TOP_K = 50  # Dense chunk candidates per search (dense-only)
+HYBRID_FUSION = "weighted"  # "weighted", "rrf", or None for dense-only search
+HYBRID_DENSE_TOP_K = 30  # Dense chunk candidates when BM25 candidates are added
+LEXICAL_TOP_K = 20  # BM25 chunk candidates per search
+LEXICAL_WEIGHT = 0.1  # Weighted fusion: bonus of the best BM25 hit on the cosine scale
+
+ENCODE_MAX_BATCH_SIZE = 32  # Concurrent queries encoded in one forward pass
+ENCODE_MAX_WAIT_MS = 2.0  # How long to wait for more queries before encoding
+
+QUERY_CACHE_MAX_ENTRIES = 10000
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+QUERY_CACHE_TTL = 24 * 3600  # Seconds; None = no expiry
+QUERY_CACHE_DISK_PATH = None  # e.g. f"data/query_cache_{MODEL_KEY}.sqlite" to survive restarts
 
 # -------------------------------
 # Load model and datasets
 # -------------------------------
 logger.info("Initializing embedding retriever...")
 
-# Load raw data
+# Load raw data, keyed by stable question id (ids may have gaps after re-indexing)
 with open(RAW_DATA_PATH, "r", encoding="utf-8") as f:
-    raw_data: Dict[str, Dict[str, Any]] = json.load(f)
+    raw_data: Dict[int, Dict[str, Any]] = {item["id"]: item for item in json.load(f)}
+
+# Register SentenceTransformer model (loaded on first use)
+registry.register("embedder", lambda: load_sentence_transformer(MODEL_NAME, EMBEDDER_BACKEND))
+
+
+def get_model() -> SentenceTransformer:
+    """Return the SentenceTransformer model, loading it on first use."""
+    return registry.get("embedder")
 
-# Load SentenceTransformer model
-model = SentenceTransformer(MODEL_NAME)
-logger.info(f"SentenceTransformer model '{MODEL_NAME}' successfully loaded.")
 
-# Load dataset with embeddings
+# Coalesce concurrent encode calls into one batch
+encode_batcher = MicroBatcher(
+    lambda texts: get_model().encode(texts),
+    max_batch_size=ENCODE_MAX_BATCH_SIZE,
+    max_wait_ms=ENCODE_MAX_WAIT_MS,
+    name="encode"
+)
+
+# Use the shard workers if configured: they hold the vectors, so only the
+# store metadata (row list and version) is read here
 logger.info("Loading embeddings...")
-with open(DATASET_PATH, "r", encoding="utf-8") as f:
-    dataset: List[Dict[str, Any]] = json.load(f)
+search_index = None
+embeddings: Optional[np.ndarray] = None
+embedding_inv_norms: Optional[np.ndarray] = None
+if SEARCH_SHARDS:
+    store_metadata = load_store_metadata(MODEL_KEY)
+    search_index = load_sharded_index(
+        MODEL_KEY, store_metadata, SEARCH_SHARDS, timeout=SEARCH_SHARD_TIMEOUT, degrade=SEARCH_SHARD_DEGRADE
+    )
+    if search_index is None:
+        logger.warning(f"No up-to-date shards for {MODEL_KEY}, rebuild with build_embeddings.py --shards N.")
+
+# Otherwise load the embedding store (matrix is memory-mapped, shared between workers via page cache)
+if search_index is None:
+    embeddings, store_metadata = load_store(MODEL_KEY)
+    # Normalize once at load time: stores built with unit-length rows need nothing,
+    # older stores get precomputed inverse norms instead of an in-memory copy
+    embedding_inv_norms = None if store_metadata.get("normalized") else inverse_row_norms(embeddings)
+
+dataset: List[Dict[str, Any]] = store_metadata["chunks"]
+INDEX_VERSION: str = store_metadata.get("version", "")  # Changes on every rebuild
+chunk_question_ids = np.array([int(item["question_id"]) for item in dataset], dtype=np.int64)
+
+# Else use the quantized codes if configured, the IVF index for large corpora,
+# exact search otherwise (each only when it matches the store)
+if search_index is None and SEARCH_QUANTIZATION:
+    search_index = load_quantized_index(
+        MODEL_KEY, SEARCH_QUANTIZATION, embeddings, store_metadata, embedding_inv_norms, rescore=QUANT_RESCORE
+    )
+    if search_index is None:
+        logger.warning(f"No up-to-date {SEARCH_QUANTIZATION} codes for {MODEL_KEY}, rebuild with build_embeddings.py.")
+if search_index is None:
+    search_index = load_ann_index(MODEL_KEY, embeddings, store_metadata, embedding_inv_norms, nprobe=ANN_NPROBE)
+if search_index is None:
+    search_index = ExactIndex(embeddings, embedding_inv_norms)
+logger.info(f"Search backend: {search_index.name} (ANN used from {ANN_MIN_CORPUS} chunks).")
+
+# BM25 index for hybrid search (exact codes and error strings the embedder misses)
+lexical_index = load_lexical_index(MODEL_KEY, store_metadata) if HYBRID_FUSION else None
+if HYBRID_FUSION and lexical_index is None:
+    logger.warning("No up-to-date BM25 index found, using dense search only.")
+
+# Load precomputed answer embeddings (one row per question) for the bi-encoder rerank
+try:
+    answer_embeddings, answer_metadata = load_store(MODEL_KEY, kind="answers")
+    answer_rows: Dict[int, int] = {
+        int(item["question_id"]): row for row, item in enumerate(answer_metadata["answers"])
+    }
+except FileNotFoundError:
+    logger.warning("No answer embeddings found, answers will be encoded at query time.")
+    answer_embeddings, answer_rows = None, {}
+if embeddings is not None:
+    logger.info(f"Embeddings are loaded: {embeddings.shape[0]} chunks, dtype {embeddings.dtype}.")
+else:
+    logger.info(f"Chunk metadata is loaded: {len(dataset)} chunks, vectors held by {len(search_index.clients)} shards.")
 
-embeddings = np.array([item["embedding"] for item in dataset])
-logger.info("Embeddings are loaded.")
+# Query embedding cache, keyed on the normalized question text
+query_cache = TieredCache(
+    LRUCache(QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES, ttl=QUERY_CACHE_TTL),
+    DiskCache(QUERY_CACHE_DISK_PATH, ttl=QUERY_CACHE_TTL) if QUERY_CACHE_DISK_PATH else None
+)
 
 # -------------------------------
-# Text preprocessing
+# Encoding
 # -------------------------------
-def normalize_text(text: str) -> str:
+def encode_text(texts: List[str]) -> np.ndarray:
     """
-    Lowercase, remove punctuation, normalize whitespace.
+    Encode a list of texts using the sentence transformer model.
+
+    Calls from concurrent requests are merged into one batch by encode_batcher.
     """
-    text = text.lower()
-    text = text.translate(str.maketrans("", "", string.punctuation))
-    return re.sub(r"\s+", " ", text).strip()
+    return np.vstack(encode_batcher.run(texts))
 
 
-def encode_text(texts: List[str]) -> np.ndarray:
+def encode_query(question: str) -> np.ndarray:
     """
-    Encode a list of texts using the sentence transformer model.
+    Encode a user question, skipping the model for repeated questions.
+
+    The question is normalized with normalize_text() and the result is
+    used as cache key, so questions differing only in case, punctuation
+    or whitespace share one entry. The key includes the model name and
+    EMBEDDER_BACKEND, so a persistent disk cache never returns vectors of
+    another backend (e.g. fp32 vectors to an int8 ONNX encoder).
+
+    Returns:
+        np.ndarray: Read-only embedding of shape (1, dim).
     """
-    return model.encode(texts)
+    text = normalize_text(question)
+    key = f"{MODEL_NAME}\0{EMBEDDER_BACKEND}\0{text}"
+    question_emb = query_cache.get(key)
+    if question_emb is None:
+        question_emb = encode_text([text])
+        question_emb.flags.writeable = False
+        query_cache.put(key, question_emb)
+    return question_emb
+
+def dense_scores(rows: np.ndarray, question_emb: np.ndarray) -> np.ndarray:
+    """Cosine scores of the question against given chunk rows."""
+    if embeddings is None:
+        return search_index.row_scores(question_emb, rows)  # scored by the shards holding the rows
+    q = normalize_query(question_emb)
+    scores = dot_scores(embeddings[rows], q)
+    if embedding_inv_norms is not None:
+        scores *= embedding_inv_norms[rows]
+    return scores
 
 # -------------------------------
 # Search top-k chunks with unique questions
 # -------------------------------
-def search_top_k(question_emb: np.ndarray, top_k: int = 5, chunk_top_k: int = 50) -> List[Dict[str, Any]]:
+def search_top_k(
+    question_emb: np.ndarray,
+    top_k: int = 5,
+    chunk_top_k: Optional[int] = None,
+    question: Optional[str] = None
+) -> List[Dict[str, Any]]:
     """
     Search for top-k relevant questions and their top chunks.
 
+    With a BM25 index and the question text, dense and lexical chunk
+    candidates are fused (HYBRID_FUSION) before grouping by question.
+
     Args:
         question_emb (np.ndarray): Encoded question embedding.
         top_k (int): Number of top questions to return.
-        chunk_top_k (int): Number of top chunks to consider per search.
+        chunk_top_k (int, optional): Number of dense chunk candidates per search
+            (default: DENSE_TOP_K, or HYBRID_DENSE_TOP_K for hybrid search).
+        question (str, optional): Question text for the lexical side.
 
     Returns:
-        List[Dict]: List of top questions with scores and top chunks.
+        List[Dict]: List of top questions with scores and top chunks
+        ('top_chunks' truncated for display; 'chunk_rows', 'chunk_texts',
+        'chunk_starts' and 'chunk_scores' hold the full best chunks, best first).
     """
-    similarities = cosine_similarity(question_emb, embeddings)[0]
-    best_idxs = similarities.argsort()[::-1][:chunk_top_k]
-
-    scores_by_question: Dict[str, float] = {}
-    chunks_by_question: Dict[str, List[tuple]] = {}
-
-    for idx in best_idxs:
-        q_id = dataset[idx]["question_id"]
-        chunk_text = dataset[idx].get("chunk_text", "")
-        score = similarities[idx]
-
-        # Keep best score per question
-        scores_by_question[q_id] = max(score, scores_by_question.get(q_id, 0.0))
+    hybrid = lexical_index is not None and bool(question)
+    if chunk_top_k is None:
+        chunk_top_k = HYBRID_DENSE_TOP_K if hybrid else DENSE_TOP_K
+    best_idxs, best_scores = search_index.search(question_emb, chunk_top_k)
 
-        # Store top chunks (max 3 per question)
-        chunks_by_question.setdefault(q_id, []).append((score, chunk_text))
-        chunks_by_question[q_id] = sorted(chunks_by_question[q_id], key=lambda x: x[0], reverse=True)[:3]
+    if hybrid:
+        lexical = lexical_index.search(question, LEXICAL_TOP_K)
+        if HYBRID_FUSION == "rrf":
+            best_idxs, best_scores = fuse_rrf((best_idxs, best_scores), lexical)
+        else:
+            best_idxs, best_scores = fuse_weighted(
+                (best_idxs, best_scores), lexical, lambda rows: dense_scores(rows, question_emb), LEXICAL_WEIGHT
+            )
 
-    sorted_q_ids = sorted(scores_by_question.items(), key=lambda x: x[1], reverse=True)[:top_k]
+    # Group hits by question: best score per question, top chunks per question
+    q_ids, q_scores, members = group_hits(
+        chunk_question_ids[best_idxs], best_scores, top_k, CHUNKS_PER_QUESTION
+    )
 
     results: List[Dict[str, Any]] = []
-    for q_id, score in sorted_q_ids:
+    for q_id, score, hits in zip(q_ids, q_scores, members):
         results.append({
             "id": int(q_id),
-            "score": score,
-            "top_chunks": [chunk[:100] for s, chunk in chunks_by_question[q_id]]
+            "score": float(score),
+            "top_chunks": [dataset[best_idxs[hit]].get("chunk_text", "")[:100] for hit in hits],
+            "chunk_rows": [int(best_idxs[hit]) for hit in hits],
+            "chunk_texts": [dataset[best_idxs[hit]].get("chunk_text", "") for hit in hits],
+            "chunk_starts": [dataset[best_idxs[hit]].get("word_start") for hit in hits],
+            "chunk_scores": [float(best_scores[hit]) for hit in hits]
         })
 
     return results
@@ -116,16 +258,22 @@ def rerank_questions(top_chunk_results: List[Dict[str, Any]], question_emb: np.n
         top_k (int): Number of top results to return.
 
     Returns:
-        List[Dict]: Top-k reranked chunks with scores.
+        List[Dict]: Top-k reranked results with scores (chunk fields of the input kept).
     """
     scores: List[Dict[str, float]] = []
+    q = normalize_query(question_emb)
 
     for item in top_chunk_results:
         chunk_id = item["id"]
-        chunk_text = raw_data[chunk_id]['answer']
-        chunk_emb = model.encode([chunk_text])
-        score = cosine_similarity(question_emb, chunk_emb)[0][0]
-        scores.append({"id": chunk_id, "score": score})
+        row = answer_rows.get(chunk_id)
+        if row is not None:
+            # Precomputed unit-length answer embedding: lookup + dot product
+            score = float(np.asarray(answer_embeddings[row], dtype=np.float32) @ q)
+        else:
+            chunk_text = raw_data[chunk_id]['answer']
+            chunk_emb = get_model().encode([chunk_text])
+            score = cosine_similarity(question_emb, chunk_emb)[0][0]
+        scores.append({**item, "score": score})
 
     scores.sort(key=lambda x: x["score"], reverse=True)
     return scores[:top_k]
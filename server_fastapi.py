@@ -13,13 +13,16 @@ logger.info("Server starting...")
 # -------------------------------
 # 2. Standard libraries
 # -------------------------------
-from typing import Any
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
 
 # -------------------------------
 # 3. Third-party libraries
 # -------------------------------
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -27,27 +30,216 @@ from pydantic import BaseModel
 # -------------------------------
 # 4. Local modules
 # -------------------------------
-from pipeline import process_question
+from pipeline import retrieve_answers, generate_answer, finalize_result, stream_answer, links_payload, metrics_payload
+from formatting import format_sse
+from model_registry import registry
+from llm_pool import PoolTimeout
+from sharded_index import ShardTimeout
+from rag_generation import LLM_POOL_SIZE
 
 # -------------------------------
 # 5. Initialize FastAPI app
 # -------------------------------
 app = FastAPI()
+
+# Models loaded in the background at startup; the rest load on first use
+WARM_UP_MODELS = ["embedder"]
+# Models that must be loaded before /ready reports the server as ready
+READY_MODELS = ["embedder"]
+
 templates = Jinja2Templates(directory="templates")
 
 # Подключение папки static (для CSS, JS, шрифтов, картинок и т.п.)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # -------------------------------
-# 6. Pydantic models
+# 6. Worker pools with backpressure
+# -------------------------------
+RETRIEVAL_WORKERS = 8  # Threads for encode/search/rerank/format
+RETRIEVAL_MAX_PENDING = 64  # Requests queued or running in retrieval before 503
+GENERATION_WORKERS = LLM_POOL_SIZE  # Concurrent llama generations (one per pooled instance)
+GENERATION_MAX_PENDING = 8  # RAG requests queued or running in generation before 503
+RETRY_AFTER_SECONDS = 1
+
+
+class BoundedStage:
+    """
+    Runs blocking pipeline stages in a dedicated thread pool, off the event loop.
+
+    At most max_pending calls may be queued or running; further calls are
+    rejected with 503 so a backlog in one stage cannot grow without bound.
+    The counter is only touched from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def acquire(self) -> None:
+        """Reserve a slot or reject the request with 503."""
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Server busy ({self.name} queue full), try again later",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        self.pending += 1
+
+    def release(self) -> None:
+        self.pending -= 1
+
+    def acquire_slot(self) -> Callable[[], None]:
+        """
+        Reserve a slot (or reject with 503) and return its release function.
+
+        The release function may be called any number of times and frees
+        the slot once, so it can be called from every path that ends a
+        request.
+        """
+        self.acquire()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.release()
+
+        return release
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        self.acquire()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.release()
+
+    async def iterate(self, make_iterator: Callable[..., Iterator[Any]], *args: Any) -> AsyncIterator[Any]:
+        """
+        Drive a blocking iterator in the pool and yield its items on the event loop.
+
+        The caller must hold a slot (acquire()). If the consumer stops early
+        (e.g. client disconnected), the worker stops after its current item.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def produce() -> None:
+            try:
+                for item in make_iterator(*args):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+            await asyncio.shield(future)
+
+
+retrieval_stage = BoundedStage("retrieval", RETRIEVAL_WORKERS, RETRIEVAL_MAX_PENDING)
+generation_stage = BoundedStage("generation", GENERATION_WORKERS, GENERATION_MAX_PENDING)
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that releases a stage slot when the response ends.
+
+    The body generator's own cleanup does not run if it never starts
+    (client gone before the first chunk, or sending the headers fails),
+    so the slot is also released after the whole ASGI call, however it
+    ends.
+    """
+
+    def __init__(self, content: AsyncIterator[str], release: Callable[[], None], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+# -------------------------------
+# 7. Pydantic models
 # -------------------------------
 class QuestionInput(BaseModel):
     question: str
     use_RAG: bool
 
 # -------------------------------
-# 7. Routes
+# 8. Routes
 # -------------------------------
+@app.exception_handler(PoolTimeout)
+async def pool_timeout(request: Request, exc: PoolTimeout) -> Any:
+    """
+    No llama instance became free in time: ask the client to retry.
+    """
+    return JSONResponse(
+        {"detail": "Server busy (generation timed out in queue), try again later"},
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+
+@app.exception_handler(ShardTimeout)
+async def shard_timeout(request: Request, exc: ShardTimeout) -> Any:
+    """
+    Search shards did not answer in time (SEARCH_SHARD_DEGRADE = "fail"): ask the client to retry.
+    """
+    return JSONResponse(
+        {"detail": "Search unavailable (index shards timed out), try again later"},
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+
+@app.on_event("startup")
+async def warm_up() -> None:
+    """
+    Start loading WARM_UP_MODELS in a background thread.
+    """
+    registry.warm_up(WARM_UP_MODELS)
+
+
+@app.get("/ready")
+async def ready() -> Any:
+    """
+    Readiness probe: 200 once READY_MODELS are loaded, 503 before.
+    Includes per-model load state and load times.
+    """
+    is_ready = registry.ready(READY_MODELS)
+    return JSONResponse({"ready": is_ready, "models": registry.status()}, status_code=200 if is_ready else 503)
+
+
+@app.get("/metrics")
+async def metrics() -> Any:
+    """
+    Stage latency percentiles, counters, cache and batching stats,
+    plus the occupancy of the FastAPI worker pools.
+    """
+    payload = metrics_payload()
+    payload["stages_pending"] = {stage.name: stage.pending for stage in (retrieval_stage, generation_stage)}
+    return JSONResponse(payload)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request) -> Any:
     """
@@ -61,14 +253,68 @@ async def ask(data: QuestionInput) -> Any:
     """
     Handle a user question:
         - Parse JSON payload via Pydantic model
-        - Process question using pipeline
+        - Retrieve answers in the retrieval pool
+        - Generate the RAG answer in the generation pool (if requested and not cached)
         - Return formatted JSON response
     """
-    result = process_question(data.dict())
+    context = await retrieval_stage.run(retrieve_answers, data.dict())
+    answer = ""
+    if context.get("cache_hit"):
+        answer = generate_answer(context)  # cached answer: no generation slot needed
+    elif context["use_RAG"]:
+        answer = await generation_stage.run(generate_answer, context)
+    result = await asyncio.get_running_loop().run_in_executor(
+        retrieval_stage.executor, finalize_result, context, answer
+    )
     return JSONResponse({"answer": result})
 
 
+@app.post("/ask_stream")
+async def ask_stream(data: QuestionInput) -> Any:
+    """
+    Handle a user question with Server-Sent Events:
+        - 'links' event right after retrieval
+        - 'token' events while the RAG answer is generated
+        - 'done' event with the final HTML
+    """
+    context = await retrieval_stage.run(retrieve_answers, data.dict())
+    # Reject with 503 before the stream starts (cached answers need no generation slot)
+    generate = context["use_RAG"] and not context.get("cache_hit")
+    release = generation_stage.acquire_slot() if generate else (lambda: None)
+
+    async def events() -> AsyncIterator[str]:
+        answer = ""
+        try:
+            yield format_sse("links", links_payload(context))
+            if generate:
+                try:
+                    async for piece in generation_stage.iterate(stream_answer, context):
+                        answer += piece
+                        yield format_sse("token", {"text": piece})
+                except Exception:
+                    logger.exception("Streaming generation failed")
+                    yield format_sse("error", {"detail": "Generation failed"})
+            elif context.get("cache_hit"):
+                for piece in stream_answer(context):
+                    answer += piece
+                    yield format_sse("token", {"text": piece})
+        finally:
+            release()  # free the slot before formatting the final answer
+
+        result = await asyncio.get_running_loop().run_in_executor(
+            retrieval_stage.executor, finalize_result, context, answer
+        )
+        yield format_sse("done", {"html": result})
+
+    return SlotStreamingResponse(
+        events(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # -------------------------------
-# 8. Run server (only via uvicorn)
+# 9. Run server (only via uvicorn)
 # -------------------------------
 # # uvicorn server_fastapi:app --reload
@@ -13,26 +13,57 @@ logger.info("Server starting...")
 # -------------------------------
 # 2. Standard libraries
 # -------------------------------
-from typing import Any
+from typing import Any, Iterator
 
 # -------------------------------
 # 3. Third-party libraries
 # -------------------------------
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 
 # -------------------------------
 # 4. Local modules
 # -------------------------------
-from pipeline import process_question
+from pipeline import process_question, retrieve_answers, stream_answer, links_payload, finalize_result, metrics_payload
+from formatting import format_sse
+from model_registry import registry
+from llm_pool import PoolTimeout
+from sharded_index import ShardTimeout
 
 # -------------------------------
 # 5. Initialize Flask app
 # -------------------------------
 app = Flask(__name__)
 
+# Models loaded in the background at startup; the rest load on first use
+WARM_UP_MODELS = ["embedder"]
+# Models that must be loaded before /ready reports the server as ready
+READY_MODELS = ["embedder"]
+
+registry.warm_up(WARM_UP_MODELS)
+
+RETRY_AFTER_SECONDS = 1
+
 # -------------------------------
 # 7. Routes
 # -------------------------------
+@app.errorhandler(PoolTimeout)
+def pool_timeout(error: PoolTimeout) -> Any:
+    """
+    No llama instance became free in time: ask the client to retry.
+    """
+    response = jsonify({"detail": "Server busy (generation timed out in queue), try again later"})
+    return response, 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+
+@app.errorhandler(ShardTimeout)
+def shard_timeout(error: ShardTimeout) -> Any:
+    """
+    Search shards did not answer in time (SEARCH_SHARD_DEGRADE = "fail"): ask the client to retry.
+    """
+    response = jsonify({"detail": "Search unavailable (index shards timed out), try again later"})
+    return response, 503, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+
+
 @app.route("/")
 def home() -> str:
     """
@@ -56,6 +87,58 @@ def ask() -> Any:
     return jsonify({"answer": result})
 
 
+@app.route("/ask_stream", methods=["POST"])
+def ask_stream() -> Response:
+    """
+    Handle a user question with Server-Sent Events:
+        - 'links' event right after retrieval
+        - 'token' events while the RAG answer is generated
+        - 'done' event with the final HTML
+    Retrieval runs before the response starts, so its errors (e.g. ShardTimeout)
+    still get their HTTP status.
+    """
+    data = request.json or {}
+    context = retrieve_answers(data)
+
+    def events() -> Iterator[str]:
+        yield format_sse("links", links_payload(context))
+
+        answer = ""
+        try:
+            for piece in stream_answer(context):
+                answer += piece
+                yield format_sse("token", {"text": piece})
+        except Exception:
+            logger.exception("Streaming generation failed")
+            yield format_sse("error", {"detail": "Generation failed"})
+
+        yield format_sse("done", {"html": finalize_result(context, answer)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/ready")
+def ready() -> Any:
+    """
+    Readiness probe: 200 once READY_MODELS are loaded, 503 before.
+    Includes per-model load state and load times.
+    """
+    is_ready = registry.ready(READY_MODELS)
+    return jsonify({"ready": is_ready, "models": registry.status()}), 200 if is_ready else 503
+
+
+@app.route("/metrics")
+def metrics() -> Any:
+    """
+    Stage latency percentiles, counters, cache and batching stats.
+    """
+    return jsonify(metrics_payload())
+
+
 # -------------------------------
 # 8. Run server
 # -------------------------------
@@ -0,0 +1,606 @@
+import os
+import sys
+import json
+import time
+import heapq
+import logging
+import secrets
+import argparse
+import threading
+import subprocess
+from functools import partial
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from multiprocessing.connection import Client, Connection, Listener
+from typing import List, Dict, Any, Callable, Optional, Tuple, Union
+import numpy as np
+
+from embedding_store import load_store
+from vector_search import ExactIndex, dot_scores, normalize_query, inverse_row_norms
+from metrics import metrics
+
+# -------------------------------
+# Configure logger
+# -------------------------------
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# Constants / Config
+# -------------------------------
+SHARD_MANIFEST_TEMPLATE = "data/shards_{model}.json"
+SHARD_FILENAME_TEMPLATE = "data/shard{shard}_{model}.npy"
+
+SHARD_COPY_BLOCK = 65536  # Rows copied per block when writing shard files
+SHARD_AUTHKEY = os.environ.get("RAG_SHARD_AUTHKEY", "").encode()  # Shared secret of remote shard workers
+SHARD_TIMEOUT = 0.5  # Seconds to wait for all shards of one search
+SHARD_DEGRADE = "partial"  # "partial": answer from the shards that replied in time, "fail": raise ShardTimeout
+SHARD_DEGRADE_MODES = ("partial", "fail")
+SHARD_CALLS_PER_SHARD = 8  # Concurrent calls per shard (client threads)
+SHARD_START_TIMEOUT = 60.0  # Seconds a local shard worker may take to start listening
+SHARD_RETRY_INTERVAL = 1.0  # Seconds before a failed or hung shard is probed again (doubles per failure)
+SHARD_RETRY_MAX_INTERVAL = 30.0  # Longest wait between probes of a shard
+
+
+class ShardTimeout(TimeoutError):
+    """Shards did not answer in time (or are down) and partial results are not allowed."""
+
+
+# -------------------------------
+# Build: split the chunk store into shard files
+# -------------------------------
+def build_shards(model_key: str, num_shards: int) -> str:
+    """
+    Split the chunk store into `num_shards` contiguous row ranges, one .npy
+    file each, and write a manifest tying them to the store version.
+
+    Args:
+        model_key (str): Sanitized model name of the store.
+        num_shards (int): Number of shards.
+
+    Returns:
+        str: Path of the written manifest.
+    """
+    matrix, metadata = load_store(model_key)
+    count = matrix.shape[0]
+    bounds = np.linspace(0, count, num_shards + 1).astype(np.int64)
+
+    shards: List[Dict[str, Any]] = []
+    for shard in range(num_shards):
+        start, end = int(bounds[shard]), int(bounds[shard + 1])
+        path = SHARD_FILENAME_TEMPLATE.format(shard=shard, model=model_key)
+        tmp_path = path + ".tmp.npy"
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=matrix.dtype, shape=(end - start, matrix.shape[1]))
+        for block_start in range(start, end, SHARD_COPY_BLOCK):
+            block_end = min(block_start + SHARD_COPY_BLOCK, end)
+            out[block_start - start:block_end - start] = matrix[block_start:block_end]
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+        shards.append({"path": path, "start": start, "count": end - start})
+
+    manifest = {
+        "store_version": metadata.get("version", ""),
+        "normalized": bool(metadata.get("normalized")),
+        "count": count,
+        "shards": shards,
+    }
+    path = SHARD_MANIFEST_TEMPLATE.format(model=model_key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_shard_manifest(model_key: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Load the shard manifest of a store, or None when it is missing or was
+    built from a different store version (metadata None skips the check).
+    """
+    path = SHARD_MANIFEST_TEMPLATE.format(model=model_key)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if metadata is not None and manifest["store_version"] != metadata.get("version", ""):
+        return None
+    return manifest
+
+
+# -------------------------------
+# Shard worker
+# -------------------------------
+def _serve_connection(conn: Connection, index: ExactIndex, info: Dict[str, Any]) -> None:
+    """Answer requests of one client connection until it is closed."""
+    offset = info["start"]
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            if request[0] == "info":
+                conn.send(info)
+                continue
+            if request[0] == "score":
+                _, query, rows = request
+                local = rows - offset
+                scores = dot_scores(index.matrix[local], query)
+                if index.inv_norms is not None:
+                    scores *= index.inv_norms[local]
+                conn.send(scores)
+                continue
+            _, query, k = request
+            start = time.perf_counter()
+            rows, scores = index.search(query, k)
+            conn.send((rows + offset, scores, time.perf_counter() - start))
+
+
+def serve_shard(model_key: str, shard: int, address: Tuple[str, int], authkey: bytes) -> None:
+    """
+    Serve exact search over one shard until the process is stopped.
+
+    The protocol is multiprocessing.connection (pickled tuples over TCP,
+    authenticated with authkey): ("info",) returns the shard description,
+    ("search", query, k) returns (global rows, scores, compute seconds) and
+    ("score", query, rows) the scores of given global rows of this shard.
+    Every client connection gets its own thread; NumPy releases the GIL
+    in the matrix-vector product, so concurrent searches overlap.
+
+    Args:
+        model_key (str): Sanitized model name of the store.
+        shard (int): Shard number in the manifest.
+        address (Tuple[str, int]): Host and port to listen on (port 0 = any free port).
+        authkey (bytes): Shared secret clients must present.
+    """
+    manifest = load_shard_manifest(model_key)
+    if manifest is None:
+        raise FileNotFoundError(f"No shard manifest for {model_key} (build with build_embeddings.py --shards N)")
+    entry = manifest["shards"][shard]
+
+    matrix = np.load(entry["path"], mmap_mode="r")
+    index = ExactIndex(matrix, None if manifest["normalized"] else inverse_row_norms(matrix))
+    info = {"shard": shard, "start": entry["start"], "count": entry["count"], "store_version": manifest["store_version"]}
+
+    with Listener(address, authkey=authkey) as listener:
+        host, port = listener.address
+        print(f"listening {host}:{port}", flush=True)  # read by start_local_shards
+        logger.info(f"Shard {shard} ({entry['count']} rows) listening on {host}:{port}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:  # failed handshake (wrong authkey, port scan, ...)
+                logger.warning(f"Shard {shard}: rejected connection: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, index, info), daemon=True).start()
+
+
+def _exit_with_parent() -> None:
+    """Stop a local shard worker when its parent closes our stdin (exits or crashes)."""
+    sys.stdin.read()
+    os._exit(0)
+
+
+def start_local_shards(model_key: str, num_shards: int) -> Tuple[List[Tuple[str, int]], bytes, List[subprocess.Popen]]:
+    """
+    Start one worker process per shard on this machine.
+
+    Workers are started with the same command as remote ones, listen on
+    free localhost ports and get a fresh random authkey; they exit when
+    this process does.
+
+    Returns:
+        Tuple: (worker addresses, authkey, processes).
+    """
+    authkey = secrets.token_hex(16).encode()
+    env = dict(os.environ, RAG_SHARD_AUTHKEY=authkey.decode())
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", model_key, str(shard),
+             "--host", "127.0.0.1", "--port", "0", "--exit-with-parent"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True
+        )
+        for shard in range(num_shards)
+    ]
+
+    addresses: List[Tuple[str, int]] = []
+    for shard, process in enumerate(processes):
+        line = _read_line(process, SHARD_START_TIMEOUT)
+        if not line.startswith("listening "):
+            for other in processes:
+                other.kill()
+            raise RuntimeError(f"Shard worker {shard} failed to start (exit code {process.poll()})")
+        host, port = line.split()[1].rsplit(":", 1)
+        addresses.append((host, int(port)))
+    return addresses, authkey, processes
+
+
+def _read_line(process: subprocess.Popen, timeout: float) -> str:
+    """First stdout line of a process, or '' if it exits or times out first."""
+    lines: List[str] = []
+    reader = threading.Thread(target=lambda: lines.append(process.stdout.readline()), daemon=True)
+    reader.start()
+    reader.join(timeout)
+    return lines[0].strip() if lines else ""
+
+
+# -------------------------------
+# Scatter-gather client
+# -------------------------------
+class ShardClient:
+    """
+    Connections to one shard worker, reused between searches.
+
+    Each call holds its own connection from request to reply, so a reply
+    that arrives after the search deadline is still read by the call it
+    belongs to and the connection stays usable. While such a late call
+    is outstanding the shard counts as slow (see `late`).
+
+    A shard that failed or timed out is skipped until `retry_at`; then one
+    search is let through as a probe (on a new connection). Every further
+    failure doubles the wait up to SHARD_RETRY_MAX_INTERVAL, and a
+    successful reply (a late one too) makes the shard healthy again.
+    """
+
+    def __init__(self, shard: int, address: Tuple[str, int], authkey: bytes):
+        self.shard = shard
+        self.address = address
+        self.authkey = authkey
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+
+        self.late = 0  # Calls past their search deadline that have not returned yet
+        self.failures = 0  # Consecutive errors and timeouts
+        self.retry_at = 0.0  # time.monotonic() from which the next probe may be sent
+        self.calls = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.probes = 0
+        self.errors = 0
+        self.compute_seconds = 0.0
+
+    def call(self, request: Tuple[Any, ...]) -> Any:
+        """Send one request and wait for its reply (connects if no idle connection)."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send(request)
+            reply = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        with self._lock:
+            self._idle.append(conn)
+        return reply
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        start = time.perf_counter()
+        rows, scores, compute_seconds = self.call(("search", q, k))
+        metrics.observe(f"shard_{self.shard}", time.perf_counter() - start)
+        with self._lock:
+            self.calls += 1
+            self.compute_seconds += compute_seconds
+        return rows, scores
+
+    def score(self, q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        start = time.perf_counter()
+        scores = self.call(("score", q, rows))
+        metrics.observe(f"shard_{self.shard}", time.perf_counter() - start)
+        return scores
+
+    def info(self) -> Dict[str, Any]:
+        return self.call(("info",))
+
+    def available(self) -> bool:
+        """
+        Whether a search should be sent to this shard now (counts skips and probes).
+
+        A shard with a late call or recent failures is skipped until
+        `retry_at`, then probed by one search; a shard with a late call on
+        every one of its threads is never probed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.late or self.failures:
+                if now < self.retry_at or self.late >= SHARD_CALLS_PER_SHARD:
+                    self.skipped += 1
+                    return False
+                self.probes += 1
+                self.retry_at = now + self._retry_interval()
+            return True
+
+    def _retry_interval(self) -> float:
+        return min(SHARD_RETRY_INTERVAL * 2 ** max(self.failures - 1, 0), SHARD_RETRY_MAX_INTERVAL)
+
+    def _failed(self) -> None:
+        self.failures += 1
+        self.retry_at = time.monotonic() + self._retry_interval()
+
+    def mark_ok(self) -> None:
+        with self._lock:
+            self.failures = 0
+
+    def mark_late(self, future: Future) -> None:
+        """Count a call that missed its deadline until it returns."""
+        with self._lock:
+            self.late += 1
+            self.timeouts += 1
+            self._failed()
+        future.add_done_callback(self._late_done)
+
+    def _late_done(self, future: Future) -> None:
+        with self._lock:
+            self.late -= 1
+            if not future.cancelled() and future.exception() is None:
+                self.failures = 0  # slow but alive
+
+    def mark_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+            self._failed()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "address": f"{self.address[0]}:{self.address[1]}",
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "skipped": self.skipped,
+                "probes": self.probes,
+                "errors": self.errors,
+                "late": self.late,
+                "mean_compute_ms": round(self.compute_seconds / self.calls * 1000, 3) if self.calls else 0.0,
+            }
+
+
+class ShardedIndex:
+    """
+    Exact search fanned out to shard workers, results merged with a heap.
+
+    Every search submits one call per shard to a thread pool and waits for
+    all of them up to `timeout`, so shards search in parallel (separate
+    processes, or separate machines). Each shard returns its own sorted
+    top-k; heapq.merge() yields the global top-k without re-sorting.
+    Round trips are recorded per shard as 'shard_<n>' stages in metrics.
+
+    A shard that misses the deadline (or is down) is left out: with
+    degrade="partial" the search answers from the shards that replied and
+    counts 'shard_partial_results'; with degrade="fail" it raises
+    ShardTimeout. Any exception of a shard call (connection, authentication,
+    pickling) counts as that shard being down. Hung and failing shards are
+    skipped by later searches and probed with backoff (see ShardClient),
+    so a hung worker costs one blocked thread per probe rather than one
+    per search, and a restarted worker is picked up again.
+
+    row_scores() scores given rows on the shards holding them (the dense
+    side of weighted fusion), so the server needs no copy of the matrix.
+    """
+
+    name = "sharded"
+
+    def __init__(
+        self,
+        addresses: List[Tuple[str, int]],
+        authkey: bytes,
+        timeout: float = SHARD_TIMEOUT,
+        degrade: str = SHARD_DEGRADE,
+        processes: Optional[List[subprocess.Popen]] = None,
+        starts: Optional[List[int]] = None
+    ):
+        if degrade not in SHARD_DEGRADE_MODES:
+            raise ValueError(f"Unknown degrade mode '{degrade}', expected one of {SHARD_DEGRADE_MODES}")
+        self.clients = [ShardClient(shard, address, authkey) for shard, address in enumerate(addresses)]
+        self.starts = np.asarray(starts if starts is not None else [], dtype=np.int64)  # First row of every shard
+        self.timeout = timeout
+        self.degrade = degrade
+        self.processes = processes or []
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.clients) * SHARD_CALLS_PER_SHARD, thread_name_prefix="shard"
+        )
+
+    def _gather(self, calls: Dict[ShardClient, Callable[[], Any]]) -> Dict[ShardClient, Any]:
+        """
+        Run one call per shard in parallel and collect the replies in time.
+
+        Returns:
+            Dict[ShardClient, Any]: Reply of every shard that answered.
+        """
+        # Scatter (hung or failing shards are skipped until their next probe)
+        futures: Dict[Future, ShardClient] = {}
+        for client, call in calls.items():
+            if client.available():
+                futures[self._executor.submit(call)] = client
+
+        # Gather until every shard answered or the deadline passed
+        done, not_done = wait_futures(futures, timeout=self.timeout)
+        replies: Dict[ShardClient, Any] = {}
+        for future in done:
+            client = futures[future]
+            try:
+                replies[client] = future.result()
+            except Exception as e:  # connection, authentication and (un)pickling errors alike
+                client.mark_error()
+                logger.warning(f"Shard {client.shard} failed: {e!r}")
+            else:
+                client.mark_ok()
+        for future in not_done:
+            futures[future].mark_late(future)
+
+        missing = len(calls) - len(replies)
+        if missing:
+            if self.degrade == "fail" or not replies:
+                raise ShardTimeout(f"{missing} of {len(calls)} shards too slow (timeout {self.timeout} s) or down")
+            metrics.inc("shard_partial_results")
+            logger.warning(f"Got {len(replies)} of {len(calls)} shards ({missing} too slow or down)")
+        return replies
+
+    def search(self, query_emb: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        q = normalize_query(query_emb)
+        results = self._gather({client: partial(client.search, q, k) for client in self.clients}).values()
+
+        # Merge the per-shard top-k lists (each sorted descending)
+        merged = list(islice(heapq.merge(
+            *(zip(scores.tolist(), rows.tolist()) for rows, scores in results), reverse=True
+        ), k))
+        return (
+            np.array([row for _, row in merged], dtype=np.int64),
+            np.array([score for score, _ in merged], dtype=np.float32)
+        )
+
+    def row_scores(self, query_emb: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        Cosine scores of given global rows, computed by the shards holding them.
+
+        Rows of shards that did not answer in time score 0 (degrade="partial").
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros(len(rows), dtype=np.float32)
+        if not len(rows):
+            return scores
+
+        q = normalize_query(query_emb)
+        owners = np.searchsorted(self.starts, rows, side="right") - 1
+        positions = {shard: np.flatnonzero(owners == shard) for shard in np.unique(owners).tolist()}
+        replies = self._gather({
+            self.clients[shard]: partial(self.clients[shard].score, q, rows[members])
+            for shard, members in positions.items()
+        })
+        for client, shard_scores in replies.items():
+            scores[positions[client.shard]] = shard_scores
+        return scores
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-shard call, timeout and error counts."""
+        return {
+            "timeout_seconds": self.timeout,
+            "degrade": self.degrade,
+            "shards": [client.stats() for client in self.clients],
+        }
+
+    def close(self) -> None:
+        """Stop the local shard workers started for this index."""
+        for process in self.processes:
+            process.terminate()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_address(value: str) -> Tuple[str, int]:
+    """'host:port' -> (host, port)."""
+    host, port = value.rsplit(":", 1)
+    return host, int(port)
+
+
+def load_sharded_index(
+    model_key: str,
+    metadata: Dict[str, Any],
+    shards: Union[str, List[str]],
+    timeout: float = SHARD_TIMEOUT,
+    degrade: str = SHARD_DEGRADE
+) -> Optional[ShardedIndex]:
+    """
+    Connect to the shard workers of a store, or None when the shards were
+    built from a different store version.
+
+    Args:
+        model_key (str): Sanitized model name of the store.
+        metadata (Dict): Store metadata (for the version check).
+        shards (str | List[str]): "local" to start one worker process per
+            shard here, or the "host:port" addresses of running workers
+            (in shard order, started with `sharded_index.py serve`).
+        timeout (float): Seconds to wait for all shards of one search.
+        degrade (str): Behaviour when shards are late, one of SHARD_DEGRADE_MODES.
+
+    Returns:
+        ShardedIndex or None.
+    """
+    manifest = load_shard_manifest(model_key, metadata)
+    if manifest is None:
+        return None
+
+    processes: List[subprocess.Popen] = []
+    if shards == "local":
+        addresses, authkey, processes = start_local_shards(model_key, len(manifest["shards"]))
+    else:
+        addresses, authkey = [parse_address(value) for value in shards], SHARD_AUTHKEY
+        if len(addresses) != len(manifest["shards"]):
+            raise ValueError(f"Got {len(addresses)} shard addresses for {len(manifest['shards'])} shards")
+
+    index = ShardedIndex(
+        addresses, authkey, timeout=timeout, degrade=degrade, processes=processes,
+        starts=[entry["start"] for entry in manifest["shards"]]
+    )
+
+    # Remote workers may serve files of another build: check before searching
+    for client in index.clients:
+        info = client.info()
+        if info["shard"] != client.shard or info["store_version"] != manifest["store_version"]:
+            logger.warning(f"Shard worker at {client.stats()['address']} serves shard {info['shard']} "
+                           f"of store {info['store_version']}, expected shard {client.shard} of {manifest['store_version']}")
+            index.close()
+            return None
+    return index
+
+
+# -------------------------------
+# Command line interface
+# -------------------------------
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run a shard worker, or compare sharded against in-process search."""
+    parser = argparse.ArgumentParser(description="Shard workers for scatter-gather search.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Serve one shard (authkey from RAG_SHARD_AUTHKEY)")
+    serve.add_argument("model_key", help="Sanitized model name, e.g. intfloat-multilingual-e5-base")
+    serve.add_argument("shard", type=int, help="Shard number")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=0, help="Port to listen on (0 = any free port)")
+    serve.add_argument("--exit-with-parent", action="store_true", help=argparse.SUPPRESS)
+
+    bench = commands.add_parser("bench", help="Latency and agreement of local shards against exact search")
+    bench.add_argument("model_key", help="Sanitized model name, e.g. intfloat-multilingual-e5-base")
+    bench.add_argument("--k", type=int, default=50, help="Results compared per query")
+    bench.add_argument("--queries", type=int, default=200, help="Corpus rows sampled as queries")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        logging.basicConfig(level=logging.INFO)
+        if not SHARD_AUTHKEY:
+            parser.error("set RAG_SHARD_AUTHKEY to the secret shared with the search servers")
+        if args.exit_with_parent:
+            threading.Thread(target=_exit_with_parent, daemon=True).start()
+        serve_shard(args.model_key, args.shard, (args.host, args.port), SHARD_AUTHKEY)
+        return
+
+    matrix, metadata = load_store(args.model_key)
+    index = load_sharded_index(args.model_key, metadata, "local", timeout=SHARD_START_TIMEOUT)
+    if index is None:
+        parser.error("no up-to-date shards for this store (build with build_embeddings.py --shards N)")
+    exact = ExactIndex(matrix, None if metadata.get("normalized") else inverse_row_norms(matrix))
+
+    rng = np.random.default_rng(0)
+    queries = np.asarray(matrix[np.sort(rng.choice(matrix.shape[0], min(args.queries, matrix.shape[0]), replace=False))],
+                         dtype=np.float32)
+    try:
+        timings = {}
+        for backend in (exact, index):
+            start = time.perf_counter()
+            found = [backend.search(q, args.k)[0] for q in queries]
+            timings[backend.name] = ((time.perf_counter() - start) * 1000 / len(queries), found)
+        agreement = np.mean([np.array_equal(a, b) for a, b in zip(timings["exact"][1], timings["sharded"][1])])
+        print(json.dumps({
+            "rows": matrix.shape[0],
+            "shards": len(index.clients),
+            "exact_ms": round(timings["exact"][0], 3),
+            "sharded_ms": round(timings["sharded"][0], 3),
+            "identical_results": round(float(agreement), 4),
+            "stats": index.stats(),
+        }, indent=2))
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# Modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# -------------------------------
+# Synthetic corpus (fixed seed)
+# -------------------------------
+CORPUS_ROWS = 5000
+CORPUS_DIM = 64
+CORPUS_CLUSTERS = 50
+QUERY_COUNT = 100
+QUERY_NOISE = 0.05
+
+
+@pytest.fixture(scope="session")
+def corpus() -> np.ndarray:
+    """Unit-length rows around CORPUS_CLUSTERS centers, like topic clusters of real chunks."""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(CORPUS_CLUSTERS, CORPUS_DIM))
+    matrix = centers[rng.integers(CORPUS_CLUSTERS, size=CORPUS_ROWS)] + 0.5 * rng.normal(size=(CORPUS_ROWS, CORPUS_DIM))
+    matrix = matrix.astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="session")
+def queries(corpus: np.ndarray) -> np.ndarray:
+    """Corpus rows with a little noise, so every query has near neighbours."""
+    rng = np.random.default_rng(1)
+    rows = rng.choice(corpus.shape[0], QUERY_COUNT, replace=False)
+    return (corpus[rows] + QUERY_NOISE * rng.normal(size=(QUERY_COUNT, CORPUS_DIM))).astype(np.float32)
@@ -0,0 +1,49 @@
+import json
+from typing import Any, Dict, List
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from benchmark import StandInEncoder
+from build_embeddings import assign_stable_ids, build_index
+from embedding_store import load_store
+
+
+def make_pairs(questions: List[str]) -> List[Dict[str, Any]]:
+    return [
+        {"id": n, "question": question, "link": None, "answer": f"answer about {question} " * 5}
+        for n, question in enumerate(questions)
+    ]
+
+
+def test_assign_stable_ids_keeps_ids_of_known_questions():
+    previous = [{"id": 0, "question": "a"}, {"id": 1, "question": "b"}, {"id": 2, "question": "c"}]
+    pairs = [{"question": q} for q in ("x", "a", "c", "a")]
+    assign_stable_ids(pairs, previous)
+    # Known questions keep their ids, new ones (and a new duplicate) get ids above the old maximum
+    assert [pair["id"] for pair in pairs] == [3, 0, 2, 4]
+
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_ids_are_stable_across_rebuilds(tmp_path, monkeypatch, incremental):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    encoder = StandInEncoder(dim=32)
+    options = dict(incremental=incremental, quantize=(), model=encoder)
+
+    build_index("m", make_pairs(["alpha", "beta", "gamma"]), **options)
+    with open("data/raw_m.json", "r", encoding="utf-8") as f:
+        before = {pair["question"]: pair["id"] for pair in json.load(f)}
+
+    # Insert a question at the front and drop one: positions shift, ids must not
+    build_index("m", make_pairs(["delta", "alpha", "gamma"]), **options)
+    _, metadata = load_store("m")
+    with open("data/raw_m.json", "r", encoding="utf-8") as f:
+        after = {pair["question"]: pair["id"] for pair in json.load(f)}
+
+    assert after["alpha"] == before["alpha"] and after["gamma"] == before["gamma"]
+    assert after["delta"] not in before.values()
+    # Chunks point at the ids of their own questions
+    ids_by_question = {f"{qid:04d}": question for question, qid in after.items()}
+    for chunk in metadata["chunks"]:
+        assert ids_by_question[chunk["question_id"]] in chunk["chunk_text"]
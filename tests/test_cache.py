@@ -0,0 +1,80 @@
+import numpy as np
+
+from cache import LRUCache, SemanticCache
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+# -------------------------------
+# LRUCache
+# -------------------------------
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_evicts_by_bytes():
+    cache = LRUCache(max_entries=100, max_bytes=10, sizeof=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "yyyy")
+    cache.put("c", "zzzz")  # 12 bytes: "a" goes
+    assert cache.get("a") is None
+    assert cache.bytes == 8
+    cache.put("big", "x" * 11)  # larger than the whole cache: not stored, nothing evicted
+    assert cache.get("big") is None
+    assert len(cache) == 2
+
+
+def test_lru_replace_keeps_byte_count():
+    cache = LRUCache(max_entries=10, sizeof=len)
+    cache.put("a", "xx")
+    cache.put("a", "xxxxx")
+    assert cache.get("a") == "xxxxx"
+    assert cache.bytes == 5
+
+
+# -------------------------------
+# SemanticCache
+# -------------------------------
+def test_semantic_hit_needs_threshold_and_scope():
+    cache = SemanticCache(max_entries=4, threshold=0.95)
+    cache.use_version("v1")
+    cache.put(unit(1, 0, 0), ("rag",), "answer")
+    assert cache.lookup(unit(1, 0.1, 0), ("rag",))[0] == "answer"  # cosine 0.995
+    assert cache.lookup(unit(1, 1, 0), ("rag",))[0] is None  # cosine 0.71
+    assert cache.lookup(unit(1, 0, 0), ("other",))[0] is None
+
+
+def test_semantic_evicts_least_recently_used():
+    cache = SemanticCache(max_entries=2, threshold=0.99)
+    cache.use_version("v1")
+    cache.put(unit(1, 0, 0), "s", "x")
+    cache.put(unit(0, 1, 0), "s", "y")
+    assert cache.lookup(unit(1, 0, 0), "s")[0] == "x"  # "y" is now the least recently used
+    cache.put(unit(0, 0, 1), "s", "z")
+    assert cache.lookup(unit(0, 1, 0), "s")[0] is None
+    assert cache.lookup(unit(1, 0, 0), "s")[0] == "x"
+    assert cache.lookup(unit(0, 0, 1), "s")[0] == "z"
+    assert len(cache) == 2 and cache.stats()["evictions"] == 1
+
+
+def test_semantic_version_change_drops_entries():
+    cache = SemanticCache(max_entries=4, threshold=0.95)
+    cache.use_version("v1")
+    cache.put(unit(1, 0), "s", "old")
+    cache.use_version("v1")
+    assert cache.lookup(unit(1, 0), "s")[0] == "old"
+    cache.use_version("v2")
+    assert len(cache) == 0
+    assert cache.lookup(unit(1, 0), "s")[0] is None
+    cache.put(unit(1, 0), "s", "new")
+    assert cache.lookup(unit(1, 0), "s")[0] == "new"
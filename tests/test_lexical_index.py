@@ -0,0 +1,69 @@
+import numpy as np
+
+from lexical_index import BM25Index, fuse_rrf, fuse_weighted
+
+
+def rows_and_scores(rows, scores):
+    return np.array(rows, dtype=np.int64), np.array(scores, dtype=np.float32)
+
+
+def test_bm25_finds_codes_and_unicode_terms():
+    texts = [
+        "printer shows error 0x80070005 after update",
+        "принтер не печатает",
+        "reset the router and wait",
+        "error codes of the router",
+    ]
+    index = BM25Index.build(texts, store_version="v1")
+    assert index.search("0x80070005", 2)[0].tolist() == [0]
+    assert index.search("принтер", 2)[0].tolist() == [1]
+    assert index.search("router error", 1)[0].tolist() == [3]
+    assert len(index.search("unknownterm", 2)[0]) == 0
+
+
+def test_bm25_save_load(tmp_path):
+    texts = ["alpha beta", "beta gamma", "gamma delta épsilon"]
+    index = BM25Index.build(texts, store_version="v1")
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.store_version == "v1"
+    for query in ("beta", "gamma épsilon", "delta"):
+        np.testing.assert_array_equal(loaded.search(query, 3)[0], index.search(query, 3)[0])
+
+
+def test_fuse_rrf_prefers_rows_in_both_lists():
+    dense = rows_and_scores([10, 11, 12], [0.9, 0.8, 0.7])
+    lexical = rows_and_scores([12, 20], [5.0, 4.0])
+    rows, scores = fuse_rrf(dense, lexical)
+    # 12 is third densely but first lexically: the only row in both lists
+    assert rows[0] == 12
+    assert rows[1] == 10
+    # Second place in either list scores the same
+    assert set(rows.tolist()[2:]) == {11, 20}
+    assert scores[2] == scores[3]
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_fuse_weighted_adds_scaled_bm25_bonus():
+    dense = rows_and_scores([1, 2], [0.80, 0.75])
+    lexical = rows_and_scores([2, 3], [10.0, 5.0])
+    scored = []
+
+    def dense_scores(rows):
+        scored.append(rows.tolist())
+        return np.full(len(rows), 0.5, dtype=np.float32)
+
+    rows, scores = fuse_weighted(dense, lexical, dense_scores, weight=0.1)
+    # Only the lexical-only row is scored densely
+    assert scored == [[3]]
+    # 2: 0.75 + 0.1 (best BM25 hit) overtakes 1: 0.80; 3: 0.5 + 0.05
+    assert rows.tolist() == [2, 1, 3]
+    np.testing.assert_allclose(scores, [0.85, 0.80, 0.55], rtol=1e-6)
+
+
+def test_fuse_weighted_without_lexical_hits_keeps_dense_order():
+    dense = rows_and_scores([4, 5], [0.7, 0.6])
+    rows, scores = fuse_weighted(dense, rows_and_scores([], []), lambda rows: np.zeros(len(rows)), weight=0.1)
+    assert rows.tolist() == [4, 5]
+    np.testing.assert_allclose(scores, [0.7, 0.6])
@@ -0,0 +1,56 @@
+from typing import List, Set
+import numpy as np
+import pytest
+
+from vector_search import ExactIndex
+from ann_index import IVFIndex
+from quantized_index import QuantizedIndex, popcount_rows, _POPCOUNT_TABLE
+
+K = 10
+
+
+def exact_truth(corpus: np.ndarray, queries: np.ndarray) -> List[Set[int]]:
+    exact = ExactIndex(corpus)
+    return [set(exact.search(q, K)[0].tolist()) for q in queries]
+
+
+def recall(index, queries: np.ndarray, truth: List[Set[int]], **kwargs) -> float:
+    found = [index.search(q, K, **kwargs)[0] for q in queries]
+    return float(np.mean([len(t.intersection(rows.tolist())) / K for t, rows in zip(truth, found)]))
+
+
+@pytest.mark.parametrize("mode, rescore, min_recall", [("int8", 50, 0.99), ("binary", 200, 0.95)])
+def test_quantized_recall(corpus, queries, mode, rescore, min_recall):
+    index = QuantizedIndex.build(corpus, mode).attach(corpus)
+    assert recall(index, queries, exact_truth(corpus, queries), rescore=rescore) >= min_recall
+
+
+def test_quantized_scores_are_exact_after_rescoring(corpus, queries):
+    index = QuantizedIndex.build(corpus, "binary").attach(corpus)
+    rows, scores = index.search(queries[0], K)
+    q = queries[0] / np.linalg.norm(queries[0])
+    np.testing.assert_allclose(scores, corpus[rows] @ q, rtol=1e-5)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_quantized_save_load(tmp_path, corpus, queries):
+    index = QuantizedIndex.build(corpus, "int8", store_version="v1")
+    path = str(tmp_path / "int8.npz")
+    index.save(path)
+    loaded = QuantizedIndex.load(path).attach(corpus)
+    assert loaded.store_version == "v1"
+    np.testing.assert_array_equal(loaded.search(queries[0], K)[0], index.attach(corpus).search(queries[0], K)[0])
+
+
+def test_popcount_lookup_matches_unpackbits():
+    bits = np.random.default_rng(2).integers(0, 256, size=(64, 48), dtype=np.uint8)
+    expected = np.unpackbits(bits, axis=1).sum(axis=1)
+    np.testing.assert_array_equal(popcount_rows(bits), expected)
+    np.testing.assert_array_equal(_POPCOUNT_TABLE[bits].sum(axis=1), expected)
+
+
+def test_ivf_recall(corpus, queries):
+    index = IVFIndex.build(corpus, store_version="v1").attach(corpus)
+    truth = exact_truth(corpus, queries)
+    assert recall(index, queries, truth, nprobe=16) >= 0.95
+    assert recall(index, queries, truth, nprobe=index.n_lists) == 1.0
@@ -0,0 +1,113 @@
+import os
+import signal
+import time
+from contextlib import contextmanager
+from typing import Iterator
+import numpy as np
+import pytest
+
+from embedding_store import save_store, load_store
+from vector_search import ExactIndex
+from sharded_index import ShardedIndex, ShardTimeout, build_shards, load_sharded_index
+import sharded_index
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, "SIGSTOP"), reason="needs SIGSTOP to hang a shard worker")
+
+SHARD_ROWS = 2000
+K = 10
+TIMEOUT = 0.3
+
+
+@pytest.fixture(scope="module")
+def sharded(tmp_path_factory, corpus):
+    """Two local shard workers over the first SHARD_ROWS corpus rows, and the matching exact index."""
+    matrix = corpus[:SHARD_ROWS]
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("shards"))
+    try:
+        os.makedirs("data")
+        save_store("m", "m", matrix, [{"question_id": f"{row:04d}"} for row in range(SHARD_ROWS)], normalized=True)
+        build_shards("m", 2)
+        _, metadata = load_store("m")
+        index = load_sharded_index("m", metadata, "local", timeout=TIMEOUT)
+    finally:
+        os.chdir(cwd)
+    yield index, ExactIndex(matrix)
+    index.close()
+
+
+@contextmanager
+def stopped(index: ShardedIndex, shard: int) -> Iterator[None]:
+    """Hang one shard worker, then resume it and wait until its late calls returned."""
+    pid = index.processes[shard].pid
+    os.kill(pid, signal.SIGSTOP)
+    try:
+        yield
+    finally:
+        os.kill(pid, signal.SIGCONT)
+        deadline = time.monotonic() + 10
+        while index.clients[shard].late and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def test_all_shards_match_exact_search(sharded, queries):
+    index, exact = sharded
+    for q in queries[:20]:
+        rows, scores = index.search(q, K)
+        expected_rows, expected_scores = exact.search(q, K)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_row_scores_come_from_owning_shards(sharded, queries):
+    index, exact = sharded
+    rows = np.array([0, 5, SHARD_ROWS // 2 + 1, SHARD_ROWS - 1])
+    q = queries[0] / np.linalg.norm(queries[0])
+    np.testing.assert_allclose(index.row_scores(queries[0], rows), exact.matrix[rows] @ q, rtol=1e-5)
+
+
+def test_hung_shard_gives_partial_results(sharded, queries, monkeypatch):
+    index, exact = sharded
+    monkeypatch.setattr(sharded_index, "SHARD_RETRY_INTERVAL", 60.0)
+    q = queries[1]
+    first_rows = index.starts[1]
+    with stopped(index, 1):
+        rows, scores = index.search(q, K)
+        # Exactly the top-k of the shard that answered
+        local_rows, local_scores = ExactIndex(exact.matrix[:first_rows]).search(q, K)
+        np.testing.assert_array_equal(rows, local_rows)
+        assert index.clients[1].stats()["timeouts"] == 1
+
+        # While the call is outstanding the shard is skipped without waiting
+        start = time.perf_counter()
+        index.search(q, K)
+        assert time.perf_counter() - start < TIMEOUT
+        assert index.clients[1].stats()["skipped"] >= 1
+
+    # The late reply makes the shard healthy again
+    np.testing.assert_array_equal(index.search(q, K)[0], exact.search(q, K)[0])
+
+
+def test_fail_mode_raises_on_hung_shard(sharded, queries):
+    index, _ = sharded
+    strict = ShardedIndex(
+        [client.address for client in index.clients], index.clients[0].authkey,
+        timeout=TIMEOUT, degrade="fail", starts=index.starts.tolist()
+    )
+    try:
+        with stopped(index, 0):
+            with pytest.raises(ShardTimeout):
+                strict.search(queries[2], K)
+    finally:
+        strict.close()
+
+
+def test_shard_errors_count_as_down(sharded, queries):
+    index, _ = sharded
+    wrong_key = ShardedIndex([client.address for client in index.clients], b"wrong", timeout=TIMEOUT)
+    try:
+        with pytest.raises(ShardTimeout):
+            wrong_key.search(queries[3], K)
+        assert [client.stats()["errors"] for client in wrong_key.clients] == [1, 1]
+    finally:
+        wrong_key.close()
@@ -0,0 +1,26 @@
+import re
+import string
+from typing import Tuple
+
+
+# -------------------------------
+# Text preprocessing
+# -------------------------------
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, remove punctuation, normalize whitespace.
+    """
+    text = text.lower()
+    text = text.translate(str.maketrans("", "", string.punctuation))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def code_terms(text: str) -> Tuple[str, ...]:
+    """
+    Words of normalize_text(text) that contain a digit (error codes, product
+    and version numbers), sorted and deduplicated.
+
+    Embeddings barely separate questions that differ only in such a term,
+    so callers that match questions by similarity also compare these.
+    """
+    return tuple(sorted({word for word in normalize_text(text).split() if any(c.isdigit() for c in word)}))
@@ -0,0 +1,159 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+# -------------------------------
+# Constants
+# -------------------------------
+SCORE_BLOCK_ROWS = 65536  # Rows converted to float32 at a time for non-float32 matrices
+
+
+# -------------------------------
+# Normalization
+# -------------------------------
+def normalize_query(query_emb: np.ndarray) -> np.ndarray:
+    """
+    Return the query embedding as a unit-length float32 vector.
+    """
+    q = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(q)
+    return q / norm if norm > 0 else q
+
+
+def inverse_row_norms(matrix: np.ndarray, block_rows: int = SCORE_BLOCK_ROWS) -> np.ndarray:
+    """
+    Compute 1 / ||row|| for every row (0 for zero rows), block by block.
+
+    Used for stores that were written without normalization, so dot
+    products can be turned into cosine scores without copying the matrix.
+    """
+    inv_norms = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1)
+        inv_norms[start:start + block_rows] = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return inv_norms
+
+
+# -------------------------------
+# Scoring
+# -------------------------------
+def dot_scores(matrix: np.ndarray, q: np.ndarray, block_rows: int = SCORE_BLOCK_ROWS) -> np.ndarray:
+    """
+    Score every row of the matrix against a float32 query vector.
+
+    float32 matrices go through a single BLAS matrix-vector product;
+    other dtypes (e.g. float16) are upcast block by block, since NumPy has
+    no fast half-precision matmul.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ q
+
+    scores = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        scores[start:start + block_rows] = block @ q
+    return scores
+
+
+def cosine_scores(matrix: np.ndarray, query_emb: np.ndarray, inv_norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Cosine similarity of the query against every row.
+
+    Args:
+        matrix (np.ndarray): Corpus matrix (rows unit-length unless inv_norms is given).
+        query_emb (np.ndarray): Query embedding of shape (dim,) or (1, dim).
+        inv_norms (np.ndarray, optional): Precomputed inverse row norms.
+
+    Returns:
+        np.ndarray: float32 scores of shape (n_rows,).
+    """
+    scores = dot_scores(matrix, normalize_query(query_emb))
+    if inv_norms is not None:
+        scores *= inv_norms
+    return scores
+
+
+# -------------------------------
+# Top-k selection
+# -------------------------------
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, sorted by score descending.
+
+    Uses argpartition (linear time) and sorts only the selected slice.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return (indices, scores) of the k highest scores, best first.
+    """
+    idxs = top_k_indices(scores, k)
+    return idxs, scores[idxs]
+
+
+# -------------------------------
+# Per-question grouping
+# -------------------------------
+def group_hits(
+    hit_groups: np.ndarray,
+    hit_scores: np.ndarray,
+    top_groups: int,
+    per_group: int
+) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+    """
+    Group score-sorted hits by an integer key (question id) with NumPy segment ops.
+
+    Args:
+        hit_groups (np.ndarray): Group id of every hit.
+        hit_scores (np.ndarray): Hit scores, sorted descending.
+        top_groups (int): Number of best groups to return.
+        per_group (int): Maximum hits kept per group.
+
+    Returns:
+        Tuple: (group ids, best score per group, hit positions per group),
+        groups ordered by best score descending, positions best first.
+    """
+    if len(hit_groups) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), []
+
+    # A stable sort by group keeps the descending score order inside each group,
+    # so the first hit of a segment is its maximum
+    order = np.argsort(hit_groups, kind="stable")
+    sorted_groups = hit_groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+
+    best = top_k_indices(hit_scores[order[starts]], top_groups)
+    members = [order[starts[g]:starts[g] + min(sizes[g], per_group)] for g in best]
+    return sorted_groups[starts[best]], hit_scores[order[starts[best]]], members
+
+
+# -------------------------------
+# Exact (brute-force) index
+# -------------------------------
+class ExactIndex:
+    """
+    Brute-force cosine search over the whole corpus matrix.
+
+    All index backends expose the same search(query_emb, k) method
+    returning (row_indices, scores) sorted by score descending.
+    """
+
+    name = "exact"
+
+    def __init__(self, matrix: np.ndarray, inv_norms: Optional[np.ndarray] = None):
+        self.matrix = matrix
+        self.inv_norms = inv_norms
+
+    def search(self, query_emb: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = cosine_scores(self.matrix, query_emb, self.inv_norms)
+        return top_k(scores, k)